@@ -13,28 +13,90 @@ Key differences from Kimi:
 1. No need to hover citations to reveal hrefs
 2. Different message container structure (div.dad65929 > div.ds-message)
 3. Direct web search panel access
+
+Tasks (one per *_input_prompts.txt) run back to back without pausing;
+set INTERACTIVE_BETWEEN_TASKS=1 to wait for Enter after each task.
 """
 from camoufox.sync_api import Camoufox
-from scrapy.http import HtmlResponse
-from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from html.parser import HTMLParser
 import time
 import os
+import re
 import json
 import random
 import argparse
 import sys
 import subprocess
-from screeninfo import get_monitors
+import atexit
+import functools
+import hashlib
+import itertools
+import logging
+import logging.handlers
+import multiprocessing
+import queue
+import threading
+
+try:
+    import orjson  # optional: faster (de)serialization of session files / NDJSON
+except ImportError:
+    orjson = None
 
 
 DEEPSEEK_HOME_URL = "https://chat.deepseek.com/"
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_number(name: str, default, cast=int):
+    """Parse a numeric env var; malformed values fall back to ``default``."""
+    value = os.environ.get(name, "").strip()
+    if not value:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        print(f"[WARN] Invalid {name}={value!r}, using {default}")
+        return default
+
+
+# Number of concurrent browser workers. Playwright's sync API is bound to the
+# thread that created it, so every worker owns its own Camoufox window.
+DEEPSEEK_PARALLELISM = max(1, _env_number("DEEPSEEK_PARALLELISM", 1))
+
+
+# FAST_NEW_CONVERSATION (default on): new chats only wait for DOMContentLoaded +
+# the input; set it to 0 to wait for the full load event again
+FAST_NEW_CONVERSATION = _env_flag("FAST_NEW_CONVERSATION", True)
+# Default timeout of page actions / waits that do not pass their own (ms)
+PAGE_DEFAULT_TIMEOUT_MS = 15000
+PAGE_NAVIGATION_TIMEOUT_MS = 30000
+# HUMANIZE=1: keep the randomized think time around new conversations
+HUMANIZE = _env_flag("HUMANIZE")
+# INTERACTIVE_BETWEEN_TASKS=1: wait for Enter after each finished task
+INTERACTIVE_BETWEEN_TASKS = _env_flag("INTERACTIVE_BETWEEN_TASKS")
+# Minimum gap (seconds) between two prompt sends, shared by all workers
+SCRAPER_RATE_LIMIT_DELAY = _env_number("SCRAPER_RATE_LIMIT_DELAY", 0.0, float)
+# Attempts per prompt while DeepSeek answers with HTTP 429 / rate-limit errors
+RATE_LIMIT_MAX_RETRIES = 5
 USER_DATA_DIR = os.path.join(
     os.path.dirname(os.path.dirname(__file__)), ".camoufox_profile", "deepseek"
 )
 OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "output")
+INPUT_FILE_SUFFIX = "_input_prompts.txt"
+# Resume files at least this large are parsed by a multiprocessing pool
+PARALLEL_NDJSON_MIN_BYTES = 5 * 1024 * 1024
 SESSION_COOKIES_FILE = os.path.join(os.path.dirname(__file__), "deepseek_cookies.json")
 SESSION_STORAGE_FILE = os.path.join(os.path.dirname(__file__), "deepseek_storage.json")
+# Playwright storage_state (cookies + localStorage), applied before the first navigation
+SESSION_STATE_FILE = os.path.join(os.path.dirname(__file__), "deepseek_state.json")
 
 # DeepSeek-specific selectors based on actual UI structure
 CHAT_INPUT_SELECTORS: List[str] = [
@@ -75,6 +137,227 @@ STOP_BUTTON_SELECTORS: List[str] = [
     'button:has(svg[name="stop"])',
 ]
 
+# Web search side panel ("已阅读 X 个网页"), in priority order. Kept as an
+# ordered list: the generic 'scrollable' fallback also matches the chat area.
+SEARCH_PANEL_SELECTORS: List[str] = [
+    "div._519be07",
+    "div.dc433409",
+    "div[class*='scrollable']",
+]
+
+# Unioned forms for hot paths where any match will do: the browser resolves
+# "a, b, c" in one DOM walk instead of one probe per fallback selector.
+# A union matches in DOM order, so the chat-input one leaves out the bare
+# "textarea" last resort (an unrelated or hidden textarea earlier in the page
+# would win) and is only used for waits, filtered to visible matches; the
+# input itself is picked by pick_first_visible(CHAT_INPUT_SELECTORS) in
+# priority order.
+CHAT_INPUT_UNION = ", ".join(s for s in CHAT_INPUT_SELECTORS if s != "textarea")
+CHAT_INPUT_VISIBLE = f"{CHAT_INPUT_UNION} >> visible=true"
+STOP_BUTTON_UNION = ", ".join(STOP_BUTTON_SELECTORS)
+
+# Send/stop icon button next to the input (disabled once a reply has finished)
+SEND_STATE_BUTTON_SELECTOR = "div._7436101.ds-icon-button"
+
+# Locators are lazy query objects, so one per (page, selector) can be reused
+# across poll ticks instead of being rebuilt every call.
+_LOC_CACHE: Dict[Tuple[int, str], object] = {}
+
+
+class _TagFormatter(logging.Formatter):
+    """Keeps the familiar "[INFO] ..." / "[WARN] ..." line format."""
+
+    TAGS = {logging.WARNING: "WARN"}
+
+    def format(self, record: logging.LogRecord) -> str:
+        tag = self.TAGS.get(record.levelno, record.levelname)
+        return f"[{tag}] {record.getMessage()}"
+
+
+# Records are buffered and written in batches; WARN/ERROR flush immediately and
+# flush_log() is called at prompt boundaries so progress never lags far behind.
+# DEEPSEEK_LOG_LEVEL=DEBUG shows the detailed polling / selector messages.
+logger = logging.getLogger("deepseek_scraper")
+_LOG_STREAM_HANDLER = logging.StreamHandler(sys.stdout)
+_LOG_STREAM_HANDLER.setFormatter(_TagFormatter())
+_LOG_HANDLER = logging.handlers.MemoryHandler(
+    capacity=256, flushLevel=logging.WARNING, target=_LOG_STREAM_HANDLER
+)
+logger.addHandler(_LOG_HANDLER)
+_LOG_LEVEL = os.environ.get("DEEPSEEK_LOG_LEVEL", "INFO").strip().upper() or "INFO"
+try:
+    logger.setLevel(_LOG_LEVEL)
+except ValueError:
+    logger.setLevel(logging.INFO)
+    logger.warning("Unknown DEEPSEEK_LOG_LEVEL=%r, using INFO", _LOG_LEVEL)
+logger.propagate = False
+
+
+def flush_log() -> None:
+    _LOG_HANDLER.flush()
+
+
+def _forget_page(page) -> None:
+    """Drop cached state of a page that is about to close (its id may be reused)."""
+    for key in [k for k in list(_LOC_CACHE) if k[0] == id(page)]:
+        _LOC_CACHE.pop(key, None)
+    _THROTTLE_STATE.pop(id(page), None)
+
+
+def _loc(page, selector: str):
+    key = (id(page), selector)
+    loc = _LOC_CACHE.get(key)
+    if loc is None:
+        loc = page.locator(selector)
+        _LOC_CACHE[key] = loc
+    return loc
+
+
+def chat_input_locator(page):
+    """Visible chat-input candidates (CHAT_INPUT_VISIBLE), built once per page; for waits."""
+    return _loc(page, CHAT_INPUT_VISIBLE)
+
+
+# Message-like containers used when none of ASSISTANT_MESSAGE_SELECTORS grew
+ASSISTANT_FALLBACK_SELECTORS: List[str] = [
+    "article:last-child",
+    "div[class*='message']:last-child",
+    "div[class*='response']:last-child",
+]
+
+# Content block inside an assistant message, in priority order
+ASSISTANT_CONTENT_SELECTORS: List[str] = [
+    "div[class*='markdown']",
+    "div[class*='content']",
+    "div[class*='message-body']",
+]
+
+# Shared JS prelude: the newest assistant message is the last node of the first
+# ASSISTANT_MESSAGE_SELECTORS entry that grew past `before`, else the last node
+# of the first matching fallback. Playwright-only selectors (e.g. :has-text)
+# are not valid CSS and are skipped.
+_JS_FIND_LATEST = """
+  const query = (s, root) => { try { return (root || document).querySelectorAll(s); } catch (e) { return []; } };
+  const visible = (el) => !!el && el.getClientRects().length > 0;
+  let last = null;
+  for (const s of sel.msg) {
+    const nodes = query(s);
+    if (nodes.length > sel.before) { last = nodes[nodes.length - 1]; break; }
+  }
+  if (!last) {
+    for (const s of sel.fallback) {
+      const nodes = query(s);
+      if (nodes.length > 0) { last = nodes[nodes.length - 1]; break; }
+    }
+  }
+"""
+
+# One round-trip per poll tick: latest assistant text + stop/send button state.
+_STREAM_STATE_JS = (
+    "(sel) => {"
+    + _JS_FIND_LATEST
+    + """
+  let generating = false;
+  for (const s of sel.stop) {
+    const el = query(s)[0];
+    if (visible(el)) { generating = true; break; }
+  }
+  const btn = query(sel.sendBtn)[0];
+  const sendDisabled = visible(btn) && (
+    (btn.getAttribute("aria-disabled") || "").toLowerCase() === "true" ||
+    (btn.className || "").includes("ds-icon-button--disabled")
+  );
+  return { text: last ? last.innerText.trim() : "", generating, sendDisabled };
+}
+"""
+)
+
+# Resolves once generation has visibly started (stop button or new text);
+# polled inside the browser by page.wait_for_function.
+_GENERATION_STARTED_JS = (
+    "(sel) => { const s = ("
+    + _STREAM_STATE_JS
+    + ")(sel); return s.generating || s.text.length > 0; }"
+)
+
+# One round-trip at completion: content HTML + http citation hrefs.
+_FINAL_CONTENT_JS = (
+    "(sel) => {"
+    + _JS_FIND_LATEST
+    + """
+  if (!last) return null;
+  let md = null;
+  for (const s of sel.content) {
+    const el = query(s, last)[0];
+    if (visible(el)) { md = el; break; }
+  }
+  if (!md) return { html: "", hrefs: [] };
+  const hrefs = [];
+  for (const a of query(sel.citation, md)) {
+    const h = a.getAttribute("href");
+    if (h && h.startsWith("http")) hrefs.push(h);
+  }
+  return { html: md.innerHTML, hrefs };
+}
+"""
+)
+
+
+def read_stream_state(page, assistant_message_count_before: int) -> Dict[str, object]:
+    """
+    Latest assistant text plus the generating (visible stop button) and
+    send-button-disabled states, fetched in a single evaluate for the polling
+    loop.
+    """
+    try:
+        return page.evaluate(
+            _STREAM_STATE_JS,
+            {
+                "msg": ASSISTANT_MESSAGE_SELECTORS,
+                "fallback": ASSISTANT_FALLBACK_SELECTORS,
+                "before": assistant_message_count_before,
+                "stop": STOP_BUTTON_SELECTORS,
+                "sendBtn": SEND_STATE_BUTTON_SELECTOR,
+            },
+        )
+    except Exception:
+        return {"text": "", "generating": False, "sendDisabled": False}
+
+
+def read_final_content(
+    page, assistant_message_count_before: int
+) -> Optional[Dict[str, object]]:
+    """
+    {html, hrefs} of the newest assistant message in one evaluate: html of
+    its content block (empty when none is visible; the caller then keeps the
+    streamed text) and the http citation hrefs inside it.
+    """
+    try:
+        return page.evaluate(
+            _FINAL_CONTENT_JS,
+            {
+                "msg": ASSISTANT_MESSAGE_SELECTORS,
+                "fallback": ASSISTANT_FALLBACK_SELECTORS,
+                "before": assistant_message_count_before,
+                "content": ASSISTANT_CONTENT_SELECTORS,
+                "citation": CITATION_LINK_SELECTOR,
+            },
+        )
+    except Exception:
+        return None
+
+
+def prewarm_locators(page) -> None:
+    """Build the locators used on every poll tick once, right after login."""
+    for selector in [CHAT_INPUT_VISIBLE, STOP_BUTTON_UNION] + ASSISTANT_MESSAGE_SELECTORS:
+        _loc(page, selector)
+
+# html_to_markdown cleanup patterns, compiled once at import time
+_RE_DASH_NUM = re.compile(r"^-\s*(\d+)$")
+_RE_MULTI_NL = re.compile(r"\n{3,}")
+_RE_MULTI_SP = re.compile(r" +")
+_HEADING_TAGS = {f"h{i}": i for i in range(1, 7)}
+
 
 def ensure_dirs() -> None:
     if not os.path.exists(USER_DATA_DIR):
@@ -83,38 +366,72 @@ def ensure_dirs() -> None:
         os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 
-def read_prompts(path: str) -> List[str]:
+def iter_new_prompts(path: str, processed: set) -> Iterator[str]:
+    """
+    Stream the non-empty prompts of an input file that are not in processed,
+    each stripped once; repeats within the file are only yielded once.
+    """
     if not os.path.exists(path):
-        return []
+        return
+    seen_in_batch = set()
+    duplicates = 0
     with open(path, "r", encoding="utf-8") as f:
-        lines = [line.strip() for line in f.readlines()]
-    return [p for p in lines if p]
+        for line in f:
+            p = line.strip()
+            if not p:
+                continue
+            fp = prompt_fingerprint(p)
+            if fp in processed:
+                continue
+            if fp in seen_in_batch:
+                duplicates += 1
+                continue
+            seen_in_batch.add(fp)
+            yield p
+    if duplicates:
+        logger.info(
+            "Skipped %s duplicate prompts in %s",
+            duplicates,
+            os.path.basename(path),
+        )
+
+
+def prompt_fingerprint(prompt: str) -> bytes:
+    """
+    16-byte blake2b digest of an already stripped prompt, used as the
+    processed-set key.
+    """
+    return hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).digest()
 
 
-def pick_first_visible(page, selectors: List[str], timeout: int = 5000):
+def pick_first_visible(page, selectors: Union[str, List[str]]):
     """
-    Find the first visible element from a list of selectors.
-    Uses a short timeout to avoid hanging.
+    Find the first visible element from a list of selectors, tried in priority
+    order (or one, possibly unioned "a, b" selector).
+    Hidden matches are filtered out in the page (visible=true), so a hidden
+    element ahead of the visible one does not hide it. Every probe is a single
+    DOM snapshot.
     """
+    if isinstance(selectors, str):
+        selectors = [selectors]
     for selector in selectors:
-        loc = page.locator(selector)
+        loc = _loc(page, f"{selector} >> visible=true")
         try:
             if loc.count() > 0:
-                first = loc.first
-                if first.is_visible(timeout=timeout):
-                    return first
+                return loc.first
         except Exception:
             continue
     return None
 
 
-def is_chat_ui_ready(page) -> bool:
+def is_chat_ui_ready(page, timeout: int = 0) -> bool:
     """
     Returns True only when the authenticated chat UI is visible.
+    timeout > 0 first waits that long (ms) for a visible chat-input candidate.
     """
     try:
         current_url = page.url or ""
-        print(f"[DEBUG] Current URL: {current_url}")
+        logger.debug("Current URL: %s", current_url)
         # NOTE:
         # DeepSeek sometimes keeps the URL as /sign_in even after the chat UI
         # is fully loaded (SPA navigation). Therefore we MUST NOT rely on the
@@ -122,70 +439,83 @@ def is_chat_ui_ready(page) -> bool:
         # whether the chat is ready. We only use DOM elements below.
 
         # Look for chat input
-        print("[DEBUG] Looking for chat input...")
+        logger.debug("Looking for chat input...")
+        if timeout > 0:
+            try:
+                chat_input_locator(page).first.wait_for(state="visible", timeout=timeout)
+            except PlaywrightTimeoutError:
+                pass
         chat_input = pick_first_visible(page, CHAT_INPUT_SELECTORS)
         if not chat_input:
-            print("[DEBUG] Chat input not found yet")
+            logger.debug("Chat input not found yet")
             return False
 
-        print("[DEBUG] Chat input found!")
+        logger.debug("Chat input found!")
         return True
     except Exception as e:
-        print(f"[DEBUG] Exception in is_chat_ui_ready: {e}")
+        logger.debug("Exception in is_chat_ui_ready: %s", e)
         return False
 
 
 def wait_for_login(page, timeout_seconds: int = 300) -> bool:
-    print("\n" + "=" * 60)
-    print("⚠️  ACTION REQUIRED:")
-    print("    1. Find the NEW browser window opened by this script")
-    print("    2. Login to DeepSeek in THAT window (not your regular browser)")
-    print("    3. Wait for the chat interface to appear")
-    print("    4. Script will automatically continue once logged in")
-    print(f"    5. Timeout: {timeout_seconds//60} minutes")
-    print("=" * 60 + "\n")
-
     # First quick check - maybe already logged in
-    print("[INFO] Checking if already logged in...")
-    if is_chat_ui_ready(page):
-        print("[INFO] ✓ Already logged in! Chat interface ready.")
+    logger.info("Checking if already logged in...")
+    if is_chat_ui_ready(page, timeout=5000):
+        logger.info("✓ Already logged in! Chat interface ready.")
         return True
 
-    # Give user time to start login process（缩短初始等待）
-    print("[INFO] Waiting 3 seconds for you to start login...")
-    time.sleep(20)
+    logger.warning(
+        "⚠️  ACTION REQUIRED:\n"
+        "    1. Find the NEW browser window opened by this script\n"
+        "    2. Login to DeepSeek in THAT window (not your regular browser)\n"
+        "    3. Wait for the chat interface to appear\n"
+        "    4. Script will automatically continue once logged in\n"
+        f"    5. Timeout: {timeout_seconds//60} minutes\n" + "=" * 60
+    )
+
+    # Give user time to start login process: poll fast for the first 10s
+    # instead of sleeping, so a session that finishes loading returns at once.
+    logger.info("Waiting up to 10 seconds for the chat interface or your login...")
+    for _ in range(20):
+        time.sleep(0.5)
+        if is_chat_ui_ready(page):
+            logger.info("✓ Chat interface ready.")
+            return True
 
-    print("[INFO] Monitoring for chat input box...")
-    start = time.time()
-    remaining = timeout_seconds - 3
+    logger.info("Monitoring for chat input box...")
+    start = time.monotonic()
+    remaining = timeout_seconds - 10
     check_count = 0
     last_url = ""
-    while time.time() - start < remaining:
+    while True:
+        now = time.monotonic()
+        if now - start >= remaining:
+            break
         check_count += 1
         current_url = page.url or ""
 
         # Notify when URL changes (indicates login progress)
         if current_url != last_url:
-            print(f"\n[INFO] ⚠️  Page changed to: {current_url}")
+            logger.info("⚠️  Page changed to: %s", current_url)
             last_url = current_url
 
-        print(
-            f"[DEBUG] Login check #{check_count} (Elapsed: {int(time.time()-start)}s)"
+        logger.debug(
+            "Login check #%s (Elapsed: %ss)", check_count, int(now - start)
         )
         if is_chat_ui_ready(page):
-            print("\n" + "=" * 60)
-            print("✓ SUCCESS: Chat interface detected!")
-            print("✓ Ready to send prompts.")
-            print("=" * 60 + "\n")
+            logger.info("✓ SUCCESS: Chat interface detected! Ready to send prompts.")
+            flush_log()
             return True
+        flush_log()
         # 更快轮询，加速检测登录完成
         time.sleep(1.5)
 
-    print("\n[ERROR] Chat input not found after timeout")
-    print("[ERROR] Please make sure you logged in the SCRIPT'S browser window")
+    logger.error("Chat input not found after timeout")
+    logger.error("Please make sure you logged in the SCRIPT'S browser window")
     return False
 
 
+@functools.lru_cache(maxsize=256)
 def get_conversation_id_from_url(url: str) -> str:
     """
     Extract conversation ID from URL.
@@ -205,116 +535,98 @@ def get_conversation_id_from_url(url: str) -> str:
     return ""
 
 
+_ZH_RE = re.compile(r"[\u4e00-\u9fff]")
+
+
 def detect_language(text: str) -> str:
-    for ch in text:
-        if "\u4e00" <= ch <= "\u9fff":
-            return "zh"
-    return "en"
+    return "zh" if _ZH_RE.search(text) else "en"
 
 
-def load_cookies_into_context(page, cookies_path: str) -> None:
-    try:
-        if os.path.exists(cookies_path):
-            with open(cookies_path, "r", encoding="utf-8") as f:
-                cookies = json.load(f)
-            if isinstance(cookies, list) and len(cookies) > 0:
-                page.context.add_cookies(cookies)
-    except Exception:
-        pass
+def _json_loads(data):
+    """Parse JSON from str/bytes with orjson when available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
 
-def save_cookies_from_context(page, cookies_path: str) -> None:
-    try:
-        cookies = page.context.cookies()
-        with open(cookies_path, "w", encoding="utf-8") as f:
-            json.dump(cookies, f, ensure_ascii=False, indent=2)
-    except Exception:
-        pass
+def _json_dumps(obj, indent: bool = False) -> bytes:
+    """Serialize to UTF-8 JSON bytes (non-ASCII kept as-is) with orjson when available."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode(
+        "utf-8"
+    )
 
 
-def load_storage_from_file(page, storage_path: str) -> None:
-    try:
-        if not os.path.exists(storage_path):
-            return
-        with open(storage_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        local_items = data.get("localStorage", {})
-        session_items = data.get("sessionStorage", {})
-        if local_items:
-            page.evaluate(
-                """(items) => { for (const [k,v] of Object.entries(items)) localStorage.setItem(k, v) }""",
-                local_items,
-            )
-        if session_items:
-            page.evaluate(
-                """(items) => { for (const [k,v] of Object.entries(items)) sessionStorage.setItem(k, v) }""",
-                session_items,
-            )
-    except Exception:
-        pass
+def has_saved_session() -> bool:
+    return os.path.exists(SESSION_STATE_FILE) or os.path.exists(SESSION_COOKIES_FILE)
+
 
+def load_session_state() -> Union[str, Dict, None]:
+    """
+    storage_state for browser.new_context(): the saved state file, or one
+    built from the legacy cookies/storage files written by older versions.
+    sessionStorage has no place in storage_state and is not carried over.
+    """
+    if os.path.exists(SESSION_STATE_FILE):
+        return SESSION_STATE_FILE
+    if not os.path.exists(SESSION_COOKIES_FILE):
+        return None
 
-def save_storage_to_file(page, storage_path: str) -> None:
+    state: Dict = {"cookies": [], "origins": []}
     try:
-        ls = page.evaluate("""() => Object.fromEntries(Object.entries(localStorage))""")
-        ss = page.evaluate(
-            """() => Object.fromEntries(Object.entries(sessionStorage))"""
-        )
-        with open(storage_path, "w", encoding="utf-8") as f:
-            json.dump(
-                {"localStorage": ls, "sessionStorage": ss},
-                f,
-                ensure_ascii=False,
-                indent=2,
-            )
+        with open(SESSION_COOKIES_FILE, "rb") as f:
+            cookies = _json_loads(f.read())
+        if isinstance(cookies, list):
+            state["cookies"] = cookies
     except Exception:
         pass
 
-
-def is_generating(page) -> bool:
-    """
-    Check if the assistant is currently generating a response.
-    Look for stop button or other generation indicators.
-    """
     try:
-        stop_btn = pick_first_visible(page, STOP_BUTTON_SELECTORS)
-        if stop_btn:
-            return True
+        if os.path.exists(SESSION_STORAGE_FILE):
+            with open(SESSION_STORAGE_FILE, "rb") as f:
+                local_items = _json_loads(f.read()).get("localStorage") or {}
+            if local_items:
+                state["origins"].append(
+                    {
+                        "origin": DEEPSEEK_HOME_URL.rstrip("/"),
+                        "localStorage": [
+                            {"name": k, "value": v} for k, v in local_items.items()
+                        ],
+                    }
+                )
     except Exception:
         pass
-    return False
+    return state
 
 
-def is_send_button_disabled(page) -> bool:
-    """
-    DeepSeek send/stop button state helper.
-    When input is empty or last LLM reply has finished, the arrow send button
-    becomes disabled (aria-disabled=true and/or has 'ds-icon-button--disabled').
-    While LLM is responding, the icon changes to a square stop button and is enabled.
+def save_session_state(context) -> None:
+    """Persist cookies + localStorage of the context in one storage_state call.
+
+    Written to a per-worker temp file and swapped in with os.replace, so a
+    crash mid-write never leaves a truncated state file behind.
     """
+    tmp_path = f"{SESSION_STATE_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
     try:
-        # The main send/stop button wrapper, based on provided HTML:
-        # <div class="_7436101 ... ds-icon-button ds-icon-button--l ds-icon-button--sizing-container ...">
-        btn = page.locator("div._7436101.ds-icon-button").first
-        if not btn or not btn.is_visible(timeout=3000):
-            return False
-
-        aria = (btn.get_attribute("aria-disabled") or "").lower()
-        cls = btn.get_attribute("class") or ""
-
-        if aria == "true":
-            return True
-        if "ds-icon-button--disabled" in cls:
-            return True
+        with open(tmp_path, "wb") as f:
+            f.write(_json_dumps(context.storage_state(), indent=True))
+        os.replace(tmp_path, SESSION_STATE_FILE)
     except Exception:
-        pass
-    return False
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
 
 
-def ensure_online_mode_enabled(page) -> None:
+def ensure_online_mode_enabled(page) -> str:
     """
     Ensure DeepSeek '联网搜索' toggle is turned ON before sending a prompt.
     Does nothing if the toggle is already enabled or not found.
+    Returns the toggle state for mode_online: "true" / "false", or "" when
+    the toggle could not be found or read.
     """
     try:
         # DeepSeek 在不同平台/版本下，有的用 <button>，有的用 <div role="button">
@@ -322,13 +634,13 @@ def ensure_online_mode_enabled(page) -> None:
             'button:has-text("联网搜索"), div[role="button"]:has-text("联网搜索")'
         )
         if toggle.count() == 0:
-            print("[DEBUG] Online search toggle ('联网搜索') not found")
-            return
+            logger.debug("Online search toggle ('联网搜索') not found")
+            return ""
 
         btn = toggle.first
-        if not btn.is_visible(timeout=5000):
-            print("[DEBUG] Online search toggle found but not visible")
-            return
+        if not btn.is_visible():
+            logger.debug("Online search toggle found but not visible")
+            return ""
 
         classes = btn.get_attribute("class") or ""
         # Selected state has class 'ds-toggle-button--selected'
@@ -337,21 +649,66 @@ def ensure_online_mode_enabled(page) -> None:
             or "selected" in classes
             or "active" in classes
         ):
-            print("[DEBUG] Online search already enabled")
-            return
+            logger.debug("Online search already enabled")
+            return "true"
 
-        print("[INFO] Enabling '联网搜索' (online search) mode...")
+        logger.info("Enabling '联网搜索' (online search) mode...")
         btn.click()
         time.sleep(0.3)
 
         # Best-effort re-check
         classes_after = btn.get_attribute("class") or ""
         if "ds-toggle-button--selected" in classes_after or "selected" in classes_after:
-            print("[INFO] '联网搜索' mode enabled")
-        else:
-            print("[WARN] Could not confirm '联网搜索' mode is enabled")
+            logger.info("'联网搜索' mode enabled")
+            return "true"
+        logger.warning("Could not confirm '联网搜索' mode is enabled")
+        return "true" if "active" in classes_after else "false"
     except Exception as e:
-        print(f"[WARN] Failed to ensure online search mode: {e}")
+        logger.warning("Failed to ensure online search mode: %s", e)
+        return ""
+
+
+# {count, results:[{href,title,snippet}]} from the side panel: first 20 items,
+# http links only, title falls back to the first 160 chars of the card text.
+_SEARCH_PANEL_RESULTS_JS = """
+(panel) => {
+  const root = panel.querySelector("div.dc433409") || panel;
+  const text = (el, s) => { const n = el.querySelector(s); return n ? n.innerText.trim() : ""; };
+  let items = root.querySelectorAll("a._24fe229");
+  if (items.length === 0) items = root.querySelectorAll("a[href]");  // Fallback: any anchor with href
+  const results = [];
+  for (const a of Array.from(items).slice(0, 20)) {
+    const href = a.getAttribute("href") || "";
+    if (!href.startsWith("http")) continue;
+    const title = text(a, ".search-view-card__title") || a.innerText.trim().slice(0, 160);
+    results.push({ href, title, snippet: text(a, ".search-view-card__snippet") });
+  }
+  return { count: items.length, results };
+}
+"""
+
+
+# Inline citation anchors of an assistant message as [{href,title,snippet}],
+# http only and de-duplicated by href (the same page is often cited twice).
+_INLINE_CITATIONS_JS = """
+(el, sel) => {
+  const seen = new Set();
+  const out = [];
+  for (const a of el.querySelectorAll(sel)) {
+    const href = a.getAttribute("href") || "";
+    if (!href.startsWith("http") || seen.has(href)) continue;
+    seen.add(href);
+    const title = (a.getAttribute("title") || a.getAttribute("aria-label") || a.innerText || "").trim();
+    out.push({ href, title, snippet: "" });
+  }
+  return out;
+}
+"""
+
+
+def find_search_panel(page):
+    """First visible web search side panel, by SEARCH_PANEL_SELECTORS priority."""
+    return pick_first_visible(page, SEARCH_PANEL_SELECTORS)
 
 
 def extract_web_search_results(
@@ -385,11 +742,26 @@ def extract_web_search_results(
 
         if search_button is None or search_button.count() == 0:
             # No web search summary block detected for this answer
-            print("[DEBUG] No web search summary button found for this response")
+            logger.debug("No web search summary button found for this response")
             return results, had_web_search_button
 
         had_web_search_button = True
-        print(f"[DEBUG] Found web search button, extracting results...")
+        logger.debug("Found web search button, extracting results...")
+
+        # Fast path: citations already rendered inline in the answer carry the
+        # result hrefs, so the side panel does not need to be opened at all.
+        try:
+            if assistant_container is not None:
+                inline = assistant_container.evaluate(
+                    _INLINE_CITATIONS_JS, CITATION_LINK_SELECTOR
+                )
+                if inline:
+                    logger.debug(
+                        "Using %s inline citations, skipping side panel", len(inline)
+                    )
+                    return inline, had_web_search_button
+        except Exception:
+            pass
 
         # Click the "已阅读 X 个网页" 区域多次尝试打开 side panel
         panel = None
@@ -397,11 +769,11 @@ def extract_web_search_results(
         for attempt in range(3):
             try:
                 btn = search_button.last
-                if not btn.is_visible(timeout=2000):
+                if not btn.is_visible():
                     continue
 
-                print(
-                    f"[DEBUG] Clicking DeepSeek web search button (attempt {attempt+1}/3)"
+                logger.debug(
+                    "Clicking DeepSeek web search button (attempt %s/3)", attempt+1
                 )
                 # Prefer the inner span.d162f7b9 with text "已阅读 X 个网页"
                 try:
@@ -428,25 +800,15 @@ def extract_web_search_results(
                 time.sleep(0.4)  # Wait briefly for panel to open
 
                 # 尝试在本次点击后立即寻找 panel，若找到即可停止重试
-                side_panel_selectors = [
-                    "div._519be07",
-                    "div.dc433409",
-                    "div[class*='scrollable']",
-                ]
-                for selector in side_panel_selectors:
-                    try:
-                        loc = page.locator(selector)
-                        if loc.count() > 0 and loc.first.is_visible():
-                            panel = loc.first
-                            click_ok = True
-                            break
-                    except Exception:
-                        continue
-                if click_ok:
+                panel = find_search_panel(page)
+                if panel is not None:
+                    click_ok = True
                     break
             except Exception as e:
-                print(
-                    f"[WARN] Failed to click DeepSeek web search button (attempt {attempt+1}/3): {e}"
+                logger.warning(
+                    "Failed to click DeepSeek web search button (attempt %s/3): %s",
+                    attempt+1,
+                    e,
                 )
                 # 最后一次再尝试 JS 触发点击，作为兜底
                 if attempt == 2:
@@ -454,124 +816,142 @@ def extract_web_search_results(
                         btn = search_button.last
                         btn.evaluate("el => el.click()")
                         time.sleep(0.4)
-                        side_panel_selectors = [
-                            "div._519be07",
-                            "div.dc433409",
-                            "div[class*='scrollable']",
-                        ]
-                        for selector in side_panel_selectors:
-                            try:
-                                loc = page.locator(selector)
-                                if loc.count() > 0 and loc.first.is_visible():
-                                    panel = loc.first
-                                    click_ok = True
-                                    break
-                            except Exception:
-                                continue
-                        if click_ok:
+                        panel = find_search_panel(page)
+                        if panel is not None:
+                            click_ok = True
                             break
                     except Exception as ee:
-                        print(f"[WARN] DeepSeek JS click fallback failed: {ee}")
+                        logger.warning("DeepSeek JS click fallback failed: %s", ee)
                 time.sleep(0.3)
 
         if not click_ok and panel is None:
-            print(
-                "[WARN] Could not open DeepSeek search results panel after 3 attempts"
+            logger.warning(
+                "Could not open DeepSeek search results panel after 3 attempts"
             )
 
         # 如果前面的快速查找没能找到 panel，这里再按旧逻辑兜底找一次
 
         # Find the side panel with search results（兜底逻辑）
         if not panel:
-            side_panel_selectors = [
-                "div._519be07",
-                "div.dc433409",
-                "div[class*='scrollable']",
-            ]
-
-            for selector in side_panel_selectors:
-                try:
-                    loc = page.locator(selector)
-                    if loc.count() > 0 and loc.first.is_visible():
-                        panel = loc.first
-                        break
-                except Exception:
-                    continue
-
+            panel = find_search_panel(page)
             if not panel:
-                print("[WARN] Could not find search results panel")
+                logger.warning("Could not find search results panel")
                 return results, had_web_search_button
 
-        # Narrow down to the actual results container if we matched the outer panel
-        try:
-            inner = panel.locator("div.dc433409")
-            if inner.count() > 0:
-                panel = inner.first
-        except Exception:
-            pass
-
-        # Extract search result items
-        # Each result is an <a class="_24fe229"> with title & snippet inside
-        result_items = panel.locator("a._24fe229")
-        if result_items.count() == 0:
-            # Fallback: any anchor with href
-            result_items = panel.locator("a[href]")
-        count = result_items.count()
-        print(f"[DEBUG] Found {count} search result items")
-
-        for i in range(min(count, 20)):  # Limit to first 20 results
-            try:
-                item = result_items.nth(i)
-                href = item.get_attribute("href") or ""
-
-                if not href or not href.startswith("http"):
-                    continue
+        # Extract search result items in one round-trip. Each result is an
+        # <a class="_24fe229"> with title & snippet inside; narrow down to the
+        # actual results container if we matched the outer panel.
+        data = panel.evaluate(_SEARCH_PANEL_RESULTS_JS) or {}
+        logger.debug("Found %s search result items", data.get('count', 0))
+        results = data.get("results") or []
 
-                # Try to extract title and snippet
-                title = ""
-                snippet = ""
+        logger.debug("Extracted %s web search results", len(results))
+    except Exception as e:
+        logger.warning("Failed to extract web search results: %s", e)
 
-                try:
-                    # DeepSeek search title: div.search-view-card__title
-                    title_elem = item.locator(
-                        "div.search-view-card__title, .search-view-card__title"
-                    ).first
-                    if title_elem:
-                        title = title_elem.inner_text().strip()
-                except Exception:
-                    pass
+    return results, had_web_search_button
 
-                if not title:
-                    title = item.inner_text().strip()[
-                        :160
-                    ]  # Fallback to first 160 chars
 
-                try:
-                    # DeepSeek search snippet: div.search-view-card__snippet
-                    snippet_elem = item.locator(
-                        "div.search-view-card__snippet, .search-view-card__snippet"
-                    ).first
-                    if snippet_elem:
-                        snippet = snippet_elem.inner_text().strip()
-                except Exception:
-                    pass
-
-                results.append(
-                    {
-                        "href": href,
-                        "title": title,
-                        "snippet": snippet,
-                    }
-                )
-            except Exception as e:
-                print(f"[WARN] Failed to extract result {i}: {e}")
-                continue
+class _MarkdownRenderer(HTMLParser):
+    """
+    Single-pass HTML -> Markdown walker used by html_to_markdown.
+    Entities are decoded by HTMLParser itself (convert_charrefs).
+    """
 
-        print(f"[DEBUG] Extracted {len(results)} web search results")
-    except Exception as e:
-        print(f"[WARN] Failed to extract web search results: {e}")
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.out: List[str] = []
+        self._skip_depth = 0  # inside <script>/<style>
+        self._links: List[Tuple[str, List[str]]] = []  # open <a>: (href, inner parts)
+        # open <ol>/<ul>: next item number for <ol>, 0 for <ul>
+        self._lists: List[int] = []
+
+    def _emit(self, text: str) -> None:
+        if self._links:
+            self._links[-1][1].append(text)
+        else:
+            self.out.append(text)
 
-    return results, had_web_search_button
+    def handle_starttag(self, tag, attrs) -> None:
+        if tag in ("script", "style"):
+            self._skip_depth += 1
+            return
+        if self._skip_depth:
+            return
+        if tag == "a":
+            href = ""
+            for name, value in attrs:
+                if name == "href":
+                    href = value or ""
+                    break
+            self._links.append((href, []))
+        elif tag == "br":
+            self._emit("\n")
+        elif tag == "li":
+            if self._lists and self._lists[-1]:
+                self._emit(f"\n{self._lists[-1]}. ")
+                self._lists[-1] += 1
+            else:
+                self._emit("\n- ")
+        elif tag in ("ol", "ul"):
+            start = 0
+            if tag == "ol":
+                start = 1
+                for name, value in attrs:
+                    if name == "start" and (value or "").isdigit():
+                        start = max(1, int(value))
+            self._lists.append(start)
+            self._emit("\n")
+        elif tag in _HEADING_TAGS:
+            self._emit("#" * _HEADING_TAGS[tag] + " ")
+
+    def handle_endtag(self, tag) -> None:
+        if tag in ("script", "style"):
+            if self._skip_depth:
+                self._skip_depth -= 1
+            return
+        if self._skip_depth:
+            return
+        if tag == "a":
+            if self._links:
+                href, parts = self._links.pop()
+                self._emit(_format_link(href, "".join(parts)))
+        elif tag in ("p", "div"):
+            self._emit("\n\n")
+        elif tag in ("ol", "ul"):
+            if self._lists:
+                self._lists.pop()
+            self._emit("\n")
+        elif tag in _HEADING_TAGS:
+            self._emit("\n\n")
+
+    def handle_data(self, data) -> None:
+        if not self._skip_depth:
+            self._emit(data.replace("\xa0", " "))
+
+    def render(self, html: str) -> str:
+        self.feed(html)
+        self.close()
+        # Unclosed <a> at the end of the buffer: keep its text
+        while self._links:
+            _, parts = self._links.pop()
+            self._emit("".join(parts))
+        return "".join(self.out)
+
+
+def _format_link(href: str, inner: str) -> str:
+    """Render one <a href=...>inner</a> as a markdown link."""
+    inner = inner.strip()
+
+    # DeepSeek citation links sometimes render as "-6" (an invisible "-" plus the index).
+    # Normalize patterns like "-6" / "- 6" to "6" so that markdown becomes [6](url) instead of [-6](url).
+    if inner:
+        inner = _RE_DASH_NUM.sub(r"\1", inner)
+
+    if not href:
+        return inner if inner else ""
+    display = inner or "link"
+    return f"[{display}]({href})"
 
 
 def html_to_markdown(html: str) -> str:
@@ -579,71 +959,13 @@ def html_to_markdown(html: str) -> str:
     Simple HTML to Markdown converter.
     Preserves links and basic formatting.
     """
-    import re
-
-    # Remove script/style tags
-    html = re.sub(
-        r"<(script|style)[^>]*>.*?</\1>", "", html, flags=re.DOTALL | re.IGNORECASE
-    )
-
-    # Convert <a href="...">text</a> to [text](url)
-    def replace_link(match):
-        full_tag = match.group(0)
-        href_match = re.search(r'href=["\']([^"\']+)["\']', full_tag)
-        href = href_match.group(1) if href_match else ""
-        inner = re.sub(r"<[^>]+>", "", match.group(1)).strip()
-
-        # DeepSeek citation links sometimes render as "-6" (an invisible "-" plus the index).
-        # Normalize patterns like "-6" / "- 6" to "6" so that markdown becomes [6](url) instead of [-6](url).
-        if inner:
-            inner = re.sub(r"^-\s*(\d+)$", r"\1", inner)
-
-        if not href:
-            return inner if inner else ""
-        display = inner or "link"
-        return f"[{display}]({href})"
-
-    html = re.sub(
-        r"<a[^>]*>(.*?)</a>", replace_link, html, flags=re.DOTALL | re.IGNORECASE
-    )
-
-    # Convert <br> to newline
-    html = re.sub(r"<br\s*/?>", "\n", html, flags=re.IGNORECASE)
-
-    # Convert </p>, </div> to double newline
-    html = re.sub(r"</(p|div)>", "\n\n", html, flags=re.IGNORECASE)
-
-    # Convert <li> to "- "
-    html = re.sub(r"<li[^>]*>", "\n- ", html, flags=re.IGNORECASE)
-    html = re.sub(r"</li>", "", html, flags=re.IGNORECASE)
-
-    # Convert lists
-    html = re.sub(r"<ol[^>]*>", "\n", html, flags=re.IGNORECASE)
-    html = re.sub(r"</ol>", "\n", html, flags=re.IGNORECASE)
-    html = re.sub(r"<ul[^>]*>", "\n", html, flags=re.IGNORECASE)
-    html = re.sub(r"</ul>", "\n", html, flags=re.IGNORECASE)
-
-    # Convert headings
-    for i in range(6, 0, -1):
-        html = re.sub(
-            f"<h{i}[^>]*>(.*?)</h{i}>",
-            "#" * i + r" \1\n\n",
-            html,
-            flags=re.DOTALL | re.IGNORECASE,
-        )
-
-    # Remove all other tags
-    html = re.sub(r"<[^>]+>", "", html)
-
-    # Decode HTML entities
-    html = html.replace("&lt;", "<").replace("&gt;", ">").replace("&amp;", "&")
-    html = html.replace("&nbsp;", " ").replace("&quot;", '"').replace("&#39;", "'")
+    text = _MarkdownRenderer().render(html)
 
     # Clean up multiple newlines
-    html = re.sub(r"\n{3,}", "\n\n", html)
-    html = re.sub(r" +", " ", html)
+    text = _RE_MULTI_NL.sub("\n\n", text)
+    text = _RE_MULTI_SP.sub(" ", text)
 
-    return html.strip()
+    return text.strip()
 
 
 def wait_for_stream_completion_and_get_text(
@@ -653,150 +975,108 @@ def wait_for_stream_completion_and_get_text(
     Wait for the assistant's response to complete streaming.
     Returns (response_text, list_of_citation_hrefs).
     """
-    start = time.time()
+    # monotonic: immune to wall-clock adjustments; read once per tick
+    start = time.monotonic()
     last_text = ""
-    stable_ticks = 0
     last_change_time = start
     # 缩短最大等待时间与检测周期，加快响应完成判定
     max_stream_seconds = max(45, min(180, int(timeout_seconds * 0.7)))
-    required_stable_ticks = 3  # ~0.75s with 0.25s sleep
-
-    def get_latest_assistant():
-        # Try specific selectors first
-        for selector in ASSISTANT_MESSAGE_SELECTORS:
-            loc = page.locator(selector)
-            try:
-                if loc.count() > assistant_message_count_before:
-                    return loc.nth(loc.count() - 1)
-            except Exception:
-                continue
-
-        # Fallback: try to find last message-like container
-        fallback_selectors = [
-            "article:last-child",
-            "div[class*='message']:last-child",
-            "div[class*='response']:last-child",
-        ]
-        for selector in fallback_selectors:
-            try:
-                loc = page.locator(selector)
-                if loc.count() > 0:
-                    return loc.last
-            except Exception:
-                continue
-        return None
+    # Stability is measured in seconds since the poll interval is adaptive:
+    # 0.2s while text is streaming, backing off to 1.0s while it is stalled.
+    required_stable_seconds = 0.75
+    interval = 0.2
 
-    # Wait for generation to start
-    start_phase_deadline = time.time() + min(30, timeout_seconds * 0.2)
-    while time.time() < start_phase_deadline:
-        if is_generating(page):
-            print("[DEBUG] Generation started (stop button visible)")
-            break
+    # Wait for generation to start (stop button or content), polled in-browser
+    try:
+        page.wait_for_function(
+            _GENERATION_STARTED_JS,
+            arg={
+                "msg": ASSISTANT_MESSAGE_SELECTORS,
+                "fallback": ASSISTANT_FALLBACK_SELECTORS,
+                "before": assistant_message_count_before,
+                "stop": STOP_BUTTON_SELECTORS,
+                "sendBtn": SEND_STATE_BUTTON_SELECTOR,
+            },
+            timeout=int(min(30, timeout_seconds * 0.2) * 1000),
+            polling=100,
+        )
+    except PlaywrightTimeoutError:
+        logger.debug("Generation start not detected, continuing to poll")
+    except Exception:
+        pass
 
-        # Also check for content appearing
-        try:
-            container = get_latest_assistant()
-            if container:
-                text_now = container.inner_text().strip()
-                if text_now and len(text_now) > len(last_text):
-                    last_text = text_now
-                    last_change_time = time.time()
-                    print("[DEBUG] Content started appearing")
-                    break
-        except Exception:
-            pass
-        time.sleep(0.15)
+    state = read_stream_state(page, assistant_message_count_before)
+    if state["generating"]:
+        logger.debug("Generation started (stop button visible)")
+    if state["text"]:
+        last_text = state["text"]
+        last_change_time = time.monotonic()
+        logger.debug("Content started appearing")
 
     # Wait for completion
-    while time.time() - start < timeout_seconds:
-        container = get_latest_assistant()
-        try:
-            text = container.inner_text().strip() if container else ""
-        except Exception:
-            text = ""
+    while True:
+        now = time.monotonic()
+        if now - start >= timeout_seconds:
+            break
+        state = read_stream_state(page, assistant_message_count_before)
+        text = state["text"]
+        generating = state["generating"]
 
-        if text and text == last_text:
-            stable_ticks += 1
-        else:
-            stable_ticks = 0
+        changed = text != last_text
+        if changed:
             last_text = text
             if text:
-                last_change_time = time.time()
+                last_change_time = now
 
         # Force stop if generation takes too long
-        if is_generating(page) and (time.time() - start > max_stream_seconds):
-            print(f"[INFO] Forcing stop after {max_stream_seconds}s")
+        if generating and (now - start > max_stream_seconds):
+            logger.info("Forcing stop after %ss", max_stream_seconds)
             try:
-                stop_btn = pick_first_visible(page, STOP_BUTTON_SELECTORS)
+                stop_btn = pick_first_visible(page, STOP_BUTTON_UNION)
                 if stop_btn:
                     stop_btn.click()
             except Exception:
                 pass
 
         # Completion criteria:
-        # 1) Text has been stable for several ticks
+        # 1) Text has been stable for required_stable_seconds
         # 2) Send button is in the disabled state, which for DeepSeek means:
         #    - Input is empty
         #    - Last LLM reply has finished
-        if stable_ticks >= required_stable_ticks and len(text) > 0:
-            if is_send_button_disabled(page):
-                print(
-                    f"[DEBUG] Response completed ({len(text)} chars, send button disabled)"
+        if (
+            text
+            and not changed
+            and now - last_change_time >= required_stable_seconds
+        ):
+            if state["sendDisabled"]:
+                logger.debug(
+                    "Response completed (%s chars, send button disabled)", len(text)
                 )
                 break
 
         # Fallback timeout
-        if (not is_generating(page)) and (time.time() - last_change_time > 6):
-            print("[DEBUG] No changes for 6s, assuming complete")
+        if (not generating) and (now - last_change_time > 6):
+            logger.debug("No changes for 6s, assuming complete")
             break
 
-        time.sleep(0.25)
+        interval = 0.2 if changed else min(interval * 1.3, 1.0)
+        time.sleep(interval)
 
     # Extract citations
     citations: List[str] = []
     final_text = last_text
 
-    try:
-        container = get_latest_assistant()
-        if container:
-            # Try to get HTML content for better formatting
-            try:
-                # Look for markdown or content container within the message
-                content_selectors = [
-                    "div[class*='markdown']",
-                    "div[class*='content']",
-                    "div[class*='message-body']",
-                ]
-                content_container = None
-                for selector in content_selectors:
-                    try:
-                        loc = container.locator(selector)
-                        if loc.count() > 0 and loc.first.is_visible():
-                            content_container = loc.first
-                            break
-                    except Exception:
-                        continue
+    data = read_final_content(page, assistant_message_count_before)
+    if data and data.get("html"):
+        # Prefer the HTML content block for better formatting
+        final_text = html_to_markdown(data["html"])
+        seen = set()
+        for href in data.get("hrefs") or []:
+            if href not in seen:
+                seen.add(href)
+                citations.append(href)
 
-                if content_container:
-                    html_content = content_container.inner_html()
-                    final_text = html_to_markdown(html_content)
-
-                    # Extract citations
-                    citation_links = content_container.locator(CITATION_LINK_SELECTOR)
-                    for i in range(citation_links.count()):
-                        try:
-                            href = citation_links.nth(i).get_attribute("href")
-                            if href and href.startswith("http"):
-                                citations.append(href)
-                        except Exception:
-                            continue
-            except Exception:
-                # Fallback to plain text
-                final_text = container.inner_text().strip()
-    except Exception:
-        pass
-
-    return final_text, list(dict.fromkeys(citations))
+    return final_text, citations
 
 
 def send_prompt_and_collect(
@@ -809,13 +1089,13 @@ def send_prompt_and_collect(
     input_box = pick_first_visible(page, CHAT_INPUT_SELECTORS)
     if not input_box:
         # 与 Doubao 一致，先尝试自愈一次
-        print(
-            "[WARN] DeepSeek chat input not found on first try, attempting to recover by reloading chat page..."
+        logger.warning(
+            "DeepSeek chat input not found on first try, attempting to recover by reloading chat page..."
         )
         try:
             click_new_conversation(page)
         except Exception as e:
-            print(f"[WARN] DeepSeek recovery click_new_conversation failed: {e}")
+            logger.warning("DeepSeek recovery click_new_conversation failed: %s", e)
 
         input_box = pick_first_visible(page, CHAT_INPUT_SELECTORS)
         if not input_box:
@@ -824,40 +1104,33 @@ def send_prompt_and_collect(
             )
 
     # Ensure '联网搜索' online mode is enabled before sending
-    ensure_online_mode_enabled(page)
+    mode_online = ensure_online_mode_enabled(page)
 
     # Count assistant messages before sending
     assistant_before = 0
     try:
-        message_list = page.locator(MESSAGE_LIST_SELECTOR)
+        message_list = _loc(page, MESSAGE_LIST_SELECTOR)
         if message_list.count() > 0:
             assistant_before = message_list.locator("div.ds-message._63c77b1").count()
     except Exception:
         pass
 
     # Input prompt
-    print(f"[INFO] Sending prompt: {prompt_text[:50]}...")
-    # 直接聚焦，不再等待 click 完成，避免因前端动画/抖动导致的超时告警
-    try:
-        input_box.evaluate("el => el.focus()")
-    except Exception:
-        pass
-    time.sleep(0.05)
-
-    # Type the prompt（减少间隔，加快输入）
-    page.keyboard.type(prompt_text)
-    time.sleep(0.15)
+    logger.info("Sending prompt: %s...", prompt_text[:50])
+    # fill() focuses the textarea and sets the whole value with one input
+    # event, instead of one key event per character as keyboard.type did
+    input_box.fill(prompt_text)
 
     # Send via Enter key (more reliable than button click for DeepSeek)
-    send_ts = time.time()
-    print("[DEBUG] Pressing Enter to send DeepSeek prompt (no click on send button)")
+    send_ts = time.monotonic()
+    logger.debug("Pressing Enter to send DeepSeek prompt (no click on send button)")
     page.keyboard.press("Enter")
 
     # Wait for response
     response_text, inline_citations = wait_for_stream_completion_and_get_text(
         page, assistant_before, timeout_seconds=300
     )
-    latency_ms = int((time.time() - send_ts) * 1000)
+    latency_ms = int((time.monotonic() - send_ts) * 1000)
 
     url = page.url
     conversation_id = get_conversation_id_from_url(url)
@@ -867,7 +1140,7 @@ def send_prompt_and_collect(
     had_web_search_button = False
     try:
         # Get the latest assistant message container
-        message_list = page.locator(MESSAGE_LIST_SELECTOR)
+        message_list = _loc(page, MESSAGE_LIST_SELECTOR)
         if message_list.count() > 0:
             messages = message_list.locator("div.ds-message._63c77b1")
             if messages.count() > 0:
@@ -876,7 +1149,7 @@ def send_prompt_and_collect(
                     page, last_message
                 )
     except Exception as e:
-        print(f"[WARN] Failed to extract web search results: {e}")
+        logger.warning("Failed to extract web search results: %s", e)
 
     # Try to detect model name (if visible in UI)
     model_name = ""
@@ -888,7 +1161,7 @@ def send_prompt_and_collect(
         ]
         for selector in model_indicators:
             try:
-                elem = page.locator(selector).first
+                elem = _loc(page, selector).first
                 if elem and elem.is_visible():
                     model_name = elem.inner_text().strip()
                     if model_name:
@@ -898,20 +1171,6 @@ def send_prompt_and_collect(
     except Exception:
         pass
 
-    # Detect online mode from toggle buttons
-    mode_online = ""
-    try:
-        # Look for "联网搜索" toggle button
-        online_toggle = page.locator('button:has-text("联网搜索")').first
-        if online_toggle and online_toggle.is_visible():
-            # Check if button has selected/active class
-            classes = online_toggle.get_attribute("class") or ""
-            mode_online = (
-                "true" if "selected" in classes or "active" in classes else "false"
-            )
-    except Exception:
-        pass
-
     # Determine status：如果有 web search 按钮但没解析出任何结果，则视为错误
     status = "ok"
     error_message = ""
@@ -942,67 +1201,99 @@ def send_prompt_and_collect(
     return item
 
 
+# Output files stay open as raw O_APPEND descriptors for the whole task:
+# every record is handed to the kernel with a single os.write.
+_OUTPUT_FDS: Dict[str, int] = {}
+_OUTPUT_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, "O_BINARY", 0)
+
+
+def _get_fd(path: str) -> int:
+    fd = _OUTPUT_FDS.get(path)
+    if fd is None:
+        fd = os.open(path, _OUTPUT_FLAGS, 0o644)
+        _OUTPUT_FDS[path] = fd
+    return fd
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view) :]
+
+
+def close_output_fds(*paths: str) -> None:
+    """Close the cached descriptors of the given paths (all when none given)."""
+    for path in paths or list(_OUTPUT_FDS):
+        fd = _OUTPUT_FDS.pop(path, None)
+        if fd is not None:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+atexit.register(close_output_fds)
+
+
 def write_outputs(
     ndjson_path: str, md_path: str, items: List[Dict[str, Optional[str]]]
 ) -> None:
     if not items:
         return
 
-    # Determine write mode
-    ndjson_mode = "a" if os.path.exists(ndjson_path) else "w"
-    md_mode = "a" if os.path.exists(md_path) else "w"
-
-    # Write NDJSON
-    with open(ndjson_path, ndjson_mode, encoding="utf-8") as f:
-        for it in items:
-            f.write(json.dumps(it, ensure_ascii=False) + "\n")
-
-    # Write markdown
-    with open(md_path, md_mode, encoding="utf-8") as f:
-        for it in items:
-            conv_id = it.get("conversation_id") or "unknown"
-            f.write(f"# Conversation {conv_id}\n\n")
-            f.write(f"- **Website**: {it.get('website_name')}\n")
-            f.write(f"- **URL**: {it.get('item_url')}\n")
-            f.write(f"- **Model**: {it.get('model_name')}\n")
-            f.write(f"- **Online Mode**: {it.get('mode_online')}\n")
-            f.write(f"- **Language**: {it.get('response_language')}\n")
-            f.write(f"- **Latency**: {it.get('latency_ms')} ms\n")
-
-            f.write("\n## Prompt\n\n")
-            f.write((it.get("prompt_text") or "").strip() + "\n\n")
-
-            f.write("## Response\n\n")
-            f.write((it.get("response_text") or "").strip() + "\n\n")
-
-            # Write web search results if available
-            web_search_results = it.get("web_search_results", [])
-            if web_search_results:
-                f.write("## Web Search Results\n\n")
-                for idx, result in enumerate(web_search_results, 1):
-                    title = result.get("title", "Search Result")
-                    href = result.get("href", "")
-                    snippet = result.get("snippet", "")
-
-                    f.write(f"### {idx}. {title}\n\n")
-                    if href:
-                        f.write(f"- **URL**: {href}\n")
-                    if snippet:
-                        f.write(f"- **Snippet**: {snippet}\n")
-                    f.write("\n")
-
-            f.write("---\n\n")
+    # Write NDJSON: one os.write for the whole batch
+    _write_all(_get_fd(ndjson_path), b"".join(_json_dumps(it) + b"\n" for it in items))
+
+    # Write markdown: one formatted block per item, one os.write per item
+    md_fd = _get_fd(md_path)
+    for it in items:
+        get = it.get
+        conv_id = get("conversation_id") or "unknown"
+        blocks = [
+            f"# Conversation {conv_id}\n\n"
+            f"- **Website**: {get('website_name')}\n"
+            f"- **URL**: {get('item_url')}\n"
+            f"- **Model**: {get('model_name')}\n"
+            f"- **Online Mode**: {get('mode_online')}\n"
+            f"- **Language**: {get('response_language')}\n"
+            f"- **Latency**: {get('latency_ms')} ms\n"
+            f"\n## Prompt\n\n{(get('prompt_text') or '').strip()}\n\n"
+            f"## Response\n\n{(get('response_text') or '').strip()}\n\n"
+        ]
+
+        # Write web search results if available
+        web_search_results = get("web_search_results", [])
+        if web_search_results:
+            add_block = blocks.append
+            add_block("## Web Search Results\n\n")
+            for idx, result in enumerate(web_search_results, 1):
+                result_get = result.get
+                block = f"### {idx}. {result_get('title', 'Search Result')}\n\n"
+                href = result_get("href")
+                if href:
+                    block += f"- **URL**: {href}\n"
+                snippet = result_get("snippet")
+                if snippet:
+                    block += f"- **Snippet**: {snippet}\n"
+                add_block(block + "\n")
+
+        blocks.append("---\n\n")
+        _write_all(md_fd, "".join(blocks).encode("utf-8"))
 
 
 def human_think_time(min_s: float = 0.8, max_s: float = 2.2) -> None:
     """Artificial delay helper.
 
     为了整体加速，这里的默认延迟区间建议保持较小；如需更保守可在调用处覆盖。
+    With DEEPSEEK_PARALLELISM > 1 this is a no-op: request spacing is left to
+    the shared send gap (SCRAPER_RATE_LIMIT_DELAY) instead.
     """
+    if DEEPSEEK_PARALLELISM > 1:
+        return
     time.sleep(random.uniform(min_s, max_s))
 
 
-def click_new_conversation(page) -> bool:
+def click_new_conversation(page, chat_input=None) -> bool:
     """
     Reset to a fresh DeepSeek conversation.
 
@@ -1010,77 +1301,147 @@ def click_new_conversation(page) -> bool:
     不再依赖页面上的「开启新对话」按钮及其具体 DOM 结构 / 文案。
     """
     try:
-        print("[INFO] Starting new DeepSeek conversation via home URL reload...")
+        logger.info("Starting new DeepSeek conversation via home URL reload...")
 
         # 直接跳转到首页，相当于点击「开启新对话」
-        page.goto(DEEPSEEK_HOME_URL)
-        page.wait_for_load_state()
-        # 页面通常加载很快，缩短额外等待
-        time.sleep(0.4)
+        if FAST_NEW_CONVERSATION:
+            # SPA shell is usable long before the load event; the input wait below gates it
+            page.goto(DEEPSEEK_HOME_URL, wait_until="domcontentloaded")
+        else:
+            page.goto(DEEPSEEK_HOME_URL)
 
-        # 等待输入框准备就绪
-        for selector in CHAT_INPUT_SELECTORS:
-            try:
-                elem = page.locator(selector).first
-                if elem.is_visible(timeout=5000):
-                    print("[INFO] New DeepSeek conversation ready")
-                    return True
-            except Exception:
-                continue
+        # 等待输入框准备就绪：候选选择器合成一个只匹配可见元素的定位器，只等待一次
+        if chat_input is None:
+            chat_input = chat_input_locator(page)
+        try:
+            chat_input.first.wait_for(state="visible", timeout=PAGE_DEFAULT_TIMEOUT_MS)
+        except PlaywrightTimeoutError:
+            logger.warning("New DeepSeek conversation may not be fully loaded")
+            return False
 
-        print("[WARN] New DeepSeek conversation may not be fully loaded")
-        return False
+        logger.info("New DeepSeek conversation ready")
+        return True
     except Exception as e:
-        print(f"[WARN] Failed to start new DeepSeek conversation via home URL: {e}")
+        logger.warning("Failed to start new DeepSeek conversation via home URL: %s", e)
         return False
 
 
 def extract_task_name(input_file: str) -> str:
     """Extract task name from input file name."""
-    basename = os.path.basename(input_file)
-    if basename.endswith("_input_prompts.txt"):
-        return basename[: -len("_input_prompts.txt")]
+    basename = input_file.rpartition(os.sep)[2]
+    head, sep, tail = basename.rpartition(INPUT_FILE_SUFFIX)
+    if sep and not tail:
+        return head
     elif basename.endswith(".txt"):
         return basename[:-4]
     else:
         return basename
 
 
+def _parse_ok_record(raw: bytes) -> Optional[Dict]:
+    """The record of an NDJSON line if it is a status == "ok" result, else None."""
+    # Lines that cannot be a result record are skipped before any decoding
+    if b'"prompt_text"' not in raw:
+        return None
+    try:
+        item = _json_loads(raw)
+    except ValueError:
+        return None
+    if not isinstance(item, dict) or item.get("status", "ok") != "ok":
+        return None
+    return item
+
+
+def _scan_ndjson_range(job: Tuple[str, int, int]) -> Tuple[set, int]:
+    """
+    Fingerprints of the ok records whose lines start in [start, end) of the
+    file, plus the number of non-empty lines that are not ok records.
+    Top-level so it can run in a multiprocessing worker.
+    """
+    path, start, end = job
+    processed = set()
+    add = processed.add
+    dropped = 0
+    with open(path, "rb") as f:
+        if start:
+            # Align to the first line starting at or after start
+            f.seek(start - 1)
+            f.readline()
+        pos = f.tell()
+        while pos < end:
+            raw = f.readline()
+            if not raw:
+                break
+            pos += len(raw)
+            item = _parse_ok_record(raw)
+            if item is None:
+                if raw.strip():
+                    dropped += 1
+                continue
+            prompt_text = item.get("prompt_text")
+            if not isinstance(prompt_text, str):
+                continue
+            prompt_text = prompt_text.strip()
+            if prompt_text:
+                try:
+                    add(prompt_fingerprint(prompt_text))
+                except UnicodeError:
+                    # e.g. a lone surrogate escape: no input line can equal it
+                    continue
+    return processed, dropped
+
+
+def _scan_ndjson(ndjson_path: str) -> Tuple[set, int]:
+    size = os.path.getsize(ndjson_path)
+    workers = os.cpu_count() or 1
+    if size >= PARALLEL_NDJSON_MIN_BYTES and workers > 1:
+        step = -(-size // workers)
+        ranges = [
+            (ndjson_path, start, min(start + step, size))
+            for start in range(0, size, step)
+        ]
+        try:
+            with multiprocessing.Pool(workers) as mp:
+                results = mp.map(_scan_ndjson_range, ranges)
+            return (
+                set().union(*(r[0] for r in results)),
+                sum(r[1] for r in results),
+            )
+        except Exception as e:
+            logger.warning("Parallel NDJSON scan failed, reading sequentially: %s", e)
+    return _scan_ndjson_range((ndjson_path, 0, size))
+
+
 def load_processed_prompts(ndjson_path: str) -> set:
-    """Load already processed prompts from existing NDJSON file."""
+    """
+    Load already processed prompts from existing NDJSON file.
+    Returns the set of their prompt_fingerprint() digests.
+    Files of PARALLEL_NDJSON_MIN_BYTES or more are parsed on all cores.
+    """
     if not os.path.exists(ndjson_path):
         return set()
 
-    processed = set()
-    ok_items: List[Dict[str, Optional[str]]] = []
     try:
-        with open(ndjson_path, "r", encoding="utf-8") as f:
-            for line in f:
-                if line.strip():
-                    try:
-                        item = json.loads(line)
-                        prompt_text = item.get("prompt_text", "").strip()
-                        status = item.get("status", "ok")
-                        if status == "ok":
-                            ok_items.append(item)
-                            if prompt_text:
-                                processed.add(prompt_text)
-                    except json.JSONDecodeError:
-                        continue
-        # Rewrite NDJSON to keep only status == "ok" items
-        try:
-            with open(ndjson_path, "w", encoding="utf-8") as wf:
-                for it in ok_items:
-                    wf.write(json.dumps(it, ensure_ascii=False) + "\n")
-        except Exception as e:
-            print(f"[WARN] Failed to rewrite NDJSON with ok items only: {e}")
+        processed, dropped = _scan_ndjson(ndjson_path)
+
+        # Rewrite NDJSON to keep only status == "ok" items (only when needed)
+        if dropped:
+            tmp_path = ndjson_path + ".tmp"
+            try:
+                with open(ndjson_path, "rb") as f, open(tmp_path, "wb") as wf:
+                    for raw in f:
+                        if _parse_ok_record(raw) is not None:
+                            wf.write(raw if raw.endswith(b"\n") else raw + b"\n")
+                os.replace(tmp_path, ndjson_path)
+            except Exception as e:
+                logger.warning("Failed to rewrite NDJSON with ok items only: %s", e)
 
-        print(
-            f"[INFO] Found {len(processed)} already processed prompts (kept only status='ok')"
+        logger.info(
+            "Found %s already processed prompts (kept only status='ok')", len(processed)
         )
         return processed
     except Exception as e:
-        print(f"[WARN] Failed to load processed prompts: {e}")
+        logger.warning("Failed to load processed prompts: %s", e)
         return set()
 
 
@@ -1117,9 +1478,10 @@ def main() -> None:
         worker_count = args.spawn_workers
         script_path = os.path.abspath(__file__)
 
-        print(
-            f"[INFO] Spawning {worker_count} DeepSeek worker processes "
-            f"for shards 0..{worker_count - 1}"
+        logger.info(
+            "Spawning %s DeepSeek worker processes for shards 0..%s",
+            worker_count,
+            worker_count - 1,
         )
 
         processes = []
@@ -1132,7 +1494,7 @@ def main() -> None:
                 "--shard-count",
                 str(worker_count),
             ]
-            print(f"[INFO]  - Starting worker shard {i}/{worker_count} with: {cmd}")
+            logger.info(" - Starting worker shard %s/%s with: %s", i, worker_count, cmd)
             proc = subprocess.Popen(cmd)
             processes.append(proc)
             # 略微错峰，避免同时抢资源
@@ -1143,23 +1505,25 @@ def main() -> None:
         for i, p in enumerate(processes):
             code = p.wait()
             exit_codes.append(code)
-            print(f"[INFO] Worker shard {i} exited with code {code}")
+            logger.info("Worker shard %s exited with code %s", i, code)
 
         # 如果有任意非零退出码，把整体退出码设为非零，方便上层监控
         if any(code != 0 for code in exit_codes):
-            print("[WARN] Some DeepSeek shards exited with non-zero status")
+            logger.warning("Some DeepSeek shards exited with non-zero status")
             sys.exit(1)
         else:
-            print("[INFO] All DeepSeek shards completed successfully")
+            logger.info("All DeepSeek shards completed successfully")
             return
 
     # Worker 模式：真正执行某个 shard 的抓取任务
     if args.shard_count <= 0:
-        print("[ERROR] --shard-count must be >= 1")
+        logger.error("--shard-count must be >= 1")
         return
     if not (0 <= args.shard_index < args.shard_count):
-        print(
-            f"[ERROR] --shard-index must be in [0, {args.shard_count - 1}], got {args.shard_index}"
+        logger.error(
+            "--shard-index must be in [0, %s], got %s",
+            args.shard_count - 1,
+            args.shard_index,
         )
         return
 
@@ -1167,37 +1531,44 @@ def main() -> None:
 
     # Find all input files matching pattern *_input_prompts.txt
     project_root = os.path.dirname(os.path.dirname(__file__))
-    import glob
-
-    input_files = glob.glob(os.path.join(project_root, "*_input_prompts.txt"))
+    with os.scandir(project_root or os.curdir) as it:
+        input_names = [
+            e.name for e in it if e.name.endswith(INPUT_FILE_SUFFIX) and e.is_file()
+        ]
+    input_files = [os.path.join(project_root, name) for name in input_names]
 
     if not input_files:
-        print("[WARN] No input files found matching pattern '*_input_prompts.txt'")
-        print("[INFO] Looking for 'input_prompts.txt' as fallback...")
+        logger.warning("No input files found matching pattern '*_input_prompts.txt'")
+        logger.info("Looking for 'input_prompts.txt' as fallback...")
         fallback = os.path.join(project_root, "input_prompts.txt")
         if os.path.exists(fallback):
+            input_names = ["input_prompts.txt"]
             input_files = [fallback]
         else:
-            print("[ERROR] No input files found. Please create a file with prompts.")
+            logger.error("No input files found. Please create a file with prompts.")
             return
 
-    print(
-        f"[INFO] Found {len(input_files)} input file(s): {[os.path.basename(f) for f in input_files]}"
+    logger.info(
+        "Found %s input file(s): %s", len(input_files), input_names
     )
 
-    # Process each input file as a separate task
+    # Process each input file as a separate task; the browser workers are
+    # started on the first task that has prompts and shared by all of them
+    pool = BrowserWorkerPool(DEEPSEEK_PARALLELISM)
+    try:
+        run_input_files(pool, input_files, args)
+    finally:
+        pool.close()
+
+
+def run_input_files(pool: "BrowserWorkerPool", input_files: List[str], args) -> None:
     for input_file in input_files:
         task_name = extract_task_name(input_file)
-        print(f"\n{'='*60}")
-        print(f"[INFO] Processing task: {task_name}")
-        print(f"[INFO] Input file: {input_file}")
-        print(f"[INFO] Shard: index={args.shard_index}, count={args.shard_count}")
-        print(f"{'='*60}\n")
-
-        prompts = read_prompts(input_file)
-        if not prompts:
-            print(f"[WARN] No prompts found in {input_file}, skipping...")
-            continue
+        logger.info("=" * 60)
+        logger.info("Processing task: %s", task_name)
+        logger.info("Input file: %s", input_file)
+        logger.info("Shard: index=%s, count=%s", args.shard_index, args.shard_count)
+        logger.info("=" * 60)
 
         # Generate output file names
         output_ndjson = os.path.join(
@@ -1208,183 +1579,427 @@ def main() -> None:
         # Load already processed prompts (also normalizes NDJSON to status=='ok')
         processed_prompts = load_processed_prompts(output_ndjson)
 
-        # Filter out already processed prompts
-        new_prompts = [p for p in prompts if p.strip() not in processed_prompts]
-
-        if not new_prompts:
-            print(f"[INFO] All prompts in {task_name} have been processed. Skipping...")
-            continue
-
-        if len(new_prompts) < len(prompts):
-            print(
-                f"[INFO] Skipping {len(prompts) - len(new_prompts)} already processed prompts"
-            )
-            print(f"[INFO] Processing {len(new_prompts)} new prompts")
+        # Stream unseen prompts straight from the input file
+        new_prompts: Iterator[str] = iter_new_prompts(input_file, processed_prompts)
 
         # Apply sharding: keep only prompts whose index matches this shard
         if args.shard_count > 1:
-            sharded_prompts = [
+            new_prompts = (
                 p
                 for idx, p in enumerate(new_prompts)
                 if idx % args.shard_count == args.shard_index
-            ]
-            print(
-                f"[INFO] After sharding, this shard will process {len(sharded_prompts)} prompts"
             )
-        else:
-            sharded_prompts = new_prompts
 
-        if not sharded_prompts:
-            print(
-                f"[INFO] No prompts assigned to shard {args.shard_index} for task '{task_name}', skipping..."
+        # Peek one prompt to keep the "nothing to do" short-circuit
+        first_prompt = next(new_prompts, None)
+        if first_prompt is None:
+            logger.info(
+                "No new prompts in %s for shard %s. Skipping...",
+                task_name,
+                args.shard_index,
             )
             continue
 
-        process_task(task_name, sharded_prompts, output_ndjson, output_md)
+        process_task(
+            pool,
+            task_name,
+            itertools.chain([first_prompt], new_prompts),
+            output_ndjson,
+            output_md,
+        )
 
 
-def process_task(
-    task_name: str, prompts: List[str], output_ndjson: str, output_md: str
-) -> None:
-    """Process a single task with its prompts."""
-
-    print("\n" + "=" * 60)
-    print("⚠️  IMPORTANT: A NEW BROWSER WINDOW WILL OPEN")
-    print("    Please login in THE NEW BROWSER WINDOW opened by the script")
-    print("    NOT in your regular browser!")
-    print("=" * 60 + "\n")
-
-    with Camoufox(
-        humanize=True,
-        geoip=False,
-        locale="zh-CN",
-        headless=False,  # Explicitly show browser window
-    ) as browser:
-        page = browser.new_page(
-            locale="zh-CN",
+def open_deepseek_session(page, persist: bool = True) -> bool:
+    """
+    Navigate to DeepSeek (the saved session is already applied to the
+    context) and wait for the chat UI, falling back to a manual login.
+    Persists the session on success when persist is set.
+    """
+    logger.info("Opening DeepSeek in the Camoufox browser window...")
+    page.goto(DEEPSEEK_HOME_URL, wait_until="domcontentloaded")
+
+    # Fast path: saved session is still valid, skip the interactive login flow
+    if has_saved_session() and is_chat_ui_ready(page, timeout=5000):
+        logger.info("✓ Saved session restored, chat interface ready.")
+    else:
+        logger.info("Waiting for manual login (up to 5 minutes).")
+        logger.info(
+            "Please login to DeepSeek and wait for the chat interface to appear."
         )
 
-        # Load cookies before navigation
-        load_cookies_into_context(page, SESSION_COOKIES_FILE)
+        if not wait_for_login(page, timeout_seconds=300):
+            logger.error("Login not detected within timeout. Please login and rerun.")
+            return False
+
+    prewarm_locators(page)
+
+    # Persist session after successful login
+    if persist:
+        save_session_state(page.context)
+    return True
+
+
+# Last HTTP 429 seen per page (id(page) -> {"status", "retry_after"}),
+# filled by a response listener attached on first use
+_THROTTLE_STATE: Dict[int, Dict[str, object]] = {}
+_RATE_LOCK = threading.Lock()
+_last_send_ts = 0.0
+
+
+def _throttle_state(page) -> Dict[str, object]:
+    state = _THROTTLE_STATE.get(id(page))
+    if state is None:
+        state = {}
+        _THROTTLE_STATE[id(page)] = state
+
+        def on_response(response) -> None:
+            try:
+                if response.status == 429:
+                    state["status"] = 429
+                    state["retry_after"] = response.headers.get("retry-after")
+            except Exception:
+                pass
+
+        page.on("response", on_response)
+    return state
+
 
-        print(f"[INFO] Opening DeepSeek in the Camoufox browser window...")
-        page.goto(DEEPSEEK_HOME_URL)
-        page.wait_for_load_state()
+def _wait_for_send_slot() -> None:
+    """Enforce SCRAPER_RATE_LIMIT_DELAY between sends across all workers."""
+    global _last_send_ts
+    if SCRAPER_RATE_LIMIT_DELAY <= 0:
+        return
+    with _RATE_LOCK:
+        wait = _last_send_ts + SCRAPER_RATE_LIMIT_DELAY - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        _last_send_ts = time.monotonic()
+
+
+# HTTP 429 as a whole number, or the usual throttling phrases; a bare "rate"
+# would also match generate / iterate / separate
+_RE_RATE_LIMIT = re.compile(
+    r"\b429\b|rate[\s_-]?limit|too many requests", re.IGNORECASE
+)
 
-        # Restore storage
-        load_storage_from_file(page, SESSION_STORAGE_FILE)
 
-        # Reload to apply storage
+def _is_rate_limit_error(exc: Exception) -> bool:
+    return _RE_RATE_LIMIT.search(str(exc)) is not None
+
+
+def _send_with_backoff(page, prompt: str) -> Dict[str, Optional[str]]:
+    """
+    send_prompt_and_collect behind the shared send gap, retried with
+    exponential backoff (honoring Retry-After) while DeepSeek throttles.
+    """
+    state = _throttle_state(page)
+    for attempt in range(RATE_LIMIT_MAX_RETRIES):
+        _wait_for_send_slot()
+        state.clear()
+        error: Optional[Exception] = None
+        item: Dict[str, Optional[str]] = {}
         try:
-            page.goto(DEEPSEEK_HOME_URL)
-            page.wait_for_load_state()
-        except Exception:
-            pass
+            item = send_prompt_and_collect(
+                page, prompt_text=prompt, website_name="DEEPSEEK"
+            )
+        except Exception as e:
+            error = e
 
-        print("[INFO] Waiting for manual login (up to 5 minutes).")
-        print(
-            "[INFO] Please login to DeepSeek and wait for the chat interface to appear."
+        throttled = state.get("status") == 429 or (
+            error is not None and _is_rate_limit_error(error)
         )
+        if not throttled or attempt == RATE_LIMIT_MAX_RETRIES - 1:
+            if error is not None:
+                raise error
+            return item
 
-        if not wait_for_login(page, timeout_seconds=300):
-            print("[ERROR] Login not detected within timeout. Please login and rerun.")
+        delay = min(60.0, 0.5 * 2**attempt)
+        try:
+            delay = max(delay, float(state.get("retry_after") or 0))
+        except (TypeError, ValueError):
+            pass  # Retry-After given as an HTTP date
+        logger.warning(
+            "DeepSeek rate limit detected, backing off %.1fs (attempt %s/%s)",
+            delay,
+            attempt + 1,
+            RATE_LIMIT_MAX_RETRIES,
+        )
+        time.sleep(delay)
+        click_new_conversation(page)
+    return {}
+
+
+def collect_with_retries(
+    page, prompt: str, max_retries: int = 3
+) -> Dict[str, Optional[str]]:
+    """send_prompt_and_collect with up to max_retries attempts until status is "ok"."""
+    item: Dict[str, Optional[str]] = {}
+    for attempt in range(1, max_retries + 1):
+        try:
+            item = _send_with_backoff(page, prompt)
+        except Exception as e:
+            logger.error(
+                "Failed to process prompt (attempt %s/%s): %s", attempt, max_retries, e
+            )
+            url = page.url
+            item = {
+                "website_name": "DEEPSEEK",
+                "conversation_id": get_conversation_id_from_url(url),
+                "item_url": url,
+                "model_name": "",
+                "mode_online": "",
+                "prompt_text": prompt,
+                "response_text": "",
+                "web_search_results": [],
+                "response_language": "",
+                "latency_ms": 0,
+                "status": "error",
+                "error_message": str(e),
+            }
+
+        status = item.get("status", "ok")
+        if status == "ok":
+            break
+
+        if attempt < max_retries:
+            logger.warning(
+                "Prompt failed with status '%s', retrying after short delay...", status
+            )
+            time.sleep(random.uniform(0.5, 1.2))
+    return item
+
+
+# Queue marker for BrowserWorkerPool.checkpoint_session
+_CHECKPOINT = object()
+
+
+class BrowserWorkerPool:
+    """
+    DeepSeek browser workers that live for the whole run: each worker thread
+    opens its own Camoufox window and logs in once, then serves prompts of
+    every task, so input files after the first pay no browser cold start.
+    Worker 0 establishes the login; the others wait for it and reuse the
+    saved storage_state.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = max(1, size)
+        self.prompt_queue: "queue.Queue" = queue.Queue()
+        self.session_ready = threading.Event()
+        self.session_ok = False
+        self.threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        if self.threads:
             return
+        if not has_saved_session():
+            logger.warning(
+                "⚠️  IMPORTANT: A NEW BROWSER WINDOW WILL OPEN\n"
+                "    Please login in THE NEW BROWSER WINDOW opened by the script\n"
+                "    NOT in your regular browser!\n" + "=" * 60
+            )
+        if self.size > 1:
+            logger.info("Running %s DeepSeek browser workers in parallel", self.size)
+        for i in range(self.size):
+            t = threading.Thread(
+                target=self._worker, args=(i,), name=f"deepseek-worker-{i}", daemon=True
+            )
+            t.start()
+            self.threads.append(t)
 
-        # Persist session after successful login
-        save_cookies_from_context(page, SESSION_COOKIES_FILE)
-        save_storage_to_file(page, SESSION_STORAGE_FILE)
+    def alive(self) -> bool:
+        return any(t.is_alive() for t in self.threads)
 
-        total_processed = 0
-        consecutive_failures = 0
-        for idx, prompt in enumerate(prompts):
-            print(f"\n[INFO] Processing prompt {idx + 1}/{len(prompts)}")
-
-            # Always click "New Conversation" before each prompt to ensure clean state
-            if idx == 0:
-                # For the first prompt, ensure we're in a new conversation
-                print("[INFO] Starting new conversation for first prompt...")
-                human_think_time(0.2, 0.5)
-                click_new_conversation(page)
-                human_think_time(0.2, 0.5)
-
-            # Retry up to 3 times if status is not "ok"
-            max_retries = 3
-            item: Dict[str, Optional[str]] = {}
-            for attempt in range(1, max_retries + 1):
+    def close(self) -> None:
+        """Stop the workers; worker 0 saves the session, each closes its browser."""
+        # Drop prompts nobody is waiting for any more (e.g. after Ctrl+C)
+        try:
+            while True:
+                self.prompt_queue.get_nowait()
+        except queue.Empty:
+            pass
+        for _ in self.threads:
+            self.prompt_queue.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
+
+    def checkpoint_session(self, timeout: float = 60.0) -> None:
+        """
+        Have worker 0 persist the session now (workers own their pages, so
+        this goes through the queue). One marker per live worker plus a
+        barrier makes sure every worker takes exactly one.
+        """
+        alive = sum(1 for t in self.threads if t.is_alive())
+        if not alive:
+            return
+        barrier = threading.Barrier(alive + 1)
+        for _ in range(alive):
+            self.prompt_queue.put((_CHECKPOINT, barrier))
+        try:
+            barrier.wait(timeout)
+        except threading.BrokenBarrierError:
+            logger.warning("Session checkpoint timed out")
+
+    def _worker(self, worker_id: int) -> None:
+        if worker_id > 0:
+            self.session_ready.wait()
+            if not self.session_ok:
+                return
+        try:
+            with Camoufox(
+                humanize=True,
+                geoip=False,
+                locale="zh-CN",
+                headless=False,  # Explicitly show browser window
+            ) as browser:
+                # Cookies + localStorage are applied before the first navigation
+                context = browser.new_context(
+                    locale="zh-CN",
+                    storage_state=load_session_state(),
+                )
+                # Stray waits give up after 15s instead of Playwright's 30s default
+                context.set_default_timeout(PAGE_DEFAULT_TIMEOUT_MS)
+                context.set_default_navigation_timeout(PAGE_NAVIGATION_TIMEOUT_MS)
+                page = context.new_page()
                 try:
-                    item = send_prompt_and_collect(
-                        page, prompt_text=prompt, website_name="DEEPSEEK"
-                    )
-                except Exception as e:
-                    print(
-                        f"[ERROR] Failed to process prompt (attempt {attempt}/{max_retries}): {e}"
-                    )
-                    url = page.url
-                    item = {
-                        "website_name": "DEEPSEEK",
-                        "conversation_id": get_conversation_id_from_url(url),
-                        "item_url": url,
-                        "model_name": "",
-                        "mode_online": "",
-                        "prompt_text": prompt,
-                        "response_text": "",
-                        "web_search_results": [],
-                        "response_language": "",
-                        "latency_ms": 0,
-                        "status": "error",
-                        "error_message": str(e),
-                    }
+                    self._serve(worker_id, page)
+                finally:
+                    _forget_page(page)
+                    context.close()
+        finally:
+            # Never leave the other workers waiting, e.g. if the browser failed to launch
+            if worker_id == 0:
+                self.session_ready.set()
+
+    def _serve(self, worker_id: int, page) -> None:
+        logged_in = False
+        try:
+            # Only worker 0 writes the session file; the others reuse it
+            logged_in = open_deepseek_session(page, persist=worker_id == 0)
+        finally:
+            if worker_id == 0:
+                self.session_ok = logged_in
+                self.session_ready.set()
+        if not logged_in:
+            return
 
-                status = item.get("status", "ok")
-                if status == "ok":
-                    break
+        consecutive_failures = 0
+        first = True
+        chat_input = chat_input_locator(page)
+        while True:
+            job = self.prompt_queue.get()
+            if job is None:
+                break
+            if job[0] is _CHECKPOINT:
+                if worker_id == 0:
+                    save_session_state(page.context)
+                try:
+                    job[1].wait(60)
+                except threading.BrokenBarrierError:
+                    pass
+                continue
+            idx, prompt, results = job
+            logger.info("Processing prompt #%s", idx + 1)
 
-                if attempt < max_retries:
-                    print(
-                        f"[WARN] Prompt failed with status '{status}', retrying after short delay..."
-                    )
-                    human_think_time(0.5, 1.2)
+            item: Dict[str, Optional[str]] = {}
+            try:
+                # Always start a new conversation before each prompt to ensure clean state
+                if first:
+                    logger.info("Starting new conversation for first prompt...")
+                if HUMANIZE and first:
+                    human_think_time(0.2, 0.5)
+                elif HUMANIZE:
+                    human_think_time(0.3, 0.7)
+                click_new_conversation(page, chat_input)
+                if HUMANIZE:
+                    human_think_time(0.2, 0.5)
+                first = False
+
+                item = collect_with_retries(page, prompt)
+            finally:
+                # Always report back so the task knows this prompt is finished
+                results.put((idx, item))
+                flush_log()
 
             # If still not ok after retries, skip saving this prompt
             if item.get("status") != "ok":
-                print(
-                    f"[ERROR] Prompt failed after {max_retries} attempts, skipping save for this prompt."
+                logger.error(
+                    "Prompt %s failed after 3 attempts, skipping save for this prompt.",
+                    idx + 1,
                 )
                 consecutive_failures += 1
             else:
-                print(f"[INFO] Saving result {idx + 1}/{len(prompts)}...")
-                write_outputs(output_ndjson, output_md, [item])
-                total_processed += 1
                 consecutive_failures = 0
-                print(f"[INFO] ✓ Saved to {os.path.basename(output_ndjson)}")
-
-            # Start a new conversation for the next prompt
-            if idx < len(prompts) - 1:
-                human_think_time(0.3, 0.7)
-                click_new_conversation(page)
-                human_think_time(0.2, 0.5)
 
             # 如果连续多次未成功，暂停 5 分钟，避免持续失败
             if consecutive_failures >= 5:
-                print(
-                    "[WARN] Detected 5 consecutive non-ok results. Sleeping for 5 minutes to avoid cascading failures..."
+                logger.warning(
+                    "Detected 5 consecutive non-ok results. Sleeping for 5 minutes to avoid cascading failures..."
                 )
                 time.sleep(300)
                 consecutive_failures = 0
 
         # Save session state at the end
-        save_cookies_from_context(page, SESSION_COOKIES_FILE)
-        save_storage_to_file(page, SESSION_STORAGE_FILE)
-
-        print(f"\n{'='*60}")
-        print(f"[INFO] ✓ Task '{task_name}' completed!")
-        print(f"[INFO] Processed {total_processed} prompts")
-        print(f"[INFO] Results saved to:")
-        print(f"  - {output_ndjson}")
-        print(f"  - {output_md}")
-        print(f"{'='*60}\n")
-
-        # input("Press Enter to continue...")
+        if worker_id == 0:
+            save_session_state(page.context)
+
+
+def process_task(
+    pool: BrowserWorkerPool,
+    task_name: str,
+    prompts: Iterable[str],
+    output_ndjson: str,
+    output_md: str,
+) -> None:
+    """Process a single task with its prompts on the shared browser workers."""
+    pool.start()
+
+    results: "queue.Queue" = queue.Queue()
+    total = 0
+    for prompt in prompts:
+        pool.prompt_queue.put((total, prompt, results))
+        total += 1
+    logger.info("Queued %s prompts for task '%s'", total, task_name)
+
+    # The calling thread is the single writer for this task's outputs
+    total_processed = 0
+    pending = total
+    try:
+        while pending > 0:
+            try:
+                idx, item = results.get(timeout=1.0)
+            except queue.Empty:
+                if not pool.alive():
+                    logger.error("All DeepSeek workers have stopped, aborting task")
+                    break
+                continue
+            pending -= 1
+            if item.get("status") != "ok":
+                continue
+            try:
+                logger.info("Saving result %s/%s...", idx + 1, total)
+                write_outputs(output_ndjson, output_md, [item])
+                total_processed += 1
+                logger.info("✓ Saved to %s", os.path.basename(output_ndjson))
+            except Exception as e:
+                logger.error("Failed to save result %s: %s", idx + 1, e)
+            flush_log()
+    finally:
+        close_output_fds(output_ndjson, output_md)
+
+    logger.info("=" * 60)
+    logger.info("✓ Task '%s' completed!", task_name)
+    logger.info("Processed %s prompts", total_processed)
+    logger.info("Results saved to:\n  - %s\n  - %s", output_ndjson, output_md)
+    logger.info("=" * 60)
+    flush_log()
+
+    if INTERACTIVE_BETWEEN_TASKS:
+        # Persist the session first so Ctrl-C at the pause keeps the login
+        pool.checkpoint_session()
+        flush_log()
+        input("Press Enter to continue...")
 
 
 if __name__ == "__main__":
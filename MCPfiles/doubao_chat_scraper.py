@@ -19,18 +19,38 @@ This script:
   the "参考 X 篇资料" button
 - Saves results to NDJSON and Markdown files under `output/`
 """
-from camoufox.sync_api import Camoufox
-from scrapy.http import HtmlResponse
-from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+from typing import List, Dict, Optional, Tuple, Union
 import time
 import os
+import re
 import json
 import random
 import argparse
 import sys
-import subprocess
-from screeninfo import get_monitors
+import multiprocessing
+import glob
+import builtins
+import queue
+import threading
+from weakref import WeakKeyDictionary
+
+try:
+    import orjson  # optional: faster parsing of existing NDJSON output
+except ImportError:
+    orjson = None
+
+
+def _env_number(name: str, default, cast=int):
+    """Parse a numeric env var; malformed values fall back to ``default``."""
+    value = os.environ.get(name, "").strip()
+    if not value:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        print(f"[WARN] Invalid {name}={value!r}, using {default}")
+        return default
 
 
 DOUBAO_HOME_URL = "https://www.doubao.com/chat/"
@@ -40,6 +60,22 @@ USER_DATA_DIR = os.path.join(
 OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "output")
 SESSION_COOKIES_FILE = os.path.join(os.path.dirname(__file__), "doubao_cookies.json")
 SESSION_STORAGE_FILE = os.path.join(os.path.dirname(__file__), "doubao_storage.json")
+# Playwright storage_state (cookies + localStorage); the two files above are
+# only read as a fallback when it does not exist yet
+SESSION_STATE_FILE = os.path.join(os.path.dirname(__file__), "doubao_state.json")
+# Number of Doubao browser windows working on one task's prompts concurrently
+DOUBAO_CONCURRENCY = max(1, _env_number("DOUBAO_CONCURRENCY", 1))
+# Longest wait (seconds) for a spawned shard's browser before starting the next
+SHARD_START_TIMEOUT = 10
+# Default of --flush-batch: successful results buffered before each write
+DEFAULT_FLUSH_BATCH = 20
+# Start new conversations through the SPA router instead of a full reload
+# (falls back to the reload per page if the app does not follow); 0 disables
+DOUBAO_SPA_NEW_CHAT = os.environ.get("DOUBAO_SPA_NEW_CHAT", "1").strip().lower() not in {
+    "0", "false", "no", "off"
+}
+# Tick (seconds) of the Python-side polling loops that remain
+DOUBAO_POLL_INTERVAL = max(0.05, _env_number("DOUBAO_POLL_INTERVAL", 0.25, float))
 
 # Doubao-specific selectors based on provided UI hints
 CHAT_INPUT_SELECTORS: List[str] = [
@@ -48,12 +84,11 @@ CHAT_INPUT_SELECTORS: List[str] = [
     "textarea",  # Last resort
 ]
 
-# Message list container – holds all chat bubbles (user + assistant)
-MESSAGE_LIST_SELECTOR = (
-    "#chat-route-layout > div > main > div > div.flex.h-full.w-full.flex-col.items-center > "
-    "div.flex.h-200.w-full.flex-shrink.flex-grow.flex-col.items-center > div > "
-    "div.scroll-view-OEiNXD.container-gkoWqI.reverse-BdVQca > div > div > div.inter-H_fm37"
-)
+# Message list container – holds all chat bubbles (user + assistant).
+# Anchored on its own class only: the full layout chain above it
+# (#chat-route-layout > ... > div.scroll-view-OEiNXD ...) made every lookup
+# match a dozen utility classes.
+MESSAGE_LIST_SELECTOR = "div.inter-H_fm37"
 
 # Within Doubao messages we don't yet have a stable assistant-only class.
 # We'll use the last child in the message list as the latest model reply.
@@ -93,6 +128,28 @@ SEARCH_PANEL_SCROLL_SELECTORS: List[str] = [
 # For reusing some helper logic
 STOP_BUTTON_SELECTORS: List[str] = [STOP_BTN_SELECTOR]
 
+# Fallback lists as one CSS union each: the browser resolves them in a single
+# DOM pass instead of one count()/is_visible() round trip per selector.
+# The chat-input union leaves out the bare "textarea" last resort: a union
+# matches in DOM order, so an unrelated (or hidden) textarea earlier in the page
+# would win over the real input. Picking the input itself goes through
+# pick_first_visible(CHAT_INPUT_SELECTORS), which keeps the priority order.
+CHAT_INPUT_UNION = ", ".join(s for s in CHAT_INPUT_SELECTORS if s != "textarea")
+# Visible matches only, for .first.wait_for(): a hidden match first in the DOM
+# must not hold up the wait
+CHAT_INPUT_VISIBLE = f"{CHAT_INPUT_UNION} >> visible=true"
+STOP_BUTTON_UNION = ", ".join(STOP_BUTTON_SELECTORS)
+SEARCH_PANEL_UNION = ", ".join(SEARCH_PANEL_SCROLL_SELECTORS)
+
+
+_PRINT_LOCK = threading.Lock()
+
+
+def print(*args, **kwargs) -> None:
+    """print() guarded by a lock so lines from worker threads do not interleave."""
+    with _PRINT_LOCK:
+        builtins.print(*args, **kwargs)
+
 
 def ensure_dirs() -> None:
     if not os.path.exists(USER_DATA_DIR):
@@ -109,20 +166,67 @@ def read_prompts(path: str) -> List[str]:
     return [p for p in lines if p]
 
 
-def pick_first_visible(page, selectors: List[str], timeout: int = 5000):
-    """Find the first visible element from a list of selectors."""
+# Per-page cache of lazy Locator objects keyed by selector string; entries go
+# away together with their page
+_LOC_CACHE: "WeakKeyDictionary" = WeakKeyDictionary()
+
+
+def _loc(page, selector: str):
+    locators = _LOC_CACHE.get(page)
+    if locators is None:
+        locators = _LOC_CACHE[page] = {}
+    loc = locators.get(selector)
+    if loc is None:
+        loc = locators[selector] = page.locator(selector)
+    return loc
+
+
+def pick_first_visible(page, selectors: Union[str, List[str]]):
+    """Find the first visible element from a list of selectors, tried in
+    priority order (or one, possibly unioned "a, b" selector).
+
+    Hidden matches are filtered out in the page (visible=true), so a hidden
+    element ahead of the visible one does not hide it. Pure snapshot: count()
+    answers immediately and never auto-waits.
+    """
+    if isinstance(selectors, str):
+        selectors = [selectors]
     for selector in selectors:
-        loc = page.locator(selector)
+        loc = _loc(page, f"{selector} >> visible=true")
         try:
             if loc.count() > 0:
-                first = loc.first
-                if first.is_visible(timeout=timeout):
-                    return first
+                return loc.first
         except Exception:
             continue
     return None
 
 
+# Message-list lookups run entirely in-page: one round trip each, no cached
+# handle to validate. Only direct <div> children are messages.
+_JS_COUNT_MESSAGES = """(sel) => {
+    const list = document.querySelector(sel);
+    return list ? list.querySelectorAll(':scope > div').length : 0;
+}"""
+
+_JS_LATEST_MESSAGE = """([sel, before]) => {
+    const list = document.querySelector(sel);
+    if (!list) return null;
+    const kids = list.querySelectorAll(':scope > div');
+    return kids.length > before ? kids[kids.length - 1] : null;
+}"""
+
+
+def get_latest_message(page, count_before: int = 0):
+    """ElementHandle of the last message in the list if there are more than count_before."""
+    return page.evaluate_handle(
+        _JS_LATEST_MESSAGE, [MESSAGE_LIST_SELECTOR, count_before]
+    ).as_element()
+
+
+def count_messages(page) -> int:
+    return page.evaluate(_JS_COUNT_MESSAGES, MESSAGE_LIST_SELECTOR)
+
+
 def is_chat_ui_ready(page) -> bool:
     """Returns True only when the authenticated Doubao chat UI is visible."""
     try:
@@ -159,35 +263,19 @@ def wait_for_login(page, timeout_seconds: int = 300) -> bool:
         print("[INFO] ✓ Already logged in! Doubao chat interface ready.")
         return True
 
-    # Give user time to start login process（缩短初始等待以更快进入轮询）
-    print("[INFO] Waiting 3 seconds for you to start login...")
-    time.sleep(20)
-
+    # 由浏览器自己等待输入框出现，不再在 Python 侧每 1.5 秒轮询一次
     print("[INFO] Monitoring for Doubao chat input box...")
-    start = time.time()
-    remaining = timeout_seconds - 3
-    check_count = 0
-    last_url = ""
-    while time.time() - start < remaining:
-        check_count += 1
-        current_url = page.url or ""
-
-        # Notify when URL changes (indicates login progress)
-        if current_url != last_url:
-            print(f"\n[INFO] ⚠️  Page changed to: {current_url}")
-            last_url = current_url
-
-        print(
-            f"[DEBUG] Doubao login check #{check_count} (Elapsed: {int(time.time()-start)}s)"
+    try:
+        _loc(page, CHAT_INPUT_VISIBLE).first.wait_for(
+            state="visible", timeout=timeout_seconds * 1000
         )
-        if is_chat_ui_ready(page):
-            print("\n" + "=" * 60)
-            print("✓ SUCCESS: Doubao chat interface detected!")
-            print("✓ Ready to send prompts.")
-            print("=" * 60 + "\n")
-            return True
-        # 更快轮询，加速检测到登录完成
-        time.sleep(1.5)
+        print("\n" + "=" * 60)
+        print("✓ SUCCESS: Doubao chat interface detected!")
+        print("✓ Ready to send prompts.")
+        print("=" * 60 + "\n")
+        return True
+    except PlaywrightTimeoutError:
+        pass
 
     print("\n[ERROR] Doubao chat input not found after timeout")
     print("[ERROR] Please make sure you logged in the SCRIPT'S browser window")
@@ -209,108 +297,68 @@ def get_conversation_id_from_url(url: str) -> str:
     return ""
 
 
-def detect_language(text: str) -> str:
-    for ch in text:
-        if "\u4e00" <= ch <= "\u9fff":
-            return "zh"
-    return "en"
-
-
-def load_cookies_into_context(page, cookies_path: str) -> None:
-    try:
-        if os.path.exists(cookies_path):
-            with open(cookies_path, "r", encoding="utf-8") as f:
-                cookies = json.load(f)
-            if isinstance(cookies, list) and len(cookies) > 0:
-                page.context.add_cookies(cookies)
-    except Exception:
-        pass
+_ZH_RE = re.compile("[\u4e00-\u9fff]")
 
 
-def save_cookies_from_context(page, cookies_path: str) -> None:
-    try:
-        cookies = page.context.cookies()
-        with open(cookies_path, "w", encoding="utf-8") as f:
-            json.dump(cookies, f, ensure_ascii=False, indent=2)
-    except Exception:
-        pass
+def detect_language(text: str) -> str:
+    # Regex scan runs in C and stops at the first CJK character
+    return "zh" if _ZH_RE.search(text) else "en"
 
 
-def load_storage_from_file(page, storage_path: str) -> None:
-    try:
-        if not os.path.exists(storage_path):
-            return
-        with open(storage_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        local_items = data.get("localStorage", {})
-        session_items = data.get("sessionStorage", {})
-        if local_items:
-            page.evaluate(
-                """(items) => { for (const [k,v] of Object.entries(items)) localStorage.setItem(k, v) }""",
-                local_items,
-            )
-        if session_items:
-            page.evaluate(
-                """(items) => { for (const [k,v] of Object.entries(items)) sessionStorage.setItem(k, v) }""",
-                session_items,
-            )
-    except Exception:
-        pass
-
+def load_session_state() -> Union[str, Dict, None]:
+    """
+    storage_state for browser.new_context(): the saved state file, or one
+    built from the legacy cookies/storage files written by older versions.
+    sessionStorage has no place in storage_state and is not carried over.
+    """
+    if os.path.exists(SESSION_STATE_FILE):
+        return SESSION_STATE_FILE
+    if not os.path.exists(SESSION_COOKIES_FILE):
+        return None
 
-def save_storage_to_file(page, storage_path: str) -> None:
+    state: Dict = {"cookies": [], "origins": []}
     try:
-        ls = page.evaluate("""() => Object.fromEntries(Object.entries(localStorage))""")
-        ss = page.evaluate(
-            """() => Object.fromEntries(Object.entries(sessionStorage))"""
-        )
-        with open(storage_path, "w", encoding="utf-8") as f:
-            json.dump(
-                {"localStorage": ls, "sessionStorage": ss},
-                f,
-                ensure_ascii=False,
-                indent=2,
-            )
+        with open(SESSION_COOKIES_FILE, "r", encoding="utf-8") as f:
+            cookies = json.load(f)
+        if isinstance(cookies, list):
+            state["cookies"] = cookies
     except Exception:
         pass
 
-
-def is_model_responding(page) -> bool:
-    """Return True if the Doubao stop button is visible (model currently responding)."""
     try:
-        stop_btn = page.locator(STOP_BTN_SELECTOR)
-        if stop_btn.count() > 0 and stop_btn.first.is_visible(timeout=2000):
-            return True
+        if os.path.exists(SESSION_STORAGE_FILE):
+            with open(SESSION_STORAGE_FILE, "r", encoding="utf-8") as f:
+                local_items = json.load(f).get("localStorage") or {}
+            if local_items:
+                state["origins"].append(
+                    {
+                        "origin": "https://www.doubao.com",
+                        "localStorage": [
+                            {"name": k, "value": v} for k, v in local_items.items()
+                        ],
+                    }
+                )
     except Exception:
         pass
-    return False
-
+    return state
 
-def is_generating(page) -> bool:
-    """Backward-compatible alias of `is_model_responding` used in stream wait logic."""
-    return is_model_responding(page)
-
-
-def is_send_button_enabled(page) -> bool:
-    """True if the main send button is enabled (ready to send)."""
-    try:
-        btn = page.locator(SEND_BTN_ENABLED_SELECTOR)
-        if btn.count() > 0 and btn.first.is_visible(timeout=2000):
-            return True
-    except Exception:
-        pass
-    return False
 
+def save_session_state(context) -> None:
+    """Persist cookies + localStorage of the context in one storage_state call.
 
-def is_send_button_disabled(page) -> bool:
-    """True if the main send button is disabled (no input or reply finished)."""
+    Written to a per-worker temp file and swapped in with os.replace, so a crash
+    mid-write (or another worker saving at the same time) never leaves a
+    truncated state file behind.
+    """
+    tmp_path = f"{SESSION_STATE_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
     try:
-        btn = page.locator(SEND_BTN_DISABLED_SELECTOR)
-        if btn.count() > 0 and btn.first.is_visible(timeout=2000):
-            return True
+        context.storage_state(path=tmp_path)
+        os.replace(tmp_path, SESSION_STATE_FILE)
     except Exception:
-        pass
-    return False
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
 
 
 def ensure_deep_thinking_enabled(page) -> None:
@@ -319,13 +367,13 @@ def ensure_deep_thinking_enabled(page) -> None:
     Does nothing if the toggle is already enabled or not found.
     """
     try:
-        wrapper = page.locator(DEEP_THINK_TOGGLE_WRAPPER_SELECTOR)
+        wrapper = _loc(page, DEEP_THINK_TOGGLE_WRAPPER_SELECTOR)
         if wrapper.count() == 0:
             print("[DEBUG] Deep thinking toggle wrapper not found")
             return
 
         wrapper_el = wrapper.first
-        if not wrapper_el.is_visible(timeout=5000):
+        if not wrapper_el.is_visible():
             print("[DEBUG] Deep thinking toggle wrapper found but not visible")
             return
 
@@ -336,7 +384,7 @@ def ensure_deep_thinking_enabled(page) -> None:
             return
 
         btn = btn_loc.first
-        if not btn.is_visible(timeout=5000):
+        if not btn.is_visible():
             print("[DEBUG] Deep thinking button found but not visible")
             return
 
@@ -347,10 +395,15 @@ def ensure_deep_thinking_enabled(page) -> None:
 
         print("[INFO] Enabling Doubao '深度思考' mode...")
         btn.click()
-        time.sleep(0.3)
 
-        # Best-effort re-check
-        state_after = (btn.get_attribute("data-checked") or "").lower()
+        # Best-effort re-check: let the browser wait for the toggle to flip
+        try:
+            wrapper_el.locator("button[data-checked='true']").first.wait_for(
+                state="attached", timeout=1000
+            )
+            state_after = "true"
+        except PlaywrightTimeoutError:
+            state_after = (btn.get_attribute("data-checked") or "").lower()
         if state_after == "true":
             print("[INFO] Doubao '深度思考' mode enabled")
         else:
@@ -359,6 +412,47 @@ def ensure_deep_thinking_enabled(page) -> None:
         print(f"[WARN] Failed to ensure Doubao deep thinking mode: {e}")
 
 
+# One search result in the side panel (see extract_web_search_results)
+SEARCH_TEXT_ITEM_SELECTOR = "div[data-testid='search-text-item']"
+
+# {href, title, snippet} of every panel item, title/snippet falling back to
+# the lines of the link text
+_JS_SEARCH_PANEL_RESULTS = """(panel, itemSel) => {
+    const out = [];
+    for (const item of panel.querySelectorAll(itemSel)) {
+        const a = item.querySelector("a[href^='http']") || item.querySelector("a[href]");
+        if (!a) continue;
+        const href = a.getAttribute('href') || '';
+        if (!href.startsWith('http')) continue;
+        const t = item.querySelector("div[class*='search-item-title']");
+        const s = item.querySelector("div[class*='search-item-summary']");
+        let title = t ? (t.innerText || '').trim() : '';
+        let snippet = s ? (s.innerText || '').trim() : '';
+        if (!title || !snippet) {
+            const parts = (a.innerText || '').trim().split('\\n')
+                .map((x) => x.trim()).filter(Boolean);
+            if (!title && parts.length) title = parts[0].slice(0, 160);
+            if (!snippet && parts.length > 1) snippet = parts.slice(1).join(' ').slice(0, 400);
+        }
+        out.push({href, title: title || href, snippet});
+    }
+    return out;
+}"""
+
+
+# Panel signature: first result href + number of result items
+_JS_SEARCH_PANEL_SIGNATURE = """(panel, itemSel) => {
+    const a = panel.querySelector("a[href^='http']");
+    return (a ? a.getAttribute('href') : '') + ':' + panel.querySelectorAll(itemSel).length;
+}"""
+
+# (conversation id, panel signature) -> extracted results, FIFO-capped so an
+# already parsed panel is not walked again for the same answer
+_SEARCH_CACHE: Dict[Tuple[str, str], List[Dict[str, str]]] = {}
+_SEARCH_CACHE_MAX = 64
+_SEARCH_CACHE_LOCK = threading.Lock()
+
+
 def extract_web_search_results(
     page, assistant_container
 ) -> Tuple[List[Dict[str, str]], bool]:
@@ -374,35 +468,22 @@ def extract_web_search_results(
 
     try:
         # Helper: try to locate an already-open search panel
-        def find_panel():
-            panel_local = None
-            for selector in SEARCH_PANEL_SCROLL_SELECTORS:
-                try:
-                    loc = page.locator(selector)
-                    if loc.count() == 0:
-                        continue
-                    try:
-                        first = loc.first
-                        # Prefer visible, but don't strictly require it
-                        try:
-                            _ = first.is_visible(timeout=5000)
-                        except Exception:
-                            pass
-                        panel_local = first
-                        print(f"[DEBUG] Using Doubao search panel selector: {selector}")
-                        break
-                    except Exception:
-                        panel_local = loc.first
-                        print(
-                            f"[DEBUG] Fallback to first match for selector: {selector}"
-                        )
-                        break
-                except Exception as e:
-                    print(
-                        f"[DEBUG] Error locating Doubao search panel with {selector}: {e}"
-                    )
-                    continue
-            return panel_local
+        def find_panel(wait_ms: int = 0):
+            # All layouts in one union query; visibility is not required.
+            # With wait_ms > 0 the browser waits for the panel to be attached.
+            loc = _loc(page, SEARCH_PANEL_UNION).first
+            try:
+                if wait_ms > 0:
+                    loc.wait_for(state="attached", timeout=wait_ms)
+                elif loc.count() == 0:
+                    return None
+            except PlaywrightTimeoutError:
+                return None
+            except Exception as e:
+                print(f"[DEBUG] Error locating Doubao search panel: {e}")
+                return None
+            print("[DEBUG] Found Doubao search panel")
+            return loc
 
         # 1) First, see if the panel is already open (Doubao sometimes auto-opens it)
         panel = find_panel()
@@ -412,52 +493,45 @@ def extract_web_search_results(
             search_button = None
             try:
                 if assistant_container is not None:
-                    loc = assistant_container.locator(SEARCH_REFERENCE_BUTTON_SELECTOR)
-                    if loc.count() > 0:
-                        search_button = loc
+                    buttons = assistant_container.query_selector_all(
+                        SEARCH_REFERENCE_BUTTON_SELECTOR
+                    )
+                    if buttons:
+                        search_button = buttons[-1]
             except Exception:
                 search_button = None
 
-            if search_button is None or search_button.count() == 0:
+            if search_button is None:
                 # Fallback: search at page level
                 try:
-                    loc = page.locator(SEARCH_REFERENCE_BUTTON_SELECTOR)
+                    loc = _loc(page, SEARCH_REFERENCE_BUTTON_SELECTOR)
                     if loc.count() > 0:
-                        search_button = loc
+                        search_button = loc.last
                 except Exception:
                     search_button = None
 
-            if search_button is not None and search_button.count() > 0:
+            if search_button is not None:
                 had_reference_button = True
                 print(
                     "[DEBUG] Found Doubao search-reference button, trying to open panel..."
                 )
-                # 多次短点击重试，避免单次 click 卡 30 秒
+                # 单次 force 点击：跳过可操作性检查与点击后的等待，避免 click 卡住；
+                # 面板的渲染交给下面 find_panel 的浏览器端等待
                 panel = find_panel()
                 if not panel:
                     click_ok = False
-                    for attempt in range(3):
-                        try:
-                            btn = search_button.last
-                            if btn.is_visible(timeout=5000):
-                                print(
-                                    f"[DEBUG] Clicking Doubao search-reference button (attempt {attempt+1}/3)"
-                                )
-                                btn.click(timeout=5000)
-                                time.sleep(0.25)
-                                click_ok = True
-                                break
-                        except Exception as e:
-                            print(
-                                f"[WARN] Failed to click Doubao search-reference button (attempt {attempt+1}/3): {e}"
-                            )
-                            time.sleep(0.25)
-                    if not click_ok:
+                    try:
+                        print("[DEBUG] Clicking Doubao search-reference button")
+                        search_button.click(
+                            force=True, no_wait_after=True, timeout=2000
+                        )
+                        click_ok = True
+                    except Exception as e:
                         print(
-                            "[WARN] Giving up opening Doubao search panel for this answer after 3 attempts"
+                            f"[WARN] Failed to click Doubao search-reference button: {e}"
                         )
-                    # Re-try finding the panel after click attempts（无论成功与否，都再尝试一次）
-                    panel = find_panel()
+                    # Re-try finding the panel after the click（无论成功与否，都再尝试一次）
+                    panel = find_panel(3000 if click_ok else 0)
 
         if not panel:
             print(
@@ -474,162 +548,252 @@ def extract_web_search_results(
         #     <div class="search-item-footer-...">...</div>
         #   </a>
         # </div>
-        # 搜索结果是异步渲染的，这里做一个短轮询，避免刚打开面板时 count==0。
-        result_items = None
-        count = 0
-        # 略微缩短轮询时间，总体等待约 2 秒
-        for attempt in range(10):
-            result_items = panel.locator("div[data-testid='search-text-item']")
-            try:
-                count = result_items.count()
-            except Exception:
-                count = 0
-            if count > 0:
-                break
-            time.sleep(0.2)
-
-        print(f"[DEBUG] Found {count} potential Doubao search-text items")
-
-        for i in range(count):
-            try:
-                item = result_items.nth(i)
-
-                # Main link (href)
-                link = item.locator("a[href^='http']")
-                if link.count() == 0:
-                    link = item.locator("a[href]")
-                if link.count() == 0:
-                    continue
-
-                link_el = link.first
-                href = link_el.get_attribute("href") or ""
-                if not href or not href.startswith("http"):
-                    continue
-
-                # Title – prefer dedicated title element
-                title = ""
-                try:
-                    title_loc = item.locator("div[class*='search-item-title']")
-                    if title_loc.count() > 0:
-                        title = (title_loc.first.inner_text() or "").strip()
-                except Exception:
-                    title = ""
-
-                # Snippet – prefer dedicated summary element
-                snippet = ""
-                try:
-                    snippet_loc = item.locator("div[class*='search-item-summary']")
-                    if snippet_loc.count() > 0:
-                        snippet = (snippet_loc.first.inner_text() or "").strip()
-                except Exception:
-                    snippet = ""
+        # 搜索结果是异步渲染的，这里短暂等待第一条出现（约 2 秒），避免刚打开面板时为空。
+        try:
+            panel.locator(SEARCH_TEXT_ITEM_SELECTOR).first.wait_for(
+                state="attached", timeout=2000
+            )
+        except Exception:
+            pass
 
-                # Fallback: derive title/snippet from full link text
-                if not title or not snippet:
-                    try:
-                        full_text = (link_el.inner_text() or "").strip()
-                    except Exception:
-                        full_text = ""
-
-                    if full_text:
-                        parts = [p.strip() for p in full_text.splitlines() if p.strip()]
-                        if not title and parts:
-                            title = parts[0][:160]
-                        if not snippet and len(parts) > 1:
-                            snippet = " ".join(parts[1:])[:400]
-
-                results.append(
-                    {
-                        "href": href,
-                        "title": title or href,
-                        "snippet": snippet,
-                    }
+        cache_key = None
+        try:
+            conv_id = get_conversation_id_from_url(page.url)
+            # Only real conversation ids; the bare home URL is shared by answers
+            if len(conv_id) > 10:
+                sig = panel.evaluate(
+                    _JS_SEARCH_PANEL_SIGNATURE, SEARCH_TEXT_ITEM_SELECTOR
                 )
-            except Exception as e:
-                print(f"[WARN] Failed to extract Doubao result {i}: {e}")
-                continue
-
+                cache_key = (conv_id, sig)
+        except Exception:
+            pass
+        with _SEARCH_CACHE_LOCK:
+            cached = _SEARCH_CACHE.get(cache_key) if cache_key else None
+        if cached is not None:
+            print(f"[DEBUG] Reusing {len(cached)} cached Doubao web search results")
+            return list(cached), had_reference_button
+
+        # All items are read in one in-page pass instead of several calls per item
+        results = panel.evaluate(_JS_SEARCH_PANEL_RESULTS, SEARCH_TEXT_ITEM_SELECTOR) or []
         print(f"[DEBUG] Extracted {len(results)} Doubao web search results")
+        if cache_key and results:
+            with _SEARCH_CACHE_LOCK:
+                _SEARCH_CACHE[cache_key] = results
+                while len(_SEARCH_CACHE) > _SEARCH_CACHE_MAX:
+                    _SEARCH_CACHE.pop(next(iter(_SEARCH_CACHE)))
     except Exception as e:
         print(f"[WARN] Failed to extract Doubao web search results: {e}")
 
     return results, had_reference_button
 
 
+# html_to_markdown patterns, compiled once at import
+_RE_SCRIPT_STYLE = re.compile(
+    r"<(script|style)[^>]*>.*?</\1>", re.DOTALL | re.IGNORECASE
+)
+# Doubao 内联引用：例如 <span class="container-bhqnGO">中国科普网</span>
+# 支持 class 使用单引号或双引号，以及额外的其它 class。
+_RE_INLINE_CITE = re.compile(
+    r'<span[^>]*class=[\'"][^\'"]*\bcontainer-bhqnGO\b[^\'"]*[\'"][^>]*>(.*?)</span>',
+    re.DOTALL | re.IGNORECASE,
+)
+_RE_A = re.compile(r"<a[^>]*>(.*?)</a>", re.DOTALL | re.IGNORECASE)
+_RE_HREF = re.compile(r'href=["\']([^"\']+)["\']')
+_RE_TAG = re.compile(r"<[^>]+>")
+# <br>, </p>|</div>, <li>, </li>, <ol>|<ul>, </ol>|</ul> in one pass; the
+# replacement is picked by the index of the group that matched
+_RE_BLOCK_TAGS = re.compile(
+    r"(<br\s*/?>)|(</(?:p|div)>)|(<li[^>]*>)|(</li>)|(<(?:ol|ul)[^>]*>|</(?:ol|ul)>)",
+    re.IGNORECASE,
+)
+_BLOCK_TAG_REPLACEMENTS = ("", "\n", "\n\n", "\n- ", "", "\n")
+# All heading levels in one pass (closing tag must match the opening level)
+_RE_HEADING = re.compile(r"<h([1-6])[^>]*>(.*?)</h\1>", re.DOTALL | re.IGNORECASE)
+# The few entities Doubao emits, decoded in one pass (other entities are kept)
+_ENTITY_MAP = {
+    "&lt;": "<",
+    "&gt;": ">",
+    "&amp;": "&",
+    "&nbsp;": " ",
+    "&quot;": '"',
+    "&#39;": "'",
+}
+_RE_ENTITY = re.compile(r"&(?:lt|gt|amp|nbsp|quot|#39);")
+_RE_MULTI_NL = re.compile(r"\n{3,}")
+_RE_MULTI_SP = re.compile(r" +")
+
+
+def _replace_link(match) -> str:
+    """Convert <a href="...">text</a> to [text](url)."""
+    href_match = _RE_HREF.search(match.group(0))
+    href = href_match.group(1) if href_match else ""
+    inner = _RE_TAG.sub("", match.group(1)).strip()
+
+    if not href:
+        return inner if inner else ""
+    display = inner or "link"
+    return f"[{display}]({href})"
+
+
 def html_to_markdown(html: str) -> str:
     """Simple HTML to Markdown converter (generic, no DeepSeek-specific hacks)."""
-    import re
-
     # Remove script/style tags
-    html = re.sub(
-        r"<(script|style)[^>]*>.*?</\1>", "", html, flags=re.DOTALL | re.IGNORECASE
-    )
+    html = _RE_SCRIPT_STYLE.sub("", html)
 
-    # Doubao 内联引用：例如 <span class="container-bhqnGO">中国科普网</span>
-    # 这里不再尝试获取 URL，仅将其转成 [中国科普网] 这种括号形式。
-    # 支持 class 使用单引号或双引号，以及额外的其它 class。
-    html = re.sub(
-        r'<span[^>]*class=[\'"][^\'"]*\bcontainer-bhqnGO\b[^\'"]*[\'"][^>]*>(.*?)</span>',
-        r"[\1]",
-        html,
-        flags=re.DOTALL | re.IGNORECASE,
-    )
+    # Doubao 内联引用：这里不再尝试获取 URL，仅将其转成 [中国科普网] 这种括号形式。
+    html = _RE_INLINE_CITE.sub(r"[\1]", html)
 
     # Convert <a href="...">text</a> to [text](url)
-    def replace_link(match):
-        full_tag = match.group(0)
-        href_match = re.search(r'href=["\']([^"\']+)["\']', full_tag)
-        href = href_match.group(1) if href_match else ""
-        inner = re.sub(r"<[^>]+>", "", match.group(1)).strip()
-
-        if not href:
-            return inner if inner else ""
-        display = inner or "link"
-        return f"[{display}]({href})"
-
-    html = re.sub(
-        r"<a[^>]*>(.*?)</a>", replace_link, html, flags=re.DOTALL | re.IGNORECASE
-    )
-
-    # Convert <br> to newline
-    html = re.sub(r"<br\s*/?>", "\n", html, flags=re.IGNORECASE)
-
-    # Convert </p>, </div> to double newline
-    html = re.sub(r"</(p|div)>", "\n\n", html, flags=re.IGNORECASE)
+    html = _RE_A.sub(_replace_link, html)
 
-    # Convert <li> to "- "
-    html = re.sub(r"<li[^>]*>", "\n- ", html, flags=re.IGNORECASE)
-    html = re.sub(r"</li>", "", html, flags=re.IGNORECASE)
-
-    # Convert lists
-    html = re.sub(r"<ol[^>]*>", "\n", html, flags=re.IGNORECASE)
-    html = re.sub(r"</ol>", "\n", html, flags=re.IGNORECASE)
-    html = re.sub(r"<ul[^>]*>", "\n", html, flags=re.IGNORECASE)
-    html = re.sub(r"</ul>", "\n", html, flags=re.IGNORECASE)
+    # <br> -> newline, </p>/</div> -> blank line, <li> -> "- ", lists -> newline
+    html = _RE_BLOCK_TAGS.sub(lambda m: _BLOCK_TAG_REPLACEMENTS[m.lastindex], html)
 
     # Convert headings
-    for i in range(6, 0, -1):
-        html = re.sub(
-            f"<h{i}[^>]*>(.*?)</h{i}>",
-            "#" * i + r" \1\n\n",
-            html,
-            flags=re.DOTALL | re.IGNORECASE,
-        )
+    html = _RE_HEADING.sub(
+        lambda m: "#" * int(m.group(1)) + " " + m.group(2) + "\n\n", html
+    )
 
     # Remove all other tags
-    html = re.sub(r"<[^>]+>", "", html)
+    html = _RE_TAG.sub("", html)
 
     # Decode basic HTML entities
-    html = html.replace("&lt;", "<").replace("&gt;", ">").replace("&amp;", "&")
-    html = html.replace("&nbsp;", " ").replace("&quot;", '"').replace("&#39;", "'")
+    html = _RE_ENTITY.sub(lambda m: _ENTITY_MAP[m.group()], html)
 
     # Clean up multiple newlines and spaces
-    html = re.sub(r"\n{3,}", "\n\n", html)
-    html = re.sub(r" +", " ", html)
+    html = _RE_MULTI_NL.sub("\n\n", html)
+    html = _RE_MULTI_SP.sub(" ", html)
 
     return html.strip()
 
 
+# In-page lookup of the latest assistant reply; mirrors get_latest_assistant()
+# in wait_for_stream_completion_and_get_text.
+_JS_LATEST_REPLY = """
+    const visible = (el) => !!el && el.getClientRects().length > 0;
+    const latest = () => {
+        const list = document.querySelector(a.list);
+        if (list) {
+            const kids = list.querySelectorAll(':scope > div');
+            if (kids.length > a.before) return kids[kids.length - 1];
+        }
+        for (const sel of a.assistant) {
+            const nodes = document.querySelectorAll(sel);
+            if (nodes.length > a.before) return nodes[nodes.length - 1];
+        }
+        for (const sel of a.fallback) {
+            const nodes = document.querySelectorAll(sel);
+            if (nodes.length) return nodes[nodes.length - 1];
+        }
+        return null;
+    };
+    const node = latest();
+    const text = node ? (node.innerText || '').trim() : '';
+    const generating = visible(document.querySelector(a.stop));
+"""
+
+# One probe of everything the stream wait looks at per tick:
+# {text, generating, sendDisabled, sendEnabled}
+_JS_STREAM_STATE = (
+    "(a) => {"
+    + _JS_LATEST_REPLY
+    + """return {
+        text,
+        generating,
+        sendDisabled: visible(document.querySelector(a.disabled)),
+        sendEnabled: visible(document.querySelector(a.enabled)),
+    };
+}"""
+)
+
+# The latest reply node itself (for evaluate_handle), resolved in one call
+_JS_LATEST_REPLY_NODE = "(a) => {" + _JS_LATEST_REPLY + "return node; }"
+
+# Same probe against a reply node resolved once in Python; null once the
+# node was detached so the caller can resolve the latest reply again
+_JS_REPLY_STATE = """(n, a) => {
+    if (!n.isConnected) return null;
+    const visible = (el) => !!el && el.getClientRects().length > 0;
+    return {
+        text: (n.innerText || '').trim(),
+        generating: visible(document.querySelector(a.stop)),
+        sendDisabled: visible(document.querySelector(a.disabled)),
+        sendEnabled: visible(document.querySelector(a.enabled)),
+    };
+}"""
+
+# Containers inside a reply holding its rendered markdown, in priority order
+REPLY_CONTENT_SELECTORS: List[str] = [
+    "div[class*='markdown']",
+    "div[class*='content']",
+    "div[class*='message-body']",
+]
+
+# {html, hrefs} of the first visible content container of a reply node, else
+# {text} with the reply's plain text; null once the node was detached
+_JS_REPLY_CONTENT = """(n, a) => {
+    if (!n.isConnected) return null;
+    const visible = (el) => !!el && el.getClientRects().length > 0;
+    for (const sel of a.content) {
+        const el = n.querySelector(sel);
+        if (visible(el)) {
+            return {
+                html: el.innerHTML,
+                hrefs: Array.from(el.querySelectorAll(a.cite), (x) => x.getAttribute('href')),
+            };
+        }
+    }
+    return {text: (n.innerText || '').trim()};
+}"""
+
+# Re-resolve the cached reply node after this many empty-text ticks
+REPLY_EMPTY_RESOLVE_TICKS = 8
+
+# Resolves once generation started: stop button visible or reply text present
+_JS_GENERATION_STARTED = (
+    "(a) => {" + _JS_LATEST_REPLY + "return generating || text.length > 0; }"
+)
+
+# Resolves with {text} once the reply is complete: its length has been stable
+# for a.stableMs while the send button is disabled and the stop button gone,
+# or nothing changed for a.idleMs while not generating. State is kept on
+# window.__doubaoStable, keyed per call.
+_JS_STREAM_COMPLETE = (
+    "(a) => {"
+    + _JS_LATEST_REPLY
+    + """
+    const now = Date.now();
+    let st = window.__doubaoStable;
+    if (!st || st.key !== a.key) {
+        st = window.__doubaoStable = {key: a.key, len: -1, t: now};
+    }
+    if (text.length !== st.len) {
+        if (text.length || st.len < 0) st.t = now;
+        st.len = text.length;
+        return false;
+    }
+    const stableFor = now - st.t;
+    if (text && stableFor >= a.stableMs && !generating
+            && visible(document.querySelector(a.disabled))) {
+        return {text, reason: 'send button disabled'};
+    }
+    if (!generating && stableFor > a.idleMs) return {text, reason: 'idle'};
+    return false;
+}"""
+)
+
+# Poll interval of the in-page waits (ms). requestAnimationFrame polling is
+# throttled in background windows, so a fixed interval is used instead.
+STREAM_POLL_INTERVAL_MS = 100
+
+# Generic last-message containers tried when the message list is not found
+ASSISTANT_FALLBACK_SELECTORS: List[str] = [
+    "article:last-child",
+    "div[class*='message']:last-child",
+    "div[class*='response']:last-child",
+]
+
+
 def wait_for_stream_completion_and_get_text(
     page, assistant_message_count_before: int, timeout_seconds: int = 300
 ) -> Tuple[str, List[str]]:
@@ -643,72 +807,120 @@ def wait_for_stream_completion_and_get_text(
     last_change_time = start
     # 缩短最大等待时间与稳定检测间隔，加快认为「生成完成」的速度
     max_stream_seconds = max(45, min(180, int(timeout_seconds * 0.7)))
-    required_stable_ticks = 3  # ~0.75s with 0.25s sleep
+    # ~0.75s of unchanged text, whatever the poll interval
+    required_stable_ticks = max(1, int(round(0.75 / DOUBAO_POLL_INTERVAL)))
 
     def get_latest_assistant():
+        """ElementHandle of the latest reply, or None."""
+        # Fast path: list / assistant / fallback lookup in a single round trip
+        try:
+            return page.evaluate_handle(_JS_LATEST_REPLY_NODE, js_arg).as_element()
+        except Exception:
+            pass
+
         # First try using the message list container and last child
         try:
-            msg_list = page.locator(MESSAGE_LIST_SELECTOR)
-            if msg_list.count() > 0:
-                container = msg_list.first
-                children = container.locator(":scope > div")
-                if children.count() > assistant_message_count_before:
-                    return children.nth(children.count() - 1)
+            latest = get_latest_message(page, assistant_message_count_before)
+            if latest is not None:
+                return latest
         except Exception:
             pass
 
         # Then try any explicit assistant-role selectors
         for selector in ASSISTANT_MESSAGE_SELECTORS:
-            loc = page.locator(selector)
             try:
-                if loc.count() > assistant_message_count_before:
-                    return loc.nth(loc.count() - 1)
+                nodes = page.query_selector_all(selector)
+                if len(nodes) > assistant_message_count_before:
+                    return nodes[-1]
             except Exception:
                 continue
 
         # Fallback: try to find a generic last message-like container
-        fallback_selectors = [
-            "article:last-child",
-            "div[class*='message']:last-child",
-            "div[class*='response']:last-child",
-        ]
-        for selector in fallback_selectors:
+        for selector in ASSISTANT_FALLBACK_SELECTORS:
             try:
-                loc = page.locator(selector)
-                if loc.count() > 0:
-                    return loc.last
+                nodes = page.query_selector_all(selector)
+                if nodes:
+                    return nodes[-1]
             except Exception:
                 continue
         return None
 
-    # Wait for generation to start
-    start_phase_deadline = time.time() + min(30, timeout_seconds * 0.2)
-    while time.time() < start_phase_deadline:
-        if is_generating(page):
-            print("[DEBUG] Doubao generation started (stop button visible)")
-            break
+    js_arg = {
+        "list": MESSAGE_LIST_SELECTOR,
+        "assistant": ASSISTANT_MESSAGE_SELECTORS,
+        "fallback": ASSISTANT_FALLBACK_SELECTORS,
+        "before": assistant_message_count_before,
+        "stop": STOP_BTN_SELECTOR,
+        "disabled": SEND_BTN_DISABLED_SELECTOR,
+        "enabled": SEND_BTN_ENABLED_SELECTOR,
+        "stableMs": 750,
+        "idleMs": 6000,
+        "key": repr(start),
+    }
 
-        # Also check for content appearing
-        try:
-            container = get_latest_assistant()
-            if container:
-                text_now = container.inner_text().strip()
-                if text_now and len(text_now) > len(last_text):
-                    last_text = text_now
-                    last_change_time = time.time()
-                    print("[DEBUG] Doubao content started appearing")
-                    break
-        except Exception:
-            pass
-        time.sleep(0.15)
+    # Wait for generation to start, observed in-page
+    try:
+        page.wait_for_function(
+            _JS_GENERATION_STARTED,
+            arg=js_arg,
+            timeout=int(min(30, timeout_seconds * 0.2) * 1000),
+            polling=STREAM_POLL_INTERVAL_MS,
+        )
+        print("[DEBUG] Doubao generation started")
+    except PlaywrightTimeoutError:
+        print("[DEBUG] Doubao generation start not detected, continuing")
+    except Exception:
+        pass
 
-    # Wait for completion
-    while time.time() - start < timeout_seconds:
-        container = get_latest_assistant()
-        try:
-            text = container.inner_text().strip() if container else ""
-        except Exception:
-            text = ""
+    # Wait for completion in-page; the Python polling loop below is only the
+    # fallback once max_stream_seconds passed (it also forces the stop button)
+    completed = False
+    try:
+        remaining_ms = int((max_stream_seconds - (time.time() - start)) * 1000)
+        handle = page.wait_for_function(
+            _JS_STREAM_COMPLETE,
+            arg=js_arg,
+            timeout=max(1000, remaining_ms),
+            polling=STREAM_POLL_INTERVAL_MS,
+        )
+        done = handle.json_value()
+        last_text = done.get("text") or ""
+        completed = True
+        print(
+            f"[DEBUG] Doubao response completed ({len(last_text)} chars, {done.get('reason')})"
+        )
+    except PlaywrightTimeoutError:
+        print("[DEBUG] Doubao in-page completion wait timed out, polling instead")
+    except Exception as e:
+        print(f"[DEBUG] Doubao in-page completion wait failed, polling instead: {e}")
+
+    # Wait for completion. The reply node is resolved once and then probed
+    # directly; it is looked up again only when it got detached or stayed
+    # empty for REPLY_EMPTY_RESOLVE_TICKS ticks
+    reply = None
+    empty_ticks = 0
+    while not completed and time.time() - start < timeout_seconds:
+        if reply is None or empty_ticks >= REPLY_EMPTY_RESOLVE_TICKS:
+            reply = get_latest_assistant()
+            empty_ticks = 0
+
+        # Reply text and button states in a single round trip
+        state = None
+        if reply is not None:
+            try:
+                state = reply.evaluate(_JS_REPLY_STATE, js_arg)
+            except Exception:
+                state = None
+            if state is None:
+                reply = None
+        if state is None:
+            try:
+                state = page.evaluate(_JS_STREAM_STATE, js_arg)
+            except Exception:
+                state = {}
+        text = state.get("text") or ""
+        generating = bool(state.get("generating"))
+        empty_ticks = 0 if text else empty_ticks + 1
 
         if text and text == last_text:
             stable_ticks += 1
@@ -719,10 +931,10 @@ def wait_for_stream_completion_and_get_text(
                 last_change_time = time.time()
 
         # Force stop if generation takes too long
-        if is_generating(page) and (time.time() - start > max_stream_seconds):
+        if generating and (time.time() - start > max_stream_seconds):
             print(f"[INFO] Forcing Doubao stop after {max_stream_seconds}s")
             try:
-                stop_btn = pick_first_visible(page, STOP_BUTTON_SELECTORS)
+                stop_btn = pick_first_visible(page, STOP_BUTTON_UNION)
                 if stop_btn:
                     stop_btn.click()
             except Exception:
@@ -732,68 +944,86 @@ def wait_for_stream_completion_and_get_text(
         # 1) Text has been stable for several ticks
         # 2) Send button is in the disabled state (input empty / reply finished)
         if stable_ticks >= required_stable_ticks and len(text) > 0:
-            if is_send_button_disabled(page) and (not is_model_responding(page)):
+            if state.get("sendDisabled") and not generating:
                 print(
                     f"[DEBUG] Doubao response completed ({len(text)} chars, send button disabled)"
                 )
                 break
 
         # Fallback timeout: no changes and not generating
-        if (not is_generating(page)) and (time.time() - last_change_time > 6):
+        if (not generating) and (time.time() - last_change_time > 6):
             print("[DEBUG] Doubao: no changes for 6s, assuming complete")
             break
 
-        time.sleep(0.25)
+        time.sleep(DOUBAO_POLL_INTERVAL)
 
     # Extract citations
     citations: List[str] = []
     final_text = last_text
+    content_arg = {
+        "content": REPLY_CONTENT_SELECTORS,
+        "cite": CITATION_LINK_SELECTOR,
+    }
 
-    try:
-        container = get_latest_assistant()
-        if container:
-            # Try to get HTML content for better formatting
-            try:
-                content_selectors = [
-                    "div[class*='markdown']",
-                    "div[class*='content']",
-                    "div[class*='message-body']",
-                ]
-                content_container = None
-                for selector in content_selectors:
-                    try:
-                        loc = container.locator(selector)
-                        if loc.count() > 0 and loc.first.is_visible():
-                            content_container = loc.first
-                            break
-                    except Exception:
-                        continue
-
-                if content_container:
-                    html_content = content_container.inner_html()
-                    final_text = html_to_markdown(html_content)
-
-                    # Extract generic citation links
-                    citation_links = content_container.locator(CITATION_LINK_SELECTOR)
-                    for i in range(citation_links.count()):
-                        try:
-                            href = citation_links.nth(i).get_attribute("href")
-                            if href and href.startswith("http"):
-                                citations.append(href)
-                        except Exception:
-                            continue
-                else:
-                    # Fallback to plain text
-                    final_text = container.inner_text().strip()
-            except Exception:
-                final_text = container.inner_text().strip()
-    except Exception:
-        pass
+    # Final content in one round trip: HTML of the first visible content
+    # container plus its citation hrefs, or the plain reply text as fallback.
+    # The cached reply handle is reused unless it got detached.
+    content = None
+    for container in (reply, None):
+        try:
+            if container is None:
+                container = get_latest_assistant()
+            if container is None:
+                break
+            content = container.evaluate(_JS_REPLY_CONTENT, content_arg)
+        except Exception:
+            content = None
+        if content is not None:
+            break
+
+    if content:
+        html_content = content.get("html")
+        if html_content is not None:
+            final_text = html_to_markdown(html_content)
+            citations.extend(
+                h for h in content.get("hrefs") or [] if h and h.startswith("http")
+            )
+        else:
+            final_text = content.get("text") or ""
 
     # De-duplicate citation URLs while preserving order
     return final_text, list(dict.fromkeys(citations))
 
 
+# "参考 X 篇资料" / "参考资料" in the reply text, both in one scan
+_SEARCH_TEXT_RE = re.compile("参考 |参考资料")
+
+# Elements that may show the Doubao model name, in priority order
+MODEL_INDICATOR_SELECTORS: List[str] = [
+    "button[data-testid*='model']",
+    "div[class*='model']",
+    "div[aria-label*='模型']",
+]
+
+# {searchUi, model}: whether a "参考 X 篇资料" button exists, and the Doubao
+# model name (best-effort / can be refined later) - the text of the first
+# match of each indicator selector, first visible non-empty one wins
+_JS_PAGE_META = """(a) => {
+    let model = '';
+    for (const sel of a.model) {
+        const el = document.querySelector(sel);
+        if (el && el.getClientRects().length > 0) {
+            const t = (el.innerText || '').trim();
+            if (t) {
+                model = t;
+                break;
+            }
+        }
+    }
+    return {searchUi: !!document.querySelector(a.search), model};
+}"""
+
+
 def send_prompt_and_collect(
     page, prompt_text: str, website_name: str = "DOUBAO"
 ) -> Dict[str, Optional[str]]:
@@ -819,26 +1049,31 @@ def send_prompt_and_collect(
     # Count messages before sending (best-effort)
     assistant_before = 0
     try:
-        message_list = page.locator(MESSAGE_LIST_SELECTOR)
-        if message_list.count() > 0:
-            container = message_list.first
-            children = container.locator(":scope > div")
-            assistant_before = children.count()
+        assistant_before = count_messages(page)
     except Exception:
         pass
 
     # Input prompt
     print(f"[INFO] Sending prompt to Doubao: {prompt_text[:50]}...")
-    # 直接 focus，不再等待 click 完成，避免前端动画/抖动导致的超时告警
+    # 一次性填入整段 prompt（fill 会先 focus 并触发 input 事件），
+    # 不再逐字 keyboard.type，每个字符都是一次浏览器往返
     try:
-        input_box.evaluate("el => el.focus()")
-    except Exception:
-        pass
-    time.sleep(0.05)
+        input_box.fill(prompt_text)
+    except Exception as e:
+        print(f"[WARN] Doubao input fill failed, typing instead: {e}")
+        try:
+            input_box.evaluate("el => el.focus()")
+        except Exception:
+            pass
+        page.keyboard.type(prompt_text)
 
-    # Type the prompt（减少间隔，加快输入）
-    page.keyboard.type(prompt_text)
-    time.sleep(0.15)
+    # 等前端识别到输入（发送按钮变为可用）再回车，最多 1 秒
+    try:
+        _loc(page, SEND_BTN_ENABLED_SELECTOR).first.wait_for(
+            state="visible", timeout=1000
+        )
+    except PlaywrightTimeoutError:
+        pass
 
     # 直接使用 Enter 发送，放弃对发送按钮的点击，避免 click 卡死
     send_ts = time.time()
@@ -858,15 +1093,11 @@ def send_prompt_and_collect(
     web_search_results: List[Dict[str, str]] = []
     had_reference_button = False
     try:
-        message_list = page.locator(MESSAGE_LIST_SELECTOR)
-        if message_list.count() > 0:
-            container = message_list.first
-            children = container.locator(":scope > div")
-            if children.count() > 0:
-                last_message = children.nth(children.count() - 1)
-                web_search_results, had_reference_button = extract_web_search_results(
-                    page, last_message
-                )
+        last_message = get_latest_message(page)
+        if last_message is not None:
+            web_search_results, had_reference_button = extract_web_search_results(
+                page, last_message
+            )
     except Exception as e:
         print(f"[WARN] Failed to extract Doubao web search results: {e}")
 
@@ -875,14 +1106,23 @@ def send_prompt_and_collect(
     # - 抓到了 web_search_results
     # - 或页面上存在 "参考 X 篇资料" 的按钮
     # - 或回复文本里包含 "参考 X 篇资料" / "参考 X 篇资料"
+    # Reference-button presence and the model name in one round trip
     used_search_ui = False
+    model_name = ""
     try:
-        loc = page.locator(SEARCH_REFERENCE_BUTTON_SELECTOR)
-        used_search_ui = loc.count() > 0
+        probe = page.evaluate(
+            _JS_PAGE_META,
+            {
+                "search": SEARCH_REFERENCE_BUTTON_SELECTOR,
+                "model": MODEL_INDICATOR_SELECTORS,
+            },
+        )
+        used_search_ui = bool(probe.get("searchUi"))
+        model_name = probe.get("model") or ""
     except Exception:
-        used_search_ui = False
+        pass
 
-    used_search_text = ("参考 " in response_text) or ("参考资料" in response_text)
+    used_search_text = bool(_SEARCH_TEXT_RE.search(response_text))
 
     mode_online = (
         "true"
@@ -890,26 +1130,6 @@ def send_prompt_and_collect(
         else "false"
     )
 
-    # Doubao model name detection (best-effort / can be refined later)
-    model_name = ""
-    try:
-        model_indicators = [
-            "button[data-testid*='model']",
-            "div[class*='model']",
-            "div[aria-label*='模型']",
-        ]
-        for selector in model_indicators:
-            try:
-                elem = page.locator(selector).first
-                if elem and elem.is_visible():
-                    model_name = elem.inner_text().strip()
-                    if model_name:
-                        break
-            except Exception:
-                continue
-    except Exception:
-        pass
-
     # Determine status: 若有参考按钮但没解析出任何 web_search_results，则视为错误
     status = "ok"
     error_message = ""
@@ -940,64 +1160,204 @@ def send_prompt_and_collect(
     return item
 
 
+def _json_loads(data):
+    """Parse JSON from str/bytes with orjson when available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(obj) -> bytes:
+    """One NDJSON record as UTF-8 bytes (non-ASCII kept as-is), orjson when available."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+class OutputWriter:
+    """Append-only UTF-8 output file kept open for a whole task.
+
+    Writes go through a 64 KiB buffer; flush() once per saved prompt so an
+    interrupted run still keeps everything that was reported as saved.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.f = open(path, "ab", buffering=1 << 16)
+
+    def write(self, text: str) -> None:
+        self.f.write(text.encode("utf-8"))
+
+    def write_bytes(self, data: bytes) -> None:
+        self.f.write(data)
+
+    def write_record(self, rec: Dict) -> None:
+        self.f.write(_json_dumps(rec) + b"\n")
+
+    def flush(self) -> None:
+        self.f.flush()
+
+    def close(self) -> None:
+        if not self.f.closed:
+            self.f.close()
+
+
+# Header + prompt + response of a markdown block, filled by format_map()
+MD_TEMPLATE = (
+    "# Conversation {conversation_id}\n\n"
+    "- **Website**: {website_name}\n"
+    "- **URL**: {item_url}\n"
+    "- **Model**: {model_name}\n"
+    "- **Online Mode**: {mode_online}\n"
+    "- **Language**: {response_language}\n"
+    "- **Latency**: {latency_ms} ms\n"
+    "\n## Prompt\n\n"
+    "{prompt_text}\n\n"
+    "## Response\n\n"
+    "{response_text}\n\n"
+)
+
+
+class _MarkdownFields(dict):
+    """Missing fields render like it.get() did: as None."""
+
+    def __missing__(self, key):
+        return None
+
+
+def render_markdown(it: Dict[str, Optional[str]]) -> str:
+    """Markdown block of one result, as appended to the .md output."""
+    fields = _MarkdownFields(it)
+    fields["conversation_id"] = it.get("conversation_id") or "unknown"
+    fields["prompt_text"] = (it.get("prompt_text") or "").strip()
+    fields["response_text"] = (it.get("response_text") or "").strip()
+    parts = [MD_TEMPLATE.format_map(fields)]
+
+    # Web search results if available
+    web_search_results = it.get("web_search_results", [])
+    if web_search_results:
+        parts.append("## Web Search Results\n\n")
+        for idx, result in enumerate(web_search_results, 1):
+            title = result.get("title", "Search Result")
+            href = result.get("href", "")
+            snippet = result.get("snippet", "")
+
+            parts.append(f"### {idx}. {title}\n\n")
+            if href:
+                parts.append(f"- **URL**: {href}\n")
+            if snippet:
+                parts.append(f"- **Snippet**: {snippet}\n")
+            parts.append("\n")
+
+    parts.append("---\n\n")
+    return "".join(parts)
+
+
 def write_outputs(
-    ndjson_path: str, md_path: str, items: List[Dict[str, Optional[str]]]
+    ndjson_out: OutputWriter,
+    md_out: OutputWriter,
+    items: List[Dict[str, Optional[str]]],
 ) -> None:
     if not items:
         return
 
-    # Determine write mode
-    ndjson_mode = "a" if os.path.exists(ndjson_path) else "w"
-    md_mode = "a" if os.path.exists(md_path) else "w"
-
-    # Write NDJSON
-    with open(ndjson_path, ndjson_mode, encoding="utf-8") as f:
-        for it in items:
-            f.write(json.dumps(it, ensure_ascii=False) + "\n")
-
-    # Write markdown
-    with open(md_path, md_mode, encoding="utf-8") as f:
-        for it in items:
-            conv_id = it.get("conversation_id") or "unknown"
-            f.write(f"# Conversation {conv_id}\n\n")
-            f.write(f"- **Website**: {it.get('website_name')}\n")
-            f.write(f"- **URL**: {it.get('item_url')}\n")
-            f.write(f"- **Model**: {it.get('model_name')}\n")
-            f.write(f"- **Online Mode**: {it.get('mode_online')}\n")
-            f.write(f"- **Language**: {it.get('response_language')}\n")
-            f.write(f"- **Latency**: {it.get('latency_ms')} ms\n")
-
-            f.write("\n## Prompt\n\n")
-            f.write((it.get("prompt_text") or "").strip() + "\n\n")
-
-            f.write("## Response\n\n")
-            f.write((it.get("response_text") or "").strip() + "\n\n")
-
-            # Write web search results if available
-            web_search_results = it.get("web_search_results", [])
-            if web_search_results:
-                f.write("## Web Search Results\n\n")
-                for idx, result in enumerate(web_search_results, 1):
-                    title = result.get("title", "Search Result")
-                    href = result.get("href", "")
-                    snippet = result.get("snippet", "")
-
-                    f.write(f"### {idx}. {title}\n\n")
-                    if href:
-                        f.write(f"- **URL**: {href}\n")
-                    if snippet:
-                        f.write(f"- **Snippet**: {snippet}\n")
-                    f.write("\n")
-
-            f.write("---\n\n")
+    # One buffered write per file for the whole batch
+    ndjson_out.write_bytes(b"".join(_json_dumps(it) + b"\n" for it in items))
+    md_out.write("".join(render_markdown(it) for it in items))
+    ndjson_out.flush()
+    md_out.flush()
+
+
+# Extra pacing (seconds) on top of human_think_time, shared by all windows:
+# 0 while prompts succeed, raised by each non-ok attempt and halved by each ok
+_THINK_BACKOFF = 0.0
+THINK_BACKOFF_STEP = 1.0
+THINK_BACKOFF_MAX = 8.0
+
+
+def note_prompt_outcome(ok: bool) -> None:
+    """Adapt the human_think_time pacing to the latest attempt's outcome."""
+    global _THINK_BACKOFF
+    if ok:
+        _THINK_BACKOFF = _THINK_BACKOFF / 2 if _THINK_BACKOFF >= 0.2 else 0.0
+    else:
+        _THINK_BACKOFF = min(THINK_BACKOFF_MAX, _THINK_BACKOFF * 2 or THINK_BACKOFF_STEP)
 
 
 def human_think_time(min_s: float = 0.8, max_s: float = 2.2) -> None:
     """Artificial delay helper.
 
-    为了提速，默认延迟缩短；如需更保守，可在调用处传入更大的区间。
+    只有在出现失败（可能触发了风控/限流）后才真正等待：随机区间加上当前的退避值；
+    一切正常时不等待。
+    """
+    if _THINK_BACKOFF <= 0:
+        return
+    time.sleep(random.uniform(min_s, max_s) + _THINK_BACKOFF)
+
+
+# A chat input is rendered and the page is done loading: either the load
+# event fired, or the network went quiet (AutoFR heuristic: fewer than
+# a.maxRequests resource loads finished within the last a.windowMs), so a
+# single slow third-party resource no longer holds up the new conversation
+_JS_CHAT_PAGE_READY = """(a) => {
+    const visible = (el) => el.getClientRects().length > 0;
+    if (!Array.from(document.querySelectorAll(a.sel)).some(visible)) return false;
+    if (document.readyState === 'complete') return true;
+    const now = performance.now();
+    if (now < a.windowMs) return false;
+    const recent = performance.getEntriesByType('resource')
+        .filter((e) => now - e.responseEnd < a.windowMs).length;
+    return recent < a.maxRequests;
+}"""
+
+NETWORK_QUIET_WINDOW_MS = 1000
+NETWORK_QUIET_MAX_REQUESTS = 4
+
+# Upper bound (ms) for a reloaded chat page to become ready
+PAGE_LOAD_TIMEOUT_MS = 25000
+
+
+# Client-side "new chat": route the SPA to the home path without a reload
+_JS_SPA_NEW_CHAT = """(url) => {
+    if (location.href !== url) history.pushState({}, '', url);
+    window.dispatchEvent(new PopStateEvent('popstate', {state: {}}));
+}"""
+
+# Empty conversation on screen: no messages and a visible chat input
+_JS_FRESH_CHAT = """(a) => {
+    const list = document.querySelector(a.list);
+    if (list && list.querySelector(':scope > div')) return false;
+    return Array.from(document.querySelectorAll(a.sel)).some(
+        (el) => el.getClientRects().length > 0
+    );
+}"""
+
+# page -> False once the in-page route change did not produce a fresh chat
+_SPA_NEW_CHAT_OK: "WeakKeyDictionary" = WeakKeyDictionary()
+
+
+def spa_new_conversation(page, timeout_ms: int = 1500) -> bool:
+    """Start a new conversation via the SPA router (no document reload).
+
+    Returns False when the app did not show an empty chat within timeout_ms.
     """
-    time.sleep(random.uniform(min_s, max_s))
+    try:
+        print("[INFO] Starting new Doubao conversation in-page (no reload)...")
+        page.evaluate(_JS_SPA_NEW_CHAT, DOUBAO_HOME_URL)
+        page.wait_for_function(
+            _JS_FRESH_CHAT,
+            arg={"list": MESSAGE_LIST_SELECTOR, "sel": CHAT_INPUT_UNION},
+            timeout=timeout_ms,
+            polling=STREAM_POLL_INTERVAL_MS,
+        )
+        print("[INFO] Doubao new conversation ready")
+        return True
+    except Exception:
+        print("[DEBUG] In-page Doubao new conversation not confirmed, reloading")
+        return False
 
 
 def click_new_conversation(page) -> bool:
@@ -1006,23 +1366,35 @@ def click_new_conversation(page) -> bool:
     为了更稳定、也更快，这里直接通过跳转首页 URL 来"重置"会话，
     不再依赖左侧的「新对话」按钮及其文案/DOM 结构。
     """
+    if DOUBAO_SPA_NEW_CHAT and _SPA_NEW_CHAT_OK.get(page, True):
+        if spa_new_conversation(page):
+            return True
+        # 该页面上前端路由切换不生效，之后直接走整页跳转
+        _SPA_NEW_CHAT_OK[page] = False
+
     try:
         print("[INFO] Starting new Doubao conversation via home URL reload...")
         # 直接跳转到首页 chat URL，相当于在 UI 里点「新对话」
-        page.goto(DOUBAO_HOME_URL)
-        page.wait_for_load_state()
-        # 页面通常很快 ready，减少额外等待
-        time.sleep(0.4)
+        page.goto(DOUBAO_HOME_URL, wait_until="commit")
 
-        # 使用与登录阶段相同的 DOM 判定逻辑，更稳地等待聊天输入框就绪
+        # 由浏览器每 100ms 检查一次：聊天输入框可见，且 load 完成或网络已空闲
+        # （最多 25 秒），两个条件在同一个等待里判断
         print("[DEBUG] Waiting for Doubao chat UI to become ready after reload...")
-        start = time.time()
-        timeout = 25  # 最多等 25 秒
-        while time.time() - start < timeout:
-            if is_chat_ui_ready(page):
-                print("[INFO] Doubao new conversation ready")
-                return True
-            time.sleep(0.5)
+        try:
+            page.wait_for_function(
+                _JS_CHAT_PAGE_READY,
+                arg={
+                    "sel": CHAT_INPUT_UNION,
+                    "windowMs": NETWORK_QUIET_WINDOW_MS,
+                    "maxRequests": NETWORK_QUIET_MAX_REQUESTS,
+                },
+                timeout=PAGE_LOAD_TIMEOUT_MS,
+                polling=STREAM_POLL_INTERVAL_MS,
+            )
+            print("[INFO] Doubao new conversation ready")
+            return True
+        except PlaywrightTimeoutError:
+            pass
 
         print(
             "[WARN] Doubao new conversation may not be fully loaded (chat input still missing)"
@@ -1050,29 +1422,36 @@ def load_processed_prompts(ndjson_path: str) -> set:
         return set()
 
     processed = set()
-    ok_items: List[Dict[str, Optional[str]]] = []
+    # Raw bytes of the ok lines, so a rewrite does not re-serialize anything
+    ok_lines: List[bytes] = []
+    dropped = 0
     try:
-        with open(ndjson_path, "r", encoding="utf-8") as f:
-            for line in f:
-                if line.strip():
-                    try:
-                        item = json.loads(line)
-                        prompt_text = item.get("prompt_text", "").strip()
-                        status = item.get("status", "ok")
-                        if status == "ok":
-                            ok_items.append(item)
-                            if prompt_text:
-                                processed.add(prompt_text)
-                    except json.JSONDecodeError:
-                        continue
-
-        # Rewrite NDJSON to keep only status == "ok" items
-        try:
-            with open(ndjson_path, "w", encoding="utf-8") as wf:
-                for it in ok_items:
-                    wf.write(json.dumps(it, ensure_ascii=False) + "\n")
-        except Exception as e:
-            print(f"[WARN] Failed to rewrite Doubao NDJSON with ok items only: {e}")
+        with open(ndjson_path, "rb") as f:
+            for raw in f:
+                if not raw.strip():
+                    continue
+                try:
+                    item = _json_loads(raw)
+                except ValueError:
+                    dropped += 1
+                    continue
+                if not isinstance(item, dict) or item.get("status", "ok") != "ok":
+                    dropped += 1
+                    continue
+                ok_lines.append(raw if raw.endswith(b"\n") else raw + b"\n")
+                prompt_text = (item.get("prompt_text") or "").strip()
+                if prompt_text:
+                    processed.add(prompt_text)
+
+        # Rewrite NDJSON to keep only status == "ok" items (only when needed)
+        if dropped:
+            tmp_path = ndjson_path + ".tmp"
+            try:
+                with open(tmp_path, "wb", buffering=1 << 16) as wf:
+                    wf.write(b"".join(ok_lines))
+                os.replace(tmp_path, ndjson_path)
+            except Exception as e:
+                print(f"[WARN] Failed to rewrite Doubao NDJSON with ok items only: {e}")
 
         print(
             f"[INFO] Found {len(processed)} already processed Doubao prompts (kept only status='ok')"
@@ -1084,8 +1463,6 @@ def load_processed_prompts(ndjson_path: str) -> set:
 
 
 def main() -> None:
-    ensure_dirs()
-
     # Parse sharding & multi-process arguments
     parser = argparse.ArgumentParser(description="Doubao chat scraper")
     parser.add_argument(
@@ -1109,40 +1486,75 @@ def main() -> None:
             "different --shard-index/--shard-count; master itself will not scrape."
         ),
     )
+    parser.add_argument(
+        "--shard-mode",
+        choices=["block", "interleave"],
+        default="block",
+        help=(
+            "block: each shard takes one contiguous slice of the pending prompts "
+            "(keeps neighbouring prompts together); interleave: idx %% shard-count"
+        ),
+    )
+    parser.add_argument(
+        "--flush-batch",
+        type=int,
+        default=DEFAULT_FLUSH_BATCH,
+        help="Write results to the output files every N successful prompts",
+    )
     args, _ = parser.parse_known_args()
 
     # Master mode：只负责启动多个子进程，每个子进程跑一个 shard
     if args.spawn_workers and args.spawn_workers > 0:
         worker_count = args.spawn_workers
-        script_path = os.path.abspath(__file__)
 
         print(
             f"[INFO] Spawning {worker_count} Doubao worker processes "
             f"for shards 0..{worker_count - 1}"
         )
 
+        # 输入文件与已有输出只在主进程读取/清理一次，按分片切好后交给各子进程
+        # （也避免多个分片同时重写同一个 NDJSON）
+        ensure_dirs()
+        plans = plan_shard_tasks(worker_count, args.shard_mode)
+        if not any(plans):
+            print("[INFO] Nothing left to scrape for Doubao, not spawning workers")
+            return
+
+        # Linux 上用 fork，子进程直接复用本进程已导入的模块（不必重新启动解释器
+        # 和导入 camoufox / playwright）；Windows 没有 fork，macOS 上 fork 不安全
+        # （CPython 默认也是 spawn），其余平台都用 spawn
+        mp_ctx = multiprocessing.get_context(
+            "fork" if sys.platform.startswith("linux") else "spawn"
+        )
         processes = []
         for i in range(worker_count):
-            cmd = [
-                sys.executable,
-                script_path,
-                "--shard-index",
-                str(i),
-                "--shard-count",
-                str(worker_count),
-            ]
-            print(
-                f"[INFO]  - Starting Doubao worker shard {i}/{worker_count} with: {cmd}"
+            shard_args = argparse.Namespace(**vars(args))
+            shard_args.shard_index = i
+            shard_args.shard_count = worker_count
+            shard_args.spawn_workers = 0
+            shard_args.task_plan = plans[i]
+            started = mp_ctx.Event()
+            print(f"[INFO]  - Starting Doubao worker shard {i}/{worker_count}")
+            proc = mp_ctx.Process(
+                target=run_shard,
+                args=(shard_args, started),
+                name=f"doubao-shard-{i}",
             )
-            proc = subprocess.Popen(cmd)
+            proc.start()
             processes.append(proc)
-            # 略微错峰，避免同时抢资源
-            time.sleep(2.0)
+            # 错峰：等上一个分片的浏览器真正启动后再启动下一个，避免同时抢资源
+            # （最多等 SHARD_START_TIMEOUT 秒，不再固定 sleep 2 秒）
+            if i < worker_count - 1 and not started.wait(SHARD_START_TIMEOUT):
+                print(
+                    f"[WARN] Doubao worker shard {i} not started after "
+                    f"{SHARD_START_TIMEOUT}s, starting the next one anyway"
+                )
 
         # 等待所有子进程结束
         exit_codes = []
         for i, p in enumerate(processes):
-            code = p.wait()
+            p.join()
+            code = p.exitcode
             exit_codes.append(code)
             print(f"[INFO] Doubao worker shard {i} exited with code {code}")
 
@@ -1154,21 +1566,47 @@ def main() -> None:
             return
 
     # Worker 模式：真正执行某个 shard 的抓取任务
-    if args.shard_count <= 0:
-        print("[ERROR] --shard-count must be >= 1")
-        return
-    if not (0 <= args.shard_index < args.shard_count):
-        print(
-            f"[ERROR] --shard-index must be in [0, {args.shard_count - 1}], got {args.shard_index}"
-        )
-        return
+    run_shard(args)
 
-    ensure_dirs()
+
+# Event of the --spawn-workers master, set by this shard process once its
+# first browser window is up (or the shard ended without launching one)
+_SHARD_STARTED = None
+
+
+def _signal_shard_started() -> None:
+    if _SHARD_STARTED is not None:
+        _SHARD_STARTED.set()
+
+
+def run_shard(args: argparse.Namespace, started=None) -> None:
+    """Scrape this process's shard of every input file.
+
+    Top-level so --spawn-workers can run it in a multiprocessing child;
+    started is then the master's Event for staggering the launches.
+    """
+    global _SHARD_STARTED
+    _SHARD_STARTED = started
+    try:
+        _run_shard_tasks(args)
+    finally:
+        _signal_shard_started()
+
+
+# One task of a shard: (task name, input file, output ndjson, output md, prompts)
+ShardTask = Tuple[str, str, str, str, List[str]]
+
+
+def plan_shard_tasks(shard_count: int, shard_mode: str) -> List[List[ShardTask]]:
+    """
+    Read every input file and its existing output once and split the pending
+    prompts of each task over shard_count shards. Returns one task list per
+    shard (tasks without prompts for that shard are left out).
+    """
+    plans: List[List[ShardTask]] = [[] for _ in range(shard_count)]
 
     # Find all input files matching pattern *_input_prompts.txt
     project_root = os.path.dirname(os.path.dirname(__file__))
-    import glob
-
     input_files = glob.glob(os.path.join(project_root, "*_input_prompts.txt"))
 
     if not input_files:
@@ -1179,21 +1617,14 @@ def main() -> None:
             input_files = [fallback]
         else:
             print("[ERROR] No input files found. Please create a file with prompts.")
-            return
+            return plans
 
     print(
         f"[INFO] Found {len(input_files)} input file(s): {[os.path.basename(f) for f in input_files]}"
     )
 
-    # Process each input file as a separate task
     for input_file in input_files:
         task_name = extract_task_name(input_file)
-        print(f"\n{'='*60}")
-        print(f"[INFO] Processing Doubao task: {task_name}")
-        print(f"[INFO] Input file: {input_file}")
-        print(f"[INFO] Shard: index={args.shard_index}, count={args.shard_count}")
-        print(f"{'='*60}\n")
-
         prompts = read_prompts(input_file)
         if not prompts:
             print(f"[WARN] No prompts found in {input_file}, skipping...")
@@ -1206,183 +1637,349 @@ def main() -> None:
         output_md = os.path.join(OUTPUT_DIR, f"doubao_conversations_{task_name}.md")
 
         # Load already processed prompts
-        processed_prompts = load_processed_prompts(output_ndjson)
+        processed_prompts = frozenset(load_processed_prompts(output_ndjson))
 
-        # Filter out already processed prompts
-        new_prompts = [p for p in prompts if p.strip() not in processed_prompts]
+        # Filter out already processed prompts (each prompt stripped once)
+        new_idx = [
+            i for i, p in enumerate(prompts) if p.strip() not in processed_prompts
+        ]
 
-        if not new_prompts:
+        if not new_idx:
             print(
                 f"[INFO] All prompts in Doubao task '{task_name}' have been processed. Skipping..."
             )
             continue
 
-        if len(new_prompts) < len(prompts):
+        if len(new_idx) < len(prompts):
             print(
-                f"[INFO] Skipping {len(prompts) - len(new_prompts)} already processed prompts"
+                f"[INFO] Skipping {len(prompts) - len(new_idx)} already processed prompts"
             )
-            print(f"[INFO] Processing {len(new_prompts)} new prompts for Doubao")
+            print(f"[INFO] Processing {len(new_idx)} new prompts for Doubao")
+
+        # Apply sharding: a contiguous slice per shard (block), or every
+        # shard_count-th prompt (interleave)
+        n = len(new_idx)
+        for shard_index in range(shard_count):
+            if shard_mode == "block":
+                start = shard_index * n // shard_count
+                end = (shard_index + 1) * n // shard_count
+                shard_idx = new_idx[start:end]
+            else:
+                shard_idx = new_idx[shard_index::shard_count]
+            if shard_idx:
+                plans[shard_index].append(
+                    (
+                        task_name,
+                        input_file,
+                        output_ndjson,
+                        output_md,
+                        [prompts[i] for i in shard_idx],
+                    )
+                )
+    return plans
 
-        # Apply sharding: keep only prompts whose index matches this shard
-        if args.shard_count > 1:
-            sharded_prompts = [
-                p
-                for idx, p in enumerate(new_prompts)
-                if idx % args.shard_count == args.shard_index
-            ]
-            print(
-                f"[INFO] After sharding, this Doubao shard will process {len(sharded_prompts)} prompts"
-            )
-        else:
-            sharded_prompts = new_prompts
 
-        if not sharded_prompts:
-            print(
-                f"[INFO] No prompts assigned to Doubao shard {args.shard_index} for task '{task_name}', skipping..."
-            )
-            continue
+def _run_shard_tasks(args: argparse.Namespace) -> None:
+    if args.shard_count <= 0:
+        print("[ERROR] --shard-count must be >= 1")
+        return
+    if not (0 <= args.shard_index < args.shard_count):
+        print(
+            f"[ERROR] --shard-index must be in [0, {args.shard_count - 1}], got {args.shard_index}"
+        )
+        return
 
-        process_task(task_name, sharded_prompts, output_ndjson, output_md)
+    ensure_dirs()
 
+    # A --spawn-workers master already planned this shard; otherwise plan here
+    tasks = getattr(args, "task_plan", None)
+    if tasks is None:
+        tasks = plan_shard_tasks(args.shard_count, args.shard_mode)[args.shard_index]
 
-def process_task(
-    task_name: str, prompts: List[str], output_ndjson: str, output_md: str
-) -> None:
-    """Process a single Doubao task with its prompts."""
+    if not tasks:
+        print(f"[INFO] No prompts assigned to Doubao shard {args.shard_index}, skipping...")
+        return
 
-    print("\n" + "=" * 60)
-    print("⚠️  IMPORTANT: A NEW BROWSER WINDOW WILL OPEN (Doubao)")
-    print("    Please login in THE NEW BROWSER WINDOW opened by the script")
-    print("    NOT in your regular browser!")
-    print("=" * 60 + "\n")
+    # Process each input file as a separate task
+    for task_name, input_file, output_ndjson, output_md, prompts in tasks:
+        print(f"\n{'='*60}")
+        print(f"[INFO] Processing Doubao task: {task_name}")
+        print(f"[INFO] Input file: {input_file}")
+        print(f"[INFO] Shard: index={args.shard_index}, count={args.shard_count}")
+        print(f"{'='*60}\n")
+        if args.shard_count > 1:
+            print(
+                f"[INFO] After sharding, this Doubao shard will process {len(prompts)} prompts"
+            )
 
-    with Camoufox(
-        humanize=True,
-        geoip=False,
-        locale="zh-CN",
-        headless=False,
-    ) as browser:
-        page = browser.new_page(
-            locale="zh-CN",
+        process_task(
+            task_name,
+            prompts,
+            output_ndjson,
+            output_md,
+            flush_batch=args.flush_batch,
         )
 
-        # Load cookies before navigation
-        load_cookies_into_context(page, SESSION_COOKIES_FILE)
 
-        print(f"[INFO] Opening Doubao in the Camoufox browser window...")
-        page.goto(DOUBAO_HOME_URL)
-        page.wait_for_load_state()
-
-        # Restore storage
-        load_storage_from_file(page, SESSION_STORAGE_FILE)
+def open_doubao_session(page, worker_id: int) -> bool:
+    """
+    Open the chat page and wait for the chat UI. The saved session is
+    already in the page's context (storage_state), so one navigation is enough.
+    Worker 0 falls back to the manual login and persists the session.
+    """
+    print(f"[INFO] Opening Doubao in the Camoufox browser window...")
+    # The chat-input / login waits below decide readiness; no need to also
+    # wait for the full load event here
+    page.goto(DOUBAO_HOME_URL, wait_until="domcontentloaded")
 
-        # Reload to apply storage
+    if worker_id > 0:
+        # Session was just established by worker 0; only wait for the chat UI
         try:
-            page.goto(DOUBAO_HOME_URL)
-            page.wait_for_load_state()
-        except Exception:
-            pass
+            _loc(page, CHAT_INPUT_VISIBLE).first.wait_for(
+                state="visible", timeout=60000
+            )
+        except PlaywrightTimeoutError:
+            print(f"[ERROR] Doubao worker {worker_id} could not reuse the saved session.")
+            return False
+        return True
+
+    print("[INFO] Waiting for manual Doubao login (up to 5 minutes).")
+    print("[INFO] Please login to Doubao and wait for the chat interface to appear.")
 
-        print("[INFO] Waiting for manual Doubao login (up to 5 minutes).")
+    if not wait_for_login(page, timeout_seconds=300):
         print(
-            "[INFO] Please login to Doubao and wait for the chat interface to appear."
+            "[ERROR] Doubao login not detected within timeout. Please login and rerun."
         )
+        return False
+
+    # Persist session after successful login
+    save_session_state(page.context)
+    return True
+
+
+def collect_with_retries(page, prompt: str, max_retries: int = 3) -> Dict:
+    """send_prompt_and_collect with up to max_retries attempts for non-ok results."""
+    item: Dict[str, Optional[str]] = {}
+    for attempt in range(1, max_retries + 1):
+        try:
+            item = send_prompt_and_collect(page, prompt_text=prompt, website_name="DOUBAO")
+        except Exception as e:
+            print(
+                f"[ERROR] Failed to process Doubao prompt (attempt {attempt}/{max_retries}): {e}"
+            )
+            url = page.url
+            item = {
+                "website_name": "DOUBAO",
+                "conversation_id": get_conversation_id_from_url(url),
+                "item_url": url,
+                "model_name": "",
+                "mode_online": "",
+                "prompt_text": prompt,
+                "response_text": "",
+                "web_search_results": [],
+                "response_language": "",
+                "latency_ms": 0,
+                "status": "error",
+                "error_message": str(e),
+            }
+
+        status = item.get("status", "ok")
+        note_prompt_outcome(status == "ok")
+        if status == "ok":
+            break
 
-        if not wait_for_login(page, timeout_seconds=300):
+        if attempt < max_retries:
             print(
-                "[ERROR] Doubao login not detected within timeout. Please login and rerun."
+                f"[WARN] Doubao prompt failed with status '{status}', retrying after short delay..."
             )
-            return
+            # The retry delay is always taken, on top of the current backoff
+            time.sleep(random.uniform(0.5, 1.2) + _THINK_BACKOFF)
+    return item
 
-        # Persist session after successful login
-        save_cookies_from_context(page, SESSION_COOKIES_FILE)
-        save_storage_to_file(page, SESSION_STORAGE_FILE)
 
-        total_processed = 0
-        consecutive_failures = 0
-        for idx, prompt in enumerate(prompts):
-            print(f"\n[INFO] Processing Doubao prompt {idx + 1}/{len(prompts)}")
+def doubao_worker(
+    worker_id: int,
+    jobs: "queue.Queue",
+    results: "queue.Queue",
+    session_ready: threading.Event,
+    session_ok: List[bool],
+) -> None:
+    """
+    One Camoufox window serving prompts from jobs until it is empty.
+    Playwright's sync API is bound to its thread, so every worker owns its
+    browser. Worker 0 logs in; the others wait and reuse the saved session.
+    """
+    # Imported here: the --spawn-workers master never opens a browser
+    from camoufox.sync_api import Camoufox
 
-            # Always start a fresh conversation before each prompt
-            print("[INFO] Preparing new Doubao conversation...")
-            human_think_time(0.2, 0.5)
-            click_new_conversation(page)
-            human_think_time(0.1, 0.3)
+    if worker_id > 0:
+        session_ready.wait()
+        if not session_ok[0]:
+            return
+    try:
+        with Camoufox(
+            humanize=True,
+            geoip=False,
+            locale="zh-CN",
+            headless=False,
+        ) as browser:
+            _signal_shard_started()
+            # The saved session goes straight into the context instead of
+            # being replayed into the page after a first navigation
+            context = browser.new_context(
+                locale="zh-CN", storage_state=load_session_state()
+            )
+            page = context.new_page()
 
-            # Retry up to 3 times if status is not "ok"
-            max_retries = 3
-            item: Dict[str, Optional[str]] = {}
-            for attempt in range(1, max_retries + 1):
+            logged_in = False
+            try:
+                logged_in = open_doubao_session(page, worker_id)
+            finally:
+                if worker_id == 0:
+                    session_ok[0] = logged_in
+                    session_ready.set()
+            if not logged_in:
+                return
+
+            consecutive_failures = 0
+            while True:
                 try:
-                    item = send_prompt_and_collect(
-                        page, prompt_text=prompt, website_name="DOUBAO"
-                    )
-                except Exception as e:
+                    idx, prompt, total = jobs.get_nowait()
+                except queue.Empty:
+                    break
+                print(f"\n[INFO] Processing Doubao prompt {idx + 1}/{total}")
+
+                item: Dict[str, Optional[str]] = {}
+                try:
+                    # Always start a fresh conversation before each prompt
+                    print("[INFO] Preparing new Doubao conversation...")
+                    human_think_time(0.2, 0.5)
+                    click_new_conversation(page)
+                    human_think_time(0.1, 0.3)
+
+                    item = collect_with_retries(page, prompt)
+                finally:
+                    # Always report back so the writer knows this prompt is finished
+                    results.put((idx, item))
+
+                # If still not ok after retries, skip saving this prompt
+                if item.get("status") != "ok":
                     print(
-                        f"[ERROR] Failed to process Doubao prompt (attempt {attempt}/{max_retries}): {e}"
+                        f"[ERROR] Doubao prompt {idx + 1} failed after 3 attempts, skipping save for this prompt."
                     )
-                    url = page.url
-                    item = {
-                        "website_name": "DOUBAO",
-                        "conversation_id": get_conversation_id_from_url(url),
-                        "item_url": url,
-                        "model_name": "",
-                        "mode_online": "",
-                        "prompt_text": prompt,
-                        "response_text": "",
-                        "web_search_results": [],
-                        "response_language": "",
-                        "latency_ms": 0,
-                        "status": "error",
-                        "error_message": str(e),
-                    }
-
-                status = item.get("status", "ok")
-                if status == "ok":
-                    break
+                    consecutive_failures += 1
+                else:
+                    consecutive_failures = 0
 
-                if attempt < max_retries:
+                # 如果连续多次未成功，暂停 5 分钟，避免持续失败
+                if consecutive_failures >= 5:
                     print(
-                        f"[WARN] Doubao prompt failed with status '{status}', retrying after short delay..."
+                        "[WARN] Detected 5 consecutive non-ok results. Sleeping for 5 minutes to avoid cascading failures..."
                     )
-                    human_think_time(0.5, 1.2)
+                    time.sleep(300)
+                    consecutive_failures = 0
 
-            # If still not ok after retries, skip saving this prompt
-            if item.get("status") != "ok":
-                print(
-                    f"[ERROR] Doubao prompt failed after {max_retries} attempts, skipping save for this prompt."
-                )
-                consecutive_failures += 1
-            else:
-                print(
-                    f"[INFO] Saving Doubao result {idx + 1}/{len(prompts)} to output files..."
-                )
-                write_outputs(output_ndjson, output_md, [item])
-                total_processed += 1
-                consecutive_failures = 0
-                print(f"[INFO] ✓ Saved to {os.path.basename(output_ndjson)}")
+            # Save session state at the end
+            if worker_id == 0:
+                save_session_state(context)
+            context.close()
+    finally:
+        # Never leave the other workers waiting, e.g. if the browser failed to launch
+        if worker_id == 0:
+            session_ready.set()
 
-            # 如果连续多次未成功，暂停 5 分钟，避免持续失败
-            if consecutive_failures >= 5:
-                print(
-                    "[WARN] Detected 5 consecutive non-ok results. Sleeping for 5 minutes to avoid cascading failures..."
-                )
-                time.sleep(300)
-                consecutive_failures = 0
 
-        # Save session state at the end
-        save_cookies_from_context(page, SESSION_COOKIES_FILE)
-        save_storage_to_file(page, SESSION_STORAGE_FILE)
+def process_task(
+    task_name: str,
+    prompts: List[str],
+    output_ndjson: str,
+    output_md: str,
+    flush_batch: int = DEFAULT_FLUSH_BATCH,
+) -> None:
+    """
+    Process a single Doubao task with its prompts on DOUBAO_CONCURRENCY
+    browser windows; the calling thread is the single writer of the outputs.
+    Successful results are written in batches of flush_batch items.
+    """
 
-        print(f"\n{'='*60}")
-        print(f"[INFO] ✓ Doubao task '{task_name}' completed!")
-        print(f"[INFO] Processed {total_processed} prompts")
-        print(f"[INFO] Results saved to:")
-        print(f"  - {output_ndjson}")
-        print(f"  - {output_md}")
-        print(f"{'='*60}\n")
+    print("\n" + "=" * 60)
+    print("⚠️  IMPORTANT: A NEW BROWSER WINDOW WILL OPEN (Doubao)")
+    print("    Please login in THE NEW BROWSER WINDOW opened by the script")
+    print("    NOT in your regular browser!")
+    print("=" * 60 + "\n")
 
-        # input("Press Enter to continue...")
+    total = len(prompts)
+    # Longest prompts first (LPT): long answers start early instead of
+    # leaving one window busy at the end while the others sit idle
+    jobs: "queue.Queue" = queue.Queue()
+    for idx in sorted(range(total), key=lambda i: len(prompts[i]), reverse=True):
+        jobs.put((idx, prompts[idx], total))
+
+    worker_count = min(DOUBAO_CONCURRENCY, total)
+    if worker_count > 1:
+        print(f"[INFO] Running {worker_count} Doubao browser windows in parallel")
+    results: "queue.Queue" = queue.Queue()
+    session_ready = threading.Event()
+    session_ok = [False]
+    threads = []
+    for i in range(worker_count):
+        t = threading.Thread(
+            target=doubao_worker,
+            args=(i, jobs, results, session_ready, session_ok),
+            name=f"doubao-worker-{i}",
+            daemon=True,
+        )
+        t.start()
+        threads.append(t)
+
+    total_processed = 0
+    pending = total
+    # Output files stay open for the whole task instead of per record
+    ndjson_out = OutputWriter(output_ndjson)
+    md_out = OutputWriter(output_md)
+    flush_batch = max(1, flush_batch)
+    pending_items: List[Dict[str, Optional[str]]] = []
+    try:
+        while pending > 0:
+            try:
+                idx, item = results.get(timeout=1.0)
+            except queue.Empty:
+                if not any(t.is_alive() for t in threads):
+                    break
+                continue
+            pending -= 1
+            if item.get("status") != "ok":
+                continue
+            pending_items.append(item)
+            total_processed += 1
+            if len(pending_items) >= flush_batch:
+                print(
+                    f"[INFO] Saving {len(pending_items)} Doubao results to output files..."
+                )
+                write_outputs(ndjson_out, md_out, pending_items)
+                pending_items.clear()
+                print(f"[INFO] ✓ Saved to {os.path.basename(output_ndjson)}")
+    finally:
+        # Also reached on Ctrl+C, so buffered results are never dropped
+        if pending_items:
+            print(f"[INFO] Saving {len(pending_items)} Doubao results to output files...")
+            write_outputs(ndjson_out, md_out, pending_items)
+            print(f"[INFO] ✓ Saved to {os.path.basename(output_ndjson)}")
+        ndjson_out.close()
+        md_out.close()
+
+    for t in threads:
+        t.join()
+
+    print(f"\n{'='*60}")
+    print(f"[INFO] ✓ Doubao task '{task_name}' completed!")
+    print(f"[INFO] Processed {total_processed} prompts")
+    print(f"[INFO] Results saved to:")
+    print(f"  - {output_ndjson}")
+    print(f"  - {output_md}")
+    print(f"{'='*60}\n")
+
+    # input("Press Enter to continue...")
 
 
 if __name__ == "__main__":
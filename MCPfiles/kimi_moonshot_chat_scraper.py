@@ -1,14 +1,50 @@
 #!/usr/bin/env python
 from camoufox.sync_api import Camoufox
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
 from scrapy.http import HtmlResponse
 from datetime import datetime
 from typing import List, Dict, Optional, Tuple
 import time
 import os
+import re
 import json
+import hashlib
+import struct
 import random
+import builtins
+import queue
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from weakref import WeakKeyDictionary
+from html.parser import HTMLParser
+from io import StringIO
 from screeninfo import get_monitors
 
+try:
+    import orjson  # optional: faster (de)serialization of session files / NDJSON
+except ImportError:
+    orjson = None
+
+try:
+    # optional: C-backed (lexbor) DOM for html_to_markdown
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+
+def _env_number(name: str, default, cast=int):
+    """Parse a numeric env var; malformed values fall back to ``default``."""
+    value = os.environ.get(name, "").strip()
+    if not value:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        print(f"[WARN] Invalid {name}={value!r}, using {default}")
+        return default
+
 
 KIMI_HOME_URL = "https://kimi.moonshot.cn/chat"
 USER_DATA_DIR = os.path.join(
@@ -17,6 +53,8 @@ USER_DATA_DIR = os.path.join(
 OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "output")
 SESSION_COOKIES_FILE = os.path.join(os.path.dirname(__file__), "kimi_cookies.json")
 SESSION_STORAGE_FILE = os.path.join(os.path.dirname(__file__), "kimi_storage.json")
+# Number of Camoufox windows working on the same task in parallel
+KIMI_CONCURRENCY = max(1, _env_number("KIMI_CONCURRENCY", 1))
 
 # Tunable selectors. Adjust if Kimi UI updates. Prefer stable roles/labels over CSS classes.
 CHAT_INPUT_SELECTORS: List[str] = [
@@ -37,21 +75,273 @@ ASSISTANT_MESSAGE_SELECTORS: List[str] = [
     'div[class*="assistant"]',
     '[data-testid="assistant-message"]',
 ]
+# Toggles read after every answer to fill model_name / mode_online
+MODEL_TOGGLE_SELECTOR = '[aria-label*="模型"], [aria-label*="Model"], [data-testid*="model"]'
+ONLINE_TOGGLE_SELECTOR = ':is([aria-label*="联网"], [aria-label*="Search"], [aria-pressed])'
+NEW_CONVERSATION_SELECTORS: List[str] = [
+    'div.action-label:has(svg[name="AddConversation"])',
+    'svg[name="AddConversation"]',
+    'button:has-text("新建会话")',
+    'div:has-text("新建会话")',
+]
+# One locator / one wait for the specific candidates. The loose div:has-text
+# also matches every ancestor div, so it stays out of the union (document
+# order would pick the outermost one) and is only probed as a last resort.
+NEW_CONVERSATION_UNION = ", ".join(NEW_CONVERSATION_SELECTORS[:-1])
+NEW_CONVERSATION_WAIT_MS = 5000
+# Highest match count over the assistant selectors, in one evaluate
+_JS_MAX_COUNT = """(sels) => Math.max(0, ...sels.map(
+    (s) => document.querySelectorAll(s).length))"""
+# Any of the chat input candidates visible (evaluated in the page)
+CHAT_INPUT_UNION = ", ".join(CHAT_INPUT_SELECTORS)
+CHAT_INPUT_POLL_MS = 500
+_JS_ANY_VISIBLE = """(sel) => Array.from(document.querySelectorAll(sel)).some(
+    (el) => el.getClientRects().length > 0
+        && getComputedStyle(el).visibility !== 'hidden'
+)"""
+# Put the whole prompt into the chat input in one call. textarea: native value
+# setter + input event (React-controlled); contenteditable editors: select the
+# contents and execCommand('insertText'), which fires beforeinput/input like typing.
+_JS_INSERT_PROMPT = """(el, text) => {
+    el.focus();
+    const input = (data) => el.dispatchEvent(
+        new InputEvent('input', {bubbles: true, inputType: 'insertText', data}));
+    if (el.tagName === 'TEXTAREA' || el.tagName === 'INPUT') {
+        const desc = Object.getOwnPropertyDescriptor(Object.getPrototypeOf(el), 'value');
+        desc.set.call(el, text);
+        input(text);
+        return el.value === text;
+    }
+    const range = document.createRange();
+    range.selectNodeContents(el);
+    const selection = window.getSelection();
+    selection.removeAllRanges();
+    selection.addRange(range);
+    if (!document.execCommand('insertText', false, text)) {
+        el.textContent = text;
+        input(text);
+    }
+    return (el.innerText || '').trim().length > 0;
+}"""
+# Reply body inside an assistant item, in order of preference
+REPLY_BODY_SELECTORS: List[str] = [
+    "div.markdown-container, .markdown-container .markdown",
+    "div.segment-content-box",
+]
 # Within assistant message, anchors are used as citations/sources.
 CITATION_LINK_SELECTOR = "a[href]"
+# One in-page call returns every citation href (instead of nth(i).get_attribute per link)
+_JS_CITATION_HREFS = """(el, sel) => Array.from(
+    el.querySelectorAll(sel), a => a.getAttribute('href')
+).filter(Boolean)"""
+# Web-search side panel entries -> [{href, name, title, snippet}, ...] in one call
+_JS_SEARCH_SITES = """(root) => {
+    const text = (node, sel) => {
+        const n = node.querySelector(sel);
+        return n ? (n.innerText || '').trim() : '';
+    };
+    return Array.from(root.querySelectorAll('div.side-console .sites a.site'), a => ({
+        href: a.getAttribute('href') || '',
+        name: text(a, '.name'),
+        title: text(a, 'p.title'),
+        snippet: text(a, 'p.snippet'),
+    }));
+}"""
+# Hover every .rag-tag once, watch the container with a MutationObserver, and
+# resolve when no rag-tag is left. If conversion goes quiet for quietMs[i], the
+# still-unconverted tags are hovered again (one retry), capped at maxMs overall.
+HOVER_CITATION_OPTIONS = {"quietMs": [500, 700], "maxMs": 3000}
+_JS_HOVER_CITATIONS = """(container, opts) => new Promise((resolve) => {
+    const pending = () => Array.from(container.querySelectorAll('.rag-tag'));
+    const initial = pending().length;
+    if (!initial) {
+        resolve({initial: 0, remaining: 0, rounds: 0});
+        return;
+    }
+    const fire = (tag, type, extra) => tag.dispatchEvent(new MouseEvent(type,
+        Object.assign({view: window, bubbles: true, cancelable: true}, extra)));
+    const hover = (tags) => {
+        tags.forEach((tag) => {
+            tag.scrollIntoView({block: 'center', behavior: 'instant'});
+            const r = tag.getBoundingClientRect();
+            fire(tag, 'mouseover', {clientX: r.left + 5, clientY: r.top + 5});
+            fire(tag, 'mouseenter', {});
+        });
+        // Trigger mouseout on all to dismiss any tooltips
+        setTimeout(() => tags.forEach((tag) => fire(tag, 'mouseout', {})), 100);
+    };
+    const started = performance.now();
+    let remaining = initial;
+    let rounds = 1;
+    let lastChange = started;
+    let done = false;
+    let mo = null;
+    let tick = null;
+    const finish = () => {
+        if (done) return;
+        done = true;
+        mo.disconnect();
+        clearInterval(tick);
+        resolve({initial, remaining, rounds});
+    };
+    mo = new MutationObserver(() => {
+        const n = pending().length;
+        if (n !== remaining) {
+            remaining = n;
+            lastChange = performance.now();
+        }
+        if (n === 0) finish();
+    });
+    mo.observe(container, {subtree: true, childList: true, attributes: true});
+    hover(pending());
+    tick = setInterval(() => {
+        const now = performance.now();
+        if (now - started > opts.maxMs) return finish();
+        if (now - lastChange < opts.quietMs[rounds - 1]) return;
+        if (rounds < opts.quietMs.length) {
+            // Round 2: retry the tags that did not convert
+            rounds += 1;
+            lastChange = now;
+            hover(pending());
+        } else {
+            finish();
+        }
+    }, 50);
+})"""
+
+# Web-search pre-check in one call: does the latest assistant item carry a toolcall
+# block, and is the side panel already open? {found, tool, panel}
+SEARCH_PANEL_SELECTOR = "div.side-console-container.normal"
+_JS_SEARCH_PROBE = """(sel) => {
+    const shown = (el) => !!el && el.getClientRects().length > 0;
+    let items = document.querySelectorAll(sel.item);
+    if (!items.length) {
+        items = document.querySelectorAll(sel.fallback);
+        if (items.length <= sel.before) items = [];
+    }
+    const last = items[items.length - 1];
+    return {
+        found: !!last,
+        tool: !!last && !!last.querySelector('div.segment-content-box div.container-block'),
+        panel: shown(document.querySelector(sel.panel)),
+    };
+}"""
+
+# Search-result page text is fetched over plain HTTP in parallel; pages that fail
+# (bot wall, non-HTML, JS-only shell) fall back to a browser tab one by one
+PAGE_FETCH_WORKERS = max(1, _env_number("KIMI_PAGE_FETCH_WORKERS", 4))
+PAGE_FETCH_TIMEOUT = 20
+PAGE_FETCH_MAX_BYTES = 2 * 1024 * 1024
+PAGE_FETCH_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:135.0) "
+        "Gecko/20100101 Firefox/135.0"
+    ),
+    "Accept": "text/html,application/xhtml+xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
+}
 
 # Kimi-specific send/stop button structure shared by you
 SEND_BUTTON_ROOT = "div.send-button"
 SEND_BUTTON_CONTAINER_DISABLED = "div.send-button-container.disabled"
 STOP_ICON_SELECTOR = 'div.send-button svg[name="stop"]'
 SEND_ICON_SELECTOR = 'div.send-button svg[name="Send"]'
+_SEND_STATE_SELECTORS = {
+    "stop": STOP_ICON_SELECTOR,
+    "send": SEND_ICON_SELECTOR,
+    "disabled": SEND_BUTTON_CONTAINER_DISABLED,
+}
+_JS_SEND_STATE = """(sel) => {
+    const shown = (q) => {
+        const el = document.querySelector(q);
+        return !!el && el.getClientRects().length > 0
+            && getComputedStyle(el).visibility !== 'hidden';
+    };
+    return {
+        generating: shown(sel.stop),
+        sendIcon: shown(sel.send),
+        disabled: shown(sel.disabled),
+    };
+}"""
+# Authenticated chat UI: visible chat container holding a textbox, plus the
+# send button area (may be disabled but should exist)
+_JS_CHAT_UI_READY = """(sendRoot) => {
+    const box = document.querySelector('div.chat-content-container');
+    if (!box || box.getClientRects().length === 0) return false;
+    if (!box.querySelector("div[role='textbox'], div[contenteditable='true']")) return false;
+    return !!document.querySelector(sendRoot);
+}"""
+ASSISTANT_ITEM_SELECTOR = (
+    "div.chat-content-list div.chat-content-item.chat-content-item-assistant"
+)
+
+# Stream completion is tracked in the page: a MutationObserver records when the
+# latest assistant text last changed; Python blocks in wait_for_function on it.
+STREAM_IDLE_MS = 1200  # same window as the old 3 stable ticks x 0.4s
+STREAM_STALL_MS = 10000  # not generating and no text change for this long -> give up
+STREAM_POLL_MS = 100
+_STREAM_SELECTORS = {
+    "item": ASSISTANT_ITEM_SELECTOR,
+    "fallback": ", ".join(ASSISTANT_MESSAGE_SELECTORS),
+    "stop": STOP_ICON_SELECTOR,
+    "send": SEND_ICON_SELECTOR,
+    "idleMs": STREAM_IDLE_MS,
+    "stallMs": STREAM_STALL_MS,
+}
+_JS_STREAM_WATCH = """(sel) => {
+    const prev = window.__kimiStreamState;
+    if (prev) prev.obs.disconnect();
+    const measure = () => {
+        let items = document.querySelectorAll(sel.item);
+        if (!items.length) items = document.querySelectorAll(sel.fallback);
+        const last = items[items.length - 1];
+        return last ? (last.textContent || '').length : 0;
+    };
+    const base = measure();
+    const state = {base, len: base, t: performance.now(), obs: null};
+    state.obs = new MutationObserver(() => {
+        const n = measure();
+        if (n !== state.len) { state.len = n; state.t = performance.now(); }
+    });
+    state.obs.observe(document.body, {childList: true, subtree: true, characterData: true});
+    window.__kimiStreamState = state;
+}"""
+# wait_for_function predicate, evaluated in the page every STREAM_POLL_MS.
+# phase "start": generation began; phase "end": stream finished or stalled.
+# Returns "lost" when a navigation dropped the observer so Python re-installs it.
+_JS_STREAM_WAIT = """(sel) => {
+    const st = window.__kimiStreamState;
+    if (!st) return 'lost';
+    const shown = (q) => {
+        const el = document.querySelector(q);
+        return !!el && el.getClientRects().length > 0;
+    };
+    const generating = shown(sel.stop);
+    if (sel.phase === 'start') {
+        return generating || st.len !== st.base ? 'started' : false;
+    }
+    if (generating) return false;
+    const idle = performance.now() - st.t;
+    if (shown(sel.send) && st.len > 0 && idle >= sel.idleMs) return 'done';
+    if (idle > sel.stallMs) return 'stalled';
+    return false;
+}"""
+
+
+_PRINT_LOCK = threading.Lock()
+
+
+def print(*args, **kwargs) -> None:
+    """print() guarded by a lock so lines from worker threads do not interleave."""
+    with _PRINT_LOCK:
+        builtins.print(*args, **kwargs)
 
 
 def ensure_dirs() -> None:
-    if not os.path.exists(USER_DATA_DIR):
-        os.makedirs(USER_DATA_DIR, exist_ok=True)
-    if not os.path.exists(OUTPUT_DIR):
-        os.makedirs(OUTPUT_DIR, exist_ok=True)
+    # exist_ok covers the "already there" case; no separate exists() stat
+    # (and no race when several scraper processes start at once)
+    os.makedirs(USER_DATA_DIR, exist_ok=True)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
     # MCPfiles already exists; no need to create for session files
 
 
@@ -63,13 +353,65 @@ def read_prompts(path: str) -> List[str]:
     return [p for p in lines if p]
 
 
-def pick_first_visible(page, selectors: List[str]):
-    for selector in selectors:
-        loc = page.locator(selector)
+# page -> {cache_key: selector that last matched}; cleared on main-frame navigation
+_SELECTOR_CACHE: "WeakKeyDictionary" = WeakKeyDictionary()
+
+
+# page -> names of the model/online toggles found missing on that page
+_TOGGLE_ABSENT: "WeakKeyDictionary" = WeakKeyDictionary()
+# page -> {selector: Locator}; locators are lazy, so they stay valid across navigations
+_LOCATOR_CACHE: "WeakKeyDictionary" = WeakKeyDictionary()
+
+
+def cached_locator(page, selector: str):
+    """page.locator(selector), built once per page and reused for every prompt."""
+    per_page = _LOCATOR_CACHE.get(page)
+    if per_page is None:
+        per_page = {}
+        _LOCATOR_CACHE[page] = per_page
+    loc = per_page.get(selector)
+    if loc is None:
+        loc = per_page[selector] = page.locator(selector)
+    return loc
+
+
+def _page_selector_cache(page) -> Dict[str, str]:
+    cache = _SELECTOR_CACHE.get(page)
+    if cache is None:
+        cache = {}
+        _SELECTOR_CACHE[page] = cache
+        try:
+            page.on(
+                "framenavigated",
+                lambda frame: frame == page.main_frame and cache.clear(),
+            )
+        except Exception:
+            pass
+    return cache
+
+
+def _cached_order(selectors: List[str], cached: Optional[str]) -> List[str]:
+    """selectors with the last successful one (if any) tried first."""
+    if not cached:
+        return selectors
+    return [cached] + [s for s in selectors if s != cached]
+
+
+def pick_first_visible(page, selectors: List[str], cache_key: Optional[str] = None):
+    """
+    First visible match among selectors. With cache_key, the selector that
+    matched last time on this page is tried first (mostly a single probe).
+    """
+    cache = _page_selector_cache(page) if cache_key else None
+    ordered = _cached_order(selectors, cache.get(cache_key) if cache else None)
+    for selector in ordered:
+        loc = cached_locator(page, selector)
         try:
             if loc.count() > 0:
                 first = loc.first
                 if first.is_visible():
+                    if cache is not None:
+                        cache[cache_key] = selector
                     return first
         except Exception:
             continue
@@ -89,44 +431,56 @@ def is_chat_ui_ready(page) -> bool:
         if "/chat" not in current_url:
             return False
 
-        chat_container = page.locator("div.chat-content-container")
-        if chat_container.count() == 0 or not chat_container.first.is_visible():
-            return False
-        # Require a textbox within the chat container
-        chat_textbox = chat_container.locator(
-            "div[role='textbox'], div[contenteditable='true']"
-        )
-        if chat_textbox.count() == 0:
-            return False
-        # Require the send button area present (may be disabled but should exist)
-        send_root = page.locator(SEND_BUTTON_ROOT)
-        if send_root.count() == 0:
-            return False
-        return True
+        # Container, textbox and send area checked in one evaluate
+        return bool(page.evaluate(_JS_CHAT_UI_READY, SEND_BUTTON_ROOT))
     except Exception:
         return False
 
 
+def wait_for_chat_input(page, timeout_seconds: float) -> bool:
+    """
+    Wait (browser-side, via wait_for_function) until a chat input is visible.
+    Survives navigations during the wait, e.g. the redirect right after login.
+    """
+    deadline = time.time() + timeout_seconds
+    while True:
+        remaining_ms = (deadline - time.time()) * 1000
+        if remaining_ms <= 0:
+            return False
+        try:
+            page.wait_for_function(
+                _JS_ANY_VISIBLE,
+                arg=CHAT_INPUT_UNION,
+                timeout=max(1, remaining_ms),
+                polling=CHAT_INPUT_POLL_MS,
+            )
+            return True
+        except PlaywrightTimeoutError:
+            return False
+        except Exception:
+            # Execution context destroyed by a navigation; wait on the new document
+            time.sleep(0.5)
+
+
 def wait_for_login(page, timeout_seconds: int = 300) -> bool:
-    print("[INFO] Please login within 30 seconds...")
-    # Wait 30 seconds for user to login
-    time.sleep(15)
+    # Saved cookies/storage usually mean we are already in: no fixed pause then
+    if is_chat_ui_ready(page):
+        print("[INFO] Already logged in, chat UI is ready")
+        return True
 
+    print(f"[INFO] Please login within {timeout_seconds} seconds...")
     print("[INFO] Checking for chat input box...")
-    start = time.time()
-    remaining = timeout_seconds - 30
-    while time.time() - start < remaining:
-        # Simple check: just look for any visible textbox
-        elem = pick_first_visible(page, CHAT_INPUT_SELECTORS)
-        if elem:
-            print("[INFO] Chat input detected, ready to send prompts")
-            return True
-        time.sleep(1)
+    # Simple check: just look for any visible textbox
+    if wait_for_chat_input(page, timeout_seconds):
+        print("[INFO] Chat input detected, ready to send prompts")
+        return True
 
     print("[WARN] Chat input not found after timeout")
     return False
 
 
+# Pure string parsing; the same URL is looked up several times per prompt
+@lru_cache(maxsize=128)
 def get_conversation_id_from_url(url: str) -> str:
     # Kimi often uses /chat/<id> or query params; return the last non-empty path segment.
     try:
@@ -139,18 +493,233 @@ def get_conversation_id_from_url(url: str) -> str:
     return ""
 
 
+def prompt_fingerprint(prompt: str) -> bytes:
+    """Fixed-size blake2b key for a stripped prompt (used by the processed set)."""
+    return hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).digest()
+
+
+# Near-duplicate prompt filter (MinHash over character 5-grams + LSH banding).
+# KIMI_NEAR_DUP_THRESHOLD=0.8 skips prompts whose estimated Jaccard similarity
+# to an already processed (or already scheduled) prompt reaches the threshold;
+# 0 (default) keeps the exact-match dedup only.
+NEAR_DUP_THRESHOLD = _env_number("KIMI_NEAR_DUP_THRESHOLD", 0.0, float)
+MINHASH_NUM_PERM = 64
+MINHASH_SHINGLE = 5
+MINHASH_BANDS = 16  # 16 bands x 4 rows: ~99.9% recall at J=0.8, candidates are re-checked
+_MINHASH_PRIME = (1 << 61) - 1
+# Fixed seed: signatures in the sidecar stay comparable across runs
+_minhash_rng = random.Random(20240501)
+_MINHASH_PARAMS = [
+    (_minhash_rng.randrange(1, _MINHASH_PRIME), _minhash_rng.randrange(_MINHASH_PRIME))
+    for _ in range(MINHASH_NUM_PERM)
+]
+del _minhash_rng
+# 空白、标点差异不算区别
+_RE_SHINGLE_NOISE = re.compile(r"[\W_]+")
+
+
+def minhash_signature(text: str) -> Tuple[int, ...]:
+    """64 x 32-bit MinHash values over the normalized character 5-grams of text."""
+    norm = _RE_SHINGLE_NOISE.sub("", text.lower())
+    n = MINHASH_SHINGLE
+    shingles = {norm[i : i + n] for i in range(max(1, len(norm) - n + 1))}
+    hashes = [
+        int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+        for s in shingles
+    ]
+    p = _MINHASH_PRIME
+    return tuple(min((a * h + b) % p for h in hashes) & 0xFFFFFFFF for a, b in _MINHASH_PARAMS)
+
+
+class MinHashIndex:
+    """Banded LSH over MinHash signatures; a band hit is confirmed by the signature Jaccard."""
+
+    def __init__(self, threshold: float) -> None:
+        self.threshold = threshold
+        self.rows = MINHASH_NUM_PERM // MINHASH_BANDS
+        self.buckets: List[Dict[Tuple[int, ...], List[Tuple[int, ...]]]] = [
+            {} for _ in range(MINHASH_BANDS)
+        ]
+
+    def _bands(self, sig: Tuple[int, ...]):
+        r = self.rows
+        for i, table in enumerate(self.buckets):
+            yield table, sig[i * r : (i + 1) * r]
+
+    def insert(self, sig: Tuple[int, ...]) -> None:
+        for table, key in self._bands(sig):
+            table.setdefault(key, []).append(sig)
+
+    def query(self, sig: Tuple[int, ...]) -> bool:
+        need = self.threshold * MINHASH_NUM_PERM
+        checked = set()
+        for table, key in self._bands(sig):
+            for other in table.get(key, ()):
+                if id(other) in checked:
+                    continue
+                checked.add(id(other))
+                if sum(x == y for x, y in zip(sig, other)) >= need:
+                    return True
+        return False
+
+
+# .sig sidecar: magic header, then fixed-size records of
+# 16-byte prompt_fingerprint() + MINHASH_NUM_PERM little-endian uint32
+_SIG_MAGIC = b"KMH1"
+_SIG_RECORD = struct.Struct(f"<16s{MINHASH_NUM_PERM}I")
+
+
+def signature_path(ndjson_path: str) -> str:
+    return ndjson_path + ".sig"
+
+
+def _append_signature_records(
+    sig_path: str, records: List[Tuple[bytes, Tuple[int, ...]]]
+) -> None:
+    if not records:
+        return
+    pack = _SIG_RECORD.pack
+    with open(sig_path, "ab") as f:
+        head = _SIG_MAGIC if f.tell() == 0 else b""
+        f.write(head + b"".join(pack(fp, *sig) for fp, sig in records))
+
+
+def append_prompt_signatures(ndjson_path: str, items: List[Dict]) -> None:
+    """Append (fingerprint, signature) records for items to the .sig sidecar."""
+    records = []
+    for it in items:
+        prompt = (it.get("prompt_text") or "").strip()
+        if prompt:
+            records.append((prompt_fingerprint(prompt), minhash_signature(prompt)))
+    _append_signature_records(signature_path(ndjson_path), records)
+
+
+def _read_signatures(sig_path: str) -> Dict[bytes, Tuple[int, ...]]:
+    """
+    fingerprint -> signature from the sidecar. A torn last record (crash
+    mid-append) is cut off; a file without the header (old format) is
+    discarded, so appends always stay record-aligned.
+    """
+    try:
+        with open(sig_path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return {}
+    if not data.startswith(_SIG_MAGIC):
+        os.remove(sig_path)
+        return {}
+    body = memoryview(data)[len(_SIG_MAGIC) :]
+    whole = len(body) - len(body) % _SIG_RECORD.size
+    if whole != len(body):
+        with open(sig_path, "r+b") as f:
+            f.truncate(len(_SIG_MAGIC) + whole)
+    return {rec[0]: rec[1:] for rec in _SIG_RECORD.iter_unpack(body[:whole])}
+
+
+def load_near_dup_index(ndjson_path: str, processed: set) -> MinHashIndex:
+    """
+    Build the LSH index from the processed prompts. Signatures come from the
+    binary .sig sidecar; prompts without one (older runs) are hashed from the
+    NDJSON once and appended to the sidecar.
+    """
+    index = MinHashIndex(NEAR_DUP_THRESHOLD)
+    sig_path = signature_path(ndjson_path)
+    sigs = {
+        fp: sig for fp, sig in _read_signatures(sig_path).items() if fp in processed
+    }
+
+    if len(sigs) < len(processed) and os.path.exists(ndjson_path):
+        missing = []
+        with open(ndjson_path, "rb") as f:
+            for line in f:
+                record = _scan_ndjson_record(line)
+                if record is None or not record[0]:
+                    continue
+                try:
+                    fp = prompt_fingerprint(record[0])
+                except UnicodeError:
+                    continue  # never in processed, see load_processed_prompts
+                if fp in processed and fp not in sigs:
+                    sigs[fp] = minhash_signature(record[0])
+                    missing.append((fp, sigs[fp]))
+        _append_signature_records(sig_path, missing)
+
+    for sig in sigs.values():
+        index.insert(sig)
+    return index
+
+
+def filter_near_duplicates(
+    prompts: List[str], index: MinHashIndex
+) -> Tuple[List[str], int]:
+    """Drop prompts too similar to an indexed one; kept prompts join the index."""
+    kept: List[str] = []
+    skipped = 0
+    for p in prompts:
+        sig = minhash_signature(p)
+        if index.query(sig):
+            skipped += 1
+            continue
+        index.insert(sig)
+        kept.append(p)
+    return kept, skipped
+
+
+_ZH_RE = re.compile("[\u4e00-\u9fff]")
+
+
 def detect_language(text: str) -> str:
-    for ch in text:
-        if "\u4e00" <= ch <= "\u9fff":
-            return "zh"
-    return "en"
+    # One C-level scan that stops at the first CJK ideograph
+    return "zh" if _ZH_RE.search(text) else "en"
+
+
+def _json_loads(data):
+    """Parse JSON from str/bytes with orjson when available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(obj, indent: bool = False) -> bytes:
+    """Serialize to UTF-8 JSON bytes (non-ASCII kept as-is) with orjson when available."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode(
+        "utf-8"
+    )
+
+
+def _write_json_atomic(path: str, obj) -> None:
+    """
+    Write pretty JSON to path + ".tmp", then os.replace it into place, so a
+    crash mid-write never leaves a truncated session file behind.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb", buffering=1 << 16) as f:
+        f.write(_json_dumps(obj, indent=True))
+    os.replace(tmp_path, path)
+
+
+def _ndjson_line(obj) -> bytes:
+    """One NDJSON record (newline included) as UTF-8 bytes, orjson when available."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(
+                obj, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS
+            )
+        except TypeError:
+            pass  # e.g. ints beyond 64 bit; the stdlib encoder handles those
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
 
 
 def load_cookies_into_context(page, cookies_path: str) -> None:
     try:
         if os.path.exists(cookies_path):
-            with open(cookies_path, "r", encoding="utf-8") as f:
-                cookies = json.load(f)
+            with open(cookies_path, "rb") as f:
+                cookies = _json_loads(f.read())
             if isinstance(cookies, list) and len(cookies) > 0:
                 page.context.add_cookies(cookies)
     except Exception:
@@ -160,8 +729,7 @@ def load_cookies_into_context(page, cookies_path: str) -> None:
 def save_cookies_from_context(page, cookies_path: str) -> None:
     try:
         cookies = page.context.cookies()
-        with open(cookies_path, "w", encoding="utf-8") as f:
-            json.dump(cookies, f, ensure_ascii=False, indent=2)
+        _write_json_atomic(cookies_path, cookies)
     except Exception:
         pass
 
@@ -170,8 +738,8 @@ def load_storage_from_file(page, storage_path: str) -> None:
     try:
         if not os.path.exists(storage_path):
             return
-        with open(storage_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(storage_path, "rb") as f:
+            data = _json_loads(f.read())
         local_items = data.get("localStorage", {})
         session_items = data.get("sessionStorage", {})
         if local_items:
@@ -190,134 +758,240 @@ def load_storage_from_file(page, storage_path: str) -> None:
 
 def save_storage_to_file(page, storage_path: str) -> None:
     try:
-        ls = page.evaluate("""() => Object.fromEntries(Object.entries(localStorage))""")
-        ss = page.evaluate(
-            """() => Object.fromEntries(Object.entries(sessionStorage))"""
+        # Both storages in one evaluate
+        data = page.evaluate(
+            """() => ({
+                localStorage: Object.fromEntries(Object.entries(localStorage)),
+                sessionStorage: Object.fromEntries(Object.entries(sessionStorage)),
+            })"""
         )
-        with open(storage_path, "w", encoding="utf-8") as f:
-            json.dump(
-                {"localStorage": ls, "sessionStorage": ss},
-                f,
-                ensure_ascii=False,
-                indent=2,
-            )
+        _write_json_atomic(storage_path, data)
     except Exception:
         pass
 
 
-def is_generating(page) -> bool:
+def _send_state(page) -> Dict[str, bool]:
+    """
+    Stop icon / send icon / disabled send container visibility in one
+    evaluate (instead of count() + is_visible() per selector).
+    """
     try:
-        icon = page.locator(STOP_ICON_SELECTOR)
-        return icon.count() > 0 and icon.first.is_visible()
+        return page.evaluate(_JS_SEND_STATE, _SEND_STATE_SELECTORS)
     except Exception:
-        return False
+        return {"generating": False, "sendIcon": False, "disabled": False}
+
+
+def is_generating(page) -> bool:
+    return _send_state(page)["generating"]
 
 
 def is_send_disabled(page) -> bool:
     # Disabled when container has 'disabled' class
-    try:
-        cont = page.locator(SEND_BUTTON_CONTAINER_DISABLED)
-        return cont.count() > 0 and cont.first.is_visible()
-    except Exception:
-        return False
+    return _send_state(page)["disabled"]
 
 
 def is_send_icon_visible(page) -> bool:
-    try:
-        icon = page.locator(SEND_ICON_SELECTOR)
-        return icon.count() > 0 and icon.first.is_visible()
-    except Exception:
-        return False
+    return _send_state(page)["sendIcon"]
 
 
-def html_to_markdown(html: str) -> str:
+# Compiled once at import; html_to_markdown only runs these two passes
+_RE_MULTI_NL = re.compile(r"\n{3,}")
+# &nbsp; decodes to \xa0 and is folded into the same pass as plain spaces
+_RE_MULTI_SPACE = re.compile(r"[ \xa0]+")
+_HEADING_TAGS = {f"h{i}": i for i in range(1, 7)}
+_SKIP_TAGS = frozenset(("script", "style"))
+_LIST_TAGS = frozenset(("ol", "ul"))
+_BLOCK_CLOSE_TAGS = frozenset(("p", "div", *_HEADING_TAGS))
+
+
+class KimiMDExtractor(HTMLParser):
     """
-    Simple HTML to Markdown converter focused on preserving inline citations.
-    Handles common tags: <a>, <br>, <p>, <div>, <ol>, <ul>, <li>, etc.
+    Single-pass HTML -> Markdown converter for Kimi replies.
+    Keeps inline citations: <a> becomes [site_name](url), an unconverted
+    <div class="rag-tag"> becomes [site_name].
     """
-    import re
 
-    # Remove script/style tags
-    html = re.sub(
-        r"<(script|style)[^>]*>.*?</\1>", "", html, flags=re.DOTALL | re.IGNORECASE
-    )
+    def __init__(self) -> None:
+        # convert_charrefs=True: the parser decodes &amp; / &nbsp; / &#39; ... for us
+        super().__init__(convert_charrefs=True)
+        self.buf = StringIO()
+        # Open citation frames: {"kind": "a"|"rag", "href", "site", "text", "depth"}
+        self.stack: List[Dict] = []
+        self.skip_depth = 0  # inside <script>/<style>
+
+    def handle_starttag(self, tag, attrs) -> None:
+        if tag in _SKIP_TAGS:
+            self.skip_depth += 1
+            return
+        if self.skip_depth:
+            return
+        if self.stack:
+            # Inside a citation only its text matters; count nested divs so the
+            # right </div> closes a rag-tag frame.
+            top = self.stack[-1]
+            if top["kind"] == "rag" and tag == "div":
+                top["depth"] += 1
+            return
+        attr = dict(attrs)
+        if tag == "a":
+            self.stack.append(
+                {
+                    "kind": "a",
+                    "href": attr.get("href") or "",
+                    "site": attr.get("data-site-name") or "",
+                    "text": [],
+                    "depth": 0,
+                }
+            )
+        elif tag == "div" and "rag-tag" in (attr.get("class") or ""):
+            self.stack.append(
+                {
+                    "kind": "rag",
+                    "href": "",
+                    "site": attr.get("data-site-name") or "",
+                    "text": [],
+                    "depth": 0,
+                }
+            )
+        elif tag == "br":
+            self.buf.write("\n")
+        elif tag == "li":
+            self.buf.write("\n- ")
+        elif tag in _LIST_TAGS:
+            self.buf.write("\n")
+        elif tag in _HEADING_TAGS:
+            self.buf.write("#" * _HEADING_TAGS[tag] + " ")
+
+    def handle_endtag(self, tag) -> None:
+        if tag in _SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+            return
+        if self.skip_depth:
+            return
+        if self.stack:
+            top = self.stack[-1]
+            if top["kind"] == "a" and tag == "a":
+                self._close_frame()
+            elif top["kind"] == "rag" and tag == "div":
+                if top["depth"]:
+                    top["depth"] -= 1
+                else:
+                    self._close_frame()
+            return
+        if tag in _BLOCK_CLOSE_TAGS:
+            self.buf.write("\n\n")
+        elif tag in _LIST_TAGS:
+            self.buf.write("\n")
 
-    # Convert <a href="...">text</a> to [site_name](url) format
-    def replace_link(match):
-        full_tag = match.group(0)
-        # Extract href
-        href_match = re.search(r'href=["\']([^"\']+)["\']', full_tag)
-        href = href_match.group(1) if href_match else ""
-        # Extract data-site-name
-        site_match = re.search(r'data-site-name=["\']([^"\']+)["\']', full_tag)
-        site_name = site_match.group(1) if site_match else ""
-        # Get inner text
-        inner = re.sub(r"<[^>]+>", "", match.group(1)).strip()
-
-        if not href:
-            return inner if inner else ""
-        # Prefer site_name, fallback to inner text, ultimate fallback to "source"
-        display = site_name or inner or "source"
-        return f"[{display}]({href})"
-
-    # Also handle <div class="rag-tag" data-site-name="..."> (unconverted citations)
-    def replace_div_citation(match):
-        full_tag = match.group(0)
-        site_match = re.search(r'data-site-name=["\']([^"\']+)["\']', full_tag)
-        site_name = site_match.group(1) if site_match else "引用"
-        # Return just the site name in brackets (no URL available)
-        return f"[{site_name}]"
-
-    # Match <a ...>...</a>
-    html = re.sub(
-        r"<a[^>]*>(.*?)</a>", replace_link, html, flags=re.DOTALL | re.IGNORECASE
-    )
+    def handle_data(self, data) -> None:
+        if self.skip_depth:
+            return
+        if self.stack:
+            self.stack[-1]["text"].append(data)
+        else:
+            self.buf.write(data)
 
-    # Match <div class="rag-tag"...>...</div> for unconverted citations
-    html = re.sub(
-        r'<div[^>]*class=["\'][^"\']*rag-tag[^"\']*["\'][^>]*>.*?</div>',
-        replace_div_citation,
-        html,
-        flags=re.DOTALL | re.IGNORECASE,
-    )
+    def _close_frame(self) -> None:
+        frame = self.stack.pop()
+        if frame["kind"] == "rag":
+            # No URL available yet (tag was never hovered)
+            self.buf.write(f"[{frame['site'] or '引用'}]")
+            return
+        inner = "".join(frame["text"]).strip()
+        self.buf.write(_citation_markdown(frame["href"], frame["site"], inner))
 
-    # Convert <br> to newline
-    html = re.sub(r"<br\s*/?>", "\n", html, flags=re.IGNORECASE)
-
-    # Convert </p>, </div> to double newline for paragraphs
-    html = re.sub(r"</(p|div)>", "\n\n", html, flags=re.IGNORECASE)
-
-    # Convert <li> to "- " for lists
-    html = re.sub(r"<li[^>]*>", "\n- ", html, flags=re.IGNORECASE)
-    html = re.sub(r"</li>", "", html, flags=re.IGNORECASE)
-
-    # Convert ordered lists
-    html = re.sub(r"<ol[^>]*>", "\n", html, flags=re.IGNORECASE)
-    html = re.sub(r"</ol>", "\n", html, flags=re.IGNORECASE)
-    html = re.sub(r"<ul[^>]*>", "\n", html, flags=re.IGNORECASE)
-    html = re.sub(r"</ul>", "\n", html, flags=re.IGNORECASE)
-
-    # Convert headings
-    for i in range(6, 0, -1):
-        html = re.sub(
-            f"<h{i}[^>]*>(.*?)</h{i}>",
-            "#" * i + r" \1\n\n",
-            html,
-            flags=re.DOTALL | re.IGNORECASE,
-        )
+    def markdown(self) -> str:
+        self.close()
+        # Flush citations left open by truncated HTML
+        while self.stack:
+            self._close_frame()
+        return _tidy_markdown(self.buf.getvalue())
+
+
+def _tidy_markdown(text: str) -> str:
+    text = _RE_MULTI_NL.sub("\n\n", text)
+    text = _RE_MULTI_SPACE.sub(" ", text)
+    return text.strip()
 
-    # Remove all other tags
-    html = re.sub(r"<[^>]+>", "", html)
 
-    # Decode HTML entities
-    html = html.replace("&lt;", "<").replace("&gt;", ">").replace("&amp;", "&")
-    html = html.replace("&nbsp;", " ").replace("&quot;", '"').replace("&#39;", "'")
+def _citation_markdown(href: str, site_name: str, inner: str) -> str:
+    if not href:
+        return inner
+    # Prefer site_name, fallback to inner text, ultimate fallback to "source"
+    return f"[{site_name or inner or 'source'}]({href})"
+
+
+def lexbor_to_markdown(html: str) -> str:
+    """
+    Same output as KimiMDExtractor, walking a selectolax/lexbor DOM instead.
+    Iterative (explicit stack), so deeply nested replies cannot hit the
+    recursion limit.
+    """
+    tree = LexborHTMLParser(html)
+    root = tree.body or tree.root
+    if root is None:
+        return ""
+    out: List[str] = []
+    # Items are nodes to visit or strings to emit once a node's children are done
+    stack: list = list(reversed(list(root.iter(include_text=True))))
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            out.append(item)
+            continue
+        tag = item.tag
+        if tag == "-text":
+            out.append(item.text(deep=False))
+            continue
+        if tag in _SKIP_TAGS or tag.startswith("-"):
+            continue  # script/style, comments, doctype
+        attrs = item.attributes
+        if tag == "a":
+            out.append(
+                _citation_markdown(
+                    attrs.get("href") or "",
+                    attrs.get("data-site-name") or "",
+                    item.text(deep=True).strip(),
+                )
+            )
+            continue
+        if tag == "div" and "rag-tag" in (attrs.get("class") or ""):
+            # No URL available yet (tag was never hovered)
+            out.append(f"[{attrs.get('data-site-name') or '引用'}]")
+            continue
+
+        close = ""
+        if tag == "br":
+            out.append("\n")
+        elif tag == "li":
+            out.append("\n- ")
+        elif tag in _LIST_TAGS:
+            out.append("\n")
+            close = "\n"
+        elif tag in _HEADING_TAGS:
+            out.append("#" * _HEADING_TAGS[tag] + " ")
+        if tag in _BLOCK_CLOSE_TAGS:
+            close = "\n\n"
+        if close:
+            stack.append(close)
+        stack.extend(reversed(list(item.iter(include_text=True))))
+    return _tidy_markdown("".join(out))
 
-    # Clean up multiple newlines
-    html = re.sub(r"\n{3,}", "\n\n", html)
-    html = re.sub(r" +", " ", html)
 
-    return html.strip()
+def html_to_markdown(html: str) -> str:
+    """
+    Simple HTML to Markdown converter focused on preserving inline citations.
+    Handles common tags: <a>, <br>, <p>, <div>, <ol>, <ul>, <li>, headings.
+    Uses selectolax when installed, else the stdlib single-pass parser.
+    """
+    if LexborHTMLParser is not None:
+        try:
+            return lexbor_to_markdown(html)
+        except Exception as e:
+            print(f"[WARN] selectolax markdown conversion failed, using HTMLParser: {e}")
+    parser = KimiMDExtractor()
+    parser.feed(html)
+    return parser.markdown()
 
 
 def hover_all_citations_and_extract_markdown(page, container) -> Tuple[str, List[str]]:
@@ -329,69 +1003,17 @@ def hover_all_citations_and_extract_markdown(page, container) -> Tuple[str, List
     citations_hrefs = []
 
     try:
-        # Find all rag-tag elements
-        rag_tags = container.locator(".rag-tag")
-        initial_count = rag_tags.count()
-        print(f"[DEBUG] Found {initial_count} rag-tag elements to process")
-
         # Use JavaScript to batch trigger events - much faster than physical hover!
+        # One call: hover every rag-tag, then resolve as soon as all of them
+        # turned into <a> (or conversion went quiet) instead of fixed sleeps
         print("[DEBUG] Triggering hover events via JavaScript...")
-
-        for round_num in range(2):  # Do 2 rounds to catch any that didn't convert
-            if round_num > 0:
-                print(f"[DEBUG] Round {round_num + 1}: Retrying unconverted tags...")
-
-            page.evaluate(
-                """
-                (container) => {
-                    const tags = container.querySelectorAll('.rag-tag');
-                    console.log(`Processing ${tags.length} rag-tag elements...`);
-                    
-                    tags.forEach((tag, index) => {
-                        // Scroll into view
-                        tag.scrollIntoView({block: 'center', behavior: 'instant'});
-                        
-                        // Trigger mouseover events
-                        const mouseoverEvent = new MouseEvent('mouseover', {
-                            view: window,
-                            bubbles: true,
-                            cancelable: true,
-                            clientX: tag.getBoundingClientRect().left + 5,
-                            clientY: tag.getBoundingClientRect().top + 5
-                        });
-                        tag.dispatchEvent(mouseoverEvent);
-                        
-                        const mouseenterEvent = new MouseEvent('mouseenter', {
-                            view: window,
-                            bubbles: true,
-                            cancelable: true
-                        });
-                        tag.dispatchEvent(mouseenterEvent);
-                        
-                        // Small delay between each tag (simulate real user)
-                        // Note: This is synchronous delay in JS, not blocking Python
-                    });
-                    
-                    // Trigger mouseout on all to dismiss any tooltips
-                    setTimeout(() => {
-                        tags.forEach(tag => {
-                            const mouseoutEvent = new MouseEvent('mouseout', {
-                                view: window,
-                                bubbles: true,
-                                cancelable: true
-                            });
-                            tag.dispatchEvent(mouseoutEvent);
-                        });
-                    }, 100);
-                }
-            """,
-                container.element_handle(),
-            )
-
-            # Wait for API calls to complete and DOM to update
-            wait_time = 0.5 if round_num == 0 else 0.7
-            print(f"[DEBUG] Waiting {wait_time}s for API calls and DOM updates...")
-            time.sleep(wait_time)
+        t0 = time.time()
+        # Evaluated on the locator itself: no retained element handle
+        hover = container.evaluate(_JS_HOVER_CITATIONS, HOVER_CITATION_OPTIONS)
+        print(
+            f"[DEBUG] rag-tag hover: {hover['initial']} found, {hover['remaining']} unconverted "
+            f"after {hover['rounds']} round(s), {time.time() - t0:.2f}s"
+        )
 
         # Now extract the HTML from markdown-container
         md_container = container.locator(
@@ -406,24 +1028,17 @@ def hover_all_citations_and_extract_markdown(page, container) -> Tuple[str, List
             # Convert HTML to markdown with inline links
             markdown_text = html_to_markdown(html_content)
 
-            # Extract all hrefs for citations list
-            a_tags = md_container.locator("a[href]")
-            citation_count = a_tags.count()
+            # Extract all hrefs for citations list (single round-trip)
+            citations_hrefs = md_container.first.evaluate(
+                _JS_CITATION_HREFS, CITATION_LINK_SELECTOR
+            )
 
             # Also count remaining div.rag-tag elements
             remaining_divs = md_container.locator("div.rag-tag").count()
             print(
-                f"[DEBUG] After hover: {citation_count} <a> tags, {remaining_divs} unconverted <div> tags"
+                f"[DEBUG] After hover: {len(citations_hrefs)} <a> tags, {remaining_divs} unconverted <div> tags"
             )
 
-            for i in range(citation_count):
-                try:
-                    href = a_tags.nth(i).get_attribute("href")
-                    if href:
-                        citations_hrefs.append(href)
-                except Exception:
-                    continue
-
             return markdown_text, list(dict.fromkeys(citations_hrefs))
         else:
             return container.inner_text().strip(), []
@@ -435,138 +1050,294 @@ def hover_all_citations_and_extract_markdown(page, container) -> Tuple[str, List
             return "", []
 
 
-def wait_for_stream_completion_and_get_text_v2(
-    page, assistant_message_count_before: int, timeout_seconds: int = 300
-) -> Tuple[str, List[str]]:
-    start = time.time()
-    last_text = ""
-    stable_ticks = 0
-    last_change_time = start
-    max_stream_seconds = max(60, min(240, int(timeout_seconds * 0.8)))
-    required_stable_ticks = 3  # ~1.2s with 0.4s sleep
-
-    def get_latest_assistant():
-        # Kimi-specific: last assistant item inside chat list
+def _latest_assistant(page, assistant_message_count_before: int):
+    """Last assistant message container (Kimi chat list first, then generic selectors)."""
+    # Kimi-specific: last assistant item inside chat list
+    asst_items = cached_locator(page, ASSISTANT_ITEM_SELECTOR)
+    try:
+        if asst_items.count() > 0:
+            return asst_items.last
+    except Exception:
+        pass
+    # Fallback to generic selectors
+    for selector in ASSISTANT_MESSAGE_SELECTORS:
+        loc = cached_locator(page, selector)
         try:
-            chat_list = page.locator("div.chat-content-list")
-            if chat_list.count() > 0:
-                asst_items = chat_list.locator(
-                    "div.chat-content-item.chat-content-item-assistant"
-                )
-                if asst_items.count() > 0:
-                    return asst_items.last
+            n = loc.count()
+            if n > assistant_message_count_before:
+                return loc.nth(n - 1)
         except Exception:
-            pass
-        # Fallback to generic selectors
-        for selector in ASSISTANT_MESSAGE_SELECTORS:
-            loc = page.locator(selector)
-            try:
-                if loc.count() > assistant_message_count_before:
-                    return loc.nth(loc.count() - 1)
-            except Exception:
-                continue
-        return page.locator(
-            "div:has-text('Kimi'), div.markdown-body, article, section"
-        ).last
+            continue
+    return page.locator(
+        "div:has-text('Kimi'), div.markdown-body, article, section"
+    ).last
 
-    def extract_assistant_text(container) -> str:
-        # Prefer markdown content
-        try:
-            md = container.locator(
-                "div.markdown-container, .markdown-container .markdown"
-            )
-            if md.count() > 0 and md.first.is_visible():
-                txt = md.first.inner_text().strip()
-                if txt:
-                    return txt
-        except Exception:
-            pass
-        # Then try segment content box
+
+def _extract_assistant_text(page, container) -> str:
+    # Prefer markdown content, then the segment content box; whichever
+    # matched last time on this page is tried first
+    cache = _page_selector_cache(page)
+    for sel in _cached_order(REPLY_BODY_SELECTORS, cache.get("reply_body")):
         try:
-            seg = container.locator("div.segment-content-box")
-            if seg.count() > 0 and seg.first.is_visible():
-                txt = seg.first.inner_text().strip()
+            body = container.locator(sel)
+            if body.count() > 0 and body.first.is_visible():
+                txt = body.first.inner_text().strip()
                 if txt:
+                    cache["reply_body"] = sel
                     return txt
         except Exception:
-            pass
-        # Fallback to container text
-        try:
-            return (container.inner_text() or "").strip()
-        except Exception:
-            return ""
+            continue
+    # Fallback to container text
+    try:
+        return (container.inner_text() or "").strip()
+    except Exception:
+        return ""
+
+
+def _install_stream_observer(page) -> None:
+    try:
+        page.evaluate(_JS_STREAM_WATCH, _STREAM_SELECTORS)
+    except Exception as e:
+        print(f"[WARN] Could not install Kimi stream observer: {e}")
 
-    # Wait until generation starts
-    start_phase_deadline = time.time() + min(30, timeout_seconds * 0.2)
-    while time.time() < start_phase_deadline:
-        if is_generating(page):
-            break
-        try:
-            container = get_latest_assistant()
-            text_now = extract_assistant_text(container) if container else ""
-            if text_now and len(text_now) > len(last_text):
-                last_text = text_now
-                last_change_time = time.time()
-                break
-        except Exception:
-            pass
-        time.sleep(0.25)
 
-    # Wait for completion
-    while time.time() - start < timeout_seconds:
-        container = get_latest_assistant()
+def _wait_stream(page, phase: str, timeout_s: float) -> str:
+    """Block in wait_for_function until the phase predicate holds, or "timeout"."""
+    deadline = time.time() + timeout_s
+    arg = dict(_STREAM_SELECTORS, phase=phase)
+    while True:
+        remaining_ms = (deadline - time.time()) * 1000
+        if remaining_ms <= 0:
+            return "timeout"
         try:
-            text = extract_assistant_text(container) if container else ""
+            result = page.wait_for_function(
+                _JS_STREAM_WAIT,
+                arg=arg,
+                timeout=max(1, remaining_ms),
+                polling=STREAM_POLL_MS,
+            ).json_value()
+        except PlaywrightTimeoutError:
+            return "timeout"
         except Exception:
-            text = ""
-        if text and text == last_text:
-            stable_ticks += 1
-        else:
-            stable_ticks = 0
-            last_text = text
-            if text:
-                last_change_time = time.time()
+            # Navigation (new /chat/<id>) destroyed the context mid-wait
+            time.sleep(STREAM_POLL_MS / 1000)
+            result = "lost"
+        if result != "lost":
+            return result
+        _install_stream_observer(page)
 
-        if is_generating(page) and (time.time() - start > max_stream_seconds):
-            try:
-                page.locator(STOP_ICON_SELECTOR).first.click()
-            except Exception:
-                pass
 
-        if (
-            (not is_generating(page))
-            and is_send_icon_visible(page)
-            and (stable_ticks >= required_stable_ticks)
-            and len(text) > 0
-        ):
-            break
+def wait_for_stream_completion_and_get_text_v2(
+    page, assistant_message_count_before: int, timeout_seconds: int = 300
+) -> Tuple[str, List[str]]:
+    start = time.time()
+    max_stream_seconds = max(60, min(240, int(timeout_seconds * 0.8)))
+
+    _install_stream_observer(page)
 
-        if (not is_generating(page)) and (time.time() - last_change_time > 10):
+    # Wait until generation starts (stop icon visible OR content appears)
+    _wait_stream(page, "start", min(30, timeout_seconds * 0.2))
+
+    # Wait for completion: stop icon gone and text unchanged for STREAM_IDLE_MS.
+    # Past max_stream_seconds the stop button is clicked (retried every 5s).
+    deadline = start + timeout_seconds
+    stop_at = start + max_stream_seconds
+    while time.time() < deadline:
+        result = _wait_stream(
+            page, "end", min(deadline, max(stop_at, time.time())) - time.time()
+        )
+        if result != "timeout":
             break
+        if time.time() >= stop_at:
+            if is_generating(page):
+                try:
+                    page.locator(STOP_ICON_SELECTOR).first.click(timeout=2000)
+                except Exception:
+                    pass
+            stop_at = time.time() + 5
 
-        time.sleep(0.4)
+    # Serialize the reply text once, after the stream has settled; the same
+    # container is reused for the citations
+    try:
+        container = _latest_assistant(page, assistant_message_count_before)
+    except Exception:
+        container = None
+    try:
+        last_text = _extract_assistant_text(page, container) if container else ""
+    except Exception:
+        last_text = ""
 
     citations: List[str] = []
     try:
         container = (
-            get_latest_assistant()
-            or pick_first_visible(page, ASSISTANT_MESSAGE_SELECTORS)
+            container
+            or pick_first_visible(page, ASSISTANT_MESSAGE_SELECTORS, "assistant")
             or page.locator("article, section, div.markdown-body").last
         )
-        for i in range(container.locator(CITATION_LINK_SELECTOR).count()):
-            try:
-                href = (
-                    container.locator(CITATION_LINK_SELECTOR)
-                    .nth(i)
-                    .get_attribute("href")
-                )
-                if href:
-                    citations.append(href)
-            except Exception:
-                continue
-    except Exception:
-        pass
-    return last_text, list(dict.fromkeys(citations))
+        citations = container.evaluate(_JS_CITATION_HREFS, CITATION_LINK_SELECTOR)
+    except Exception:
+        pass
+    return last_text, list(dict.fromkeys(citations))
+
+
+# The original polling variant was removed; keep the old name importable
+wait_for_stream_completion_and_get_text = wait_for_stream_completion_and_get_text_v2
+
+
+_RE_META_CHARSET = re.compile(rb"""<meta[^>]+charset=["']?([\w-]+)""", re.I)
+_RE_TEXT_SPACE = re.compile(r"[ \t\r\f\v\xa0]+")
+_TEXT_SKIP_TAGS = frozenset(("script", "style", "noscript", "template", "svg"))
+_TEXT_BLOCK_TAGS = frozenset(
+    ("p", "div", "br", "li", "tr", "section", "article", "main", *_HEADING_TAGS)
+)
+# Tags whose text is collected on its own, and the order text() prefers them in
+_TEXT_SECTION_TAGS = frozenset(("article", "main"))
+_TEXT_PREFERENCE = ("article", "main", "content", "body")
+
+
+class PageTextExtractor(HTMLParser):
+    """
+    Main text of a fetched page without a browser. Collects article / main /
+    div#content / body text in one pass; text() returns the first non-empty,
+    in the same order the browser path tries those selectors.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.parts: Dict[str, List[str]] = {key: [] for key in _TEXT_PREFERENCE}
+        self.open = {"article": 0, "main": 0, "content": 0}
+        self.div_stack: List[bool] = []  # True for div#content / div[id*=content]
+        self.skip_depth = 0
+
+    def _emit(self, text: str) -> None:
+        self.parts["body"].append(text)
+        for key, depth in self.open.items():
+            if depth:
+                self.parts[key].append(text)
+
+    def handle_starttag(self, tag, attrs) -> None:
+        if tag in _TEXT_SKIP_TAGS:
+            self.skip_depth += 1
+            return
+        if tag in _TEXT_SECTION_TAGS:
+            self.open[tag] += 1
+        elif tag == "div":
+            is_content = "content" in (dict(attrs).get("id") or "")
+            self.div_stack.append(is_content)
+            if is_content:
+                self.open["content"] += 1
+        if tag in _TEXT_BLOCK_TAGS:
+            self._emit("\n")
+
+    def handle_endtag(self, tag) -> None:
+        if tag in _TEXT_SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+            return
+        if tag in _TEXT_BLOCK_TAGS:
+            self._emit("\n")
+        if tag in _TEXT_SECTION_TAGS:
+            self.open[tag] = max(0, self.open[tag] - 1)
+        elif tag == "div" and self.div_stack:
+            if self.div_stack.pop():
+                self.open["content"] = max(0, self.open["content"] - 1)
+
+    def handle_data(self, data) -> None:
+        if not self.skip_depth:
+            self._emit(data)
+
+    def text(self) -> str:
+        self.close()
+        for key in _TEXT_PREFERENCE:
+            lines = _RE_TEXT_SPACE.sub(" ", "".join(self.parts[key])).split("\n")
+            text = "\n".join(line.strip() for line in lines if line.strip())
+            if text:
+                return text
+        return ""
+
+
+def fetch_page_text_http(href: str) -> str:
+    """Page main text over plain HTTP; "" when the browser should be used instead."""
+    if not href.startswith(("http://", "https://")):
+        return ""
+    try:
+        req = urllib.request.Request(href, headers=PAGE_FETCH_HEADERS)
+        with urllib.request.urlopen(req, timeout=PAGE_FETCH_TIMEOUT) as resp:
+            if "html" not in (resp.headers.get_content_type() or ""):
+                return ""
+            raw = resp.read(PAGE_FETCH_MAX_BYTES)
+            charset = resp.headers.get_content_charset()
+        if not charset:
+            m = _RE_META_CHARSET.search(raw[:4096])
+            charset = m.group(1).decode("ascii") if m else "utf-8"
+        try:
+            html = raw.decode(charset, errors="replace")
+        except LookupError:
+            html = raw.decode("utf-8", errors="replace")
+        parser = PageTextExtractor()
+        parser.feed(html)
+        return parser.text()
+    except Exception:
+        # HTTP 403/429/5xx, timeouts, TLS errors... -> browser fallback
+        return ""
+
+
+def fetch_page_text_browser(page, href: str) -> str:
+    """Page main text via a new tab in the scraper's browser context."""
+    page_text = ""
+    newp = None
+    try:
+        newp = page.context.new_page()
+        newp.goto(href, timeout=20000)
+        try:
+            newp.wait_for_load_state()
+        except Exception:
+            pass
+        # Prefer article/main/body text
+        text_locators = [
+            "article",
+            "main",
+            "div#content, div[id*='content']",
+            "body",
+        ]
+        for sel in text_locators:
+            try:
+                loc = newp.locator(sel)
+                if loc.count() > 0 and loc.first.is_visible():
+                    page_text = (loc.first.inner_text() or "").strip()
+                    if page_text:
+                        break
+            except Exception:
+                continue
+    except Exception:
+        pass
+    finally:
+        if newp is not None:
+            try:
+                newp.close()
+            except Exception:
+                pass
+    return page_text
+
+
+def fetch_page_texts(page, hrefs: List[str]) -> Dict[str, str]:
+    """
+    href -> main text. Plain HTTP fetches run concurrently on a small thread
+    pool; only the misses are opened in the browser, serially, because the
+    sync Playwright page belongs to this thread.
+    """
+    unique = [h for h in dict.fromkeys(hrefs) if h]
+    if not unique:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(PAGE_FETCH_WORKERS, len(unique))) as pool:
+        texts = dict(zip(unique, pool.map(fetch_page_text_http, unique)))
+    misses = [h for h in unique if not texts[h]]
+    if misses:
+        print(
+            f"[DEBUG] {len(unique) - len(misses)}/{len(unique)} search pages fetched over HTTP, {len(misses)} via browser"
+        )
+    for href in misses:
+        texts[href] = fetch_page_text_browser(page, href)
+    return texts
 
 
 def extract_web_search_results_if_any(
@@ -599,27 +1370,27 @@ def extract_web_search_results_if_any(
             return generic.nth(generic.count() - 1)
         return None
 
-    container = get_latest_assistant()
-    if not container:
-        return results
-
-    # Check if toolcall container-block exists (web search used)
+    # Assistant item, toolcall block and panel visibility in one snapshot
     try:
-        tool_block = container.locator("div.segment-content-box div.container-block")
-        if tool_block.count() == 0:
-            return results  # no web search
+        probe = page.evaluate(
+            _JS_SEARCH_PROBE,
+            {
+                "item": ASSISTANT_ITEM_SELECTOR,
+                "fallback": "div[data-role='assistant'], [data-testid='assistant-message']",
+                "before": assistant_message_count_before,
+                "panel": SEARCH_PANEL_SELECTOR,
+            },
+        )
     except Exception:
         return results
+    if not probe["found"] or not probe["tool"]:
+        return results  # no web search
 
-    side_panel = page.locator("div.side-console-container.normal")
+    side_panel = page.locator(SEARCH_PANEL_SELECTOR)
     # If panel already visible, skip clicking; else try click then wait
-    try:
-        panel_ready = side_panel.count() > 0 and side_panel.first.is_visible()
-    except Exception:
-        panel_ready = False
-
-    if not panel_ready:
+    if not probe["panel"]:
         try:
+            container = get_latest_assistant()
             clickable = container.locator(
                 "div.segment-content-box div.container-block > div > div"
             ).first
@@ -628,191 +1399,74 @@ def extract_web_search_results_if_any(
         except Exception:
             pass
 
-        start_wait = time.time()
-        while time.time() - start_wait < 10:
-            try:
-                if side_panel.count() > 0 and side_panel.first.is_visible():
-                    break
-            except Exception:
-                pass
-            time.sleep(0.25)
+        try:
+            side_panel.first.wait_for(state="visible", timeout=10000)
+        except Exception:
+            pass
 
     if side_panel.count() == 0:
         return results
 
     # Extract search result entries
     try:
-        sites = side_panel.locator("div.side-console .sites a.site")
-        num = sites.count()
-        for i in range(num):
-            node = sites.nth(i)
-            try:
-                href = node.get_attribute("href") or ""
-                name = ""
-                title = ""
-                snippet = ""
-                try:
-                    name = node.locator(".name").first.inner_text().strip()
-                except Exception:
-                    pass
-                try:
-                    title = node.locator("p.title").first.inner_text().strip()
-                except Exception:
-                    pass
-                try:
-                    snippet = node.locator("p.snippet").first.inner_text().strip()
-                except Exception:
-                    pass
-
-                # Optionally visit the page to extract main text
-                page_text = ""
-                if href:
-                    try:
-                        newp = page.context.new_page()
-                        newp.goto(href, timeout=20000)
-                        try:
-                            newp.wait_for_load_state()
-                        except Exception:
-                            pass
-                        # Prefer article/main/body text
-                        text_locators = [
-                            "article",
-                            "main",
-                            "div#content, div[id*='content']",
-                            "body",
-                        ]
-                        for sel in text_locators:
-                            try:
-                                loc = newp.locator(sel)
-                                if loc.count() > 0 and loc.first.is_visible():
-                                    page_text = (loc.first.inner_text() or "").strip()
-                                    if page_text:
-                                        break
-                            except Exception:
-                                continue
-                    except Exception:
-                        pass
-                    finally:
-                        try:
-                            newp.close()
-                        except Exception:
-                            pass
-
-                results.append(
-                    {
-                        "href": href,
-                        "name": name,
-                        "title": title,
-                        "snippet": snippet,
-                        "page_text": page_text,
-                    }
-                )
-            except Exception:
-                continue
+        sites = side_panel.first.evaluate(_JS_SEARCH_SITES)
     except Exception:
-        pass
-
-    return results
-
-
-def wait_for_stream_completion_and_get_text(
-    page, assistant_message_count_before: int, timeout_seconds: int = 300
-) -> Tuple[str, List[str]]:
-    start = time.time()
-    last_text = ""
-    stable_ticks = 0
-
-    def get_latest_assistant():
-        # Get the last assistant container if present, else fallback to last content block
-        for selector in ASSISTANT_MESSAGE_SELECTORS:
-            loc = page.locator(selector)
-            try:
-                if loc.count() > assistant_message_count_before:
-                    return loc.nth(loc.count() - 1)
-            except Exception:
-                continue
-        # Fallback: last message-like block (risk of mixing roles)
-        fallback = page.locator(
-            "div:has-text('Kimi'), div.markdown-body, article, section"
-        ).last
-        return fallback
-
-    # Wait until generation starts (stop icon visible OR content starts growing)
-    start_phase_deadline = time.time() + min(30, timeout_seconds * 0.2)
-    while time.time() < start_phase_deadline:
-        if is_generating(page):
-            break
-        # Content growth fallback
-        try:
-            container = get_latest_assistant()
-            text_now = container.inner_text().strip() if container else ""
-            if text_now and len(text_now) > len(last_text):
-                last_text = text_now
-                break
-        except Exception:
-            pass
-        time.sleep(0.25)
-
-    # Now wait for completion: stop icon disappears, plus short text stabilization)
-    while time.time() - start < timeout_seconds:
-        container = get_latest_assistant()
-        try:
-            text = container.inner_text().strip() if container else ""
-        except Exception:
-            text = ""
-        if text and text == last_text:
-            stable_ticks += 1
-        else:
-            stable_ticks = 0
-            last_text = text
-        # Completion criteria: generating stopped and text stabilized briefly
-        if (not is_generating(page)) and (stable_ticks >= 3) and len(text) > 0:
-            break
-        time.sleep(0.4)
+        return results
 
-    # Extract citations
-    citations: List[str] = []
-    try:
-        container = (
-            pick_first_visible(page, ASSISTANT_MESSAGE_SELECTORS)
-            or page.locator("article, section, div.markdown-body").last
+    # Visit the pages to extract main text (concurrently, see fetch_page_texts)
+    page_texts = fetch_page_texts(page, [site.get("href") or "" for site in sites])
+    for site in sites:
+        href = site.get("href") or ""
+        results.append(
+            {
+                "href": href,
+                "name": site.get("name") or "",
+                "title": site.get("title") or "",
+                "snippet": site.get("snippet") or "",
+                "page_text": page_texts.get(href, ""),
+            }
         )
-        for i in range(container.locator(CITATION_LINK_SELECTOR).count()):
-            try:
-                href = (
-                    container.locator(CITATION_LINK_SELECTOR)
-                    .nth(i)
-                    .get_attribute("href")
-                )
-                if href:
-                    citations.append(href)
-            except Exception:
-                continue
-    except Exception:
-        pass
-    return last_text, list(dict.fromkeys(citations))
+
+    return results
 
 
 def send_prompt_and_collect(
     page, prompt_text: str, website_name: str = "KIMI"
 ) -> Dict[str, Optional[str]]:
-    input_box = pick_first_visible(page, CHAT_INPUT_SELECTORS)
+    input_box = pick_first_visible(page, CHAT_INPUT_SELECTORS, "chat_input")
     if not input_box:
         raise RuntimeError(
             "Chat input not found. Please ensure you are logged in and on the chat page."
         )
 
     # Count assistant messages before sending
-    assistant_before = 0
-    for selector in ASSISTANT_MESSAGE_SELECTORS:
-        try:
-            assistant_before = max(assistant_before, page.locator(selector).count())
-        except Exception:
-            continue
+    try:
+        assistant_before = int(
+            page.evaluate(_JS_MAX_COUNT, ASSISTANT_MESSAGE_SELECTORS) or 0
+        )
+    except Exception:
+        assistant_before = 0
 
-    # Input prompt and send
+    # Input prompt and send: the whole prompt goes in with one evaluate
+    # (insertText -> a single input event) instead of a keyboard.type round
+    # trip per character; fall back to typing if the editor rejected it
     input_box.click()
-    page.keyboard.type(prompt_text)
+    inserted = False
+    try:
+        inserted = input_box.evaluate(_JS_INSERT_PROMPT, prompt_text)
+    except Exception as e:
+        print(f"[WARN] Kimi prompt insert failed: {e}")
+    if not inserted:
+        print("[WARN] Kimi editor did not take the inserted prompt, typing instead")
+        page.keyboard.type(prompt_text)
+
+    # Wait until the editor state reached the send button (no longer disabled), max 1s
+    try:
+        cached_locator(page, SEND_BUTTON_CONTAINER_DISABLED).first.wait_for(
+            state="hidden", timeout=1000
+        )
+    except Exception:
+        pass
     page.keyboard.press("Enter")
 
     send_ts = time.time()
@@ -829,50 +1483,47 @@ def send_prompt_and_collect(
     inline_citation_hrefs = []
     try:
         # Get the last assistant container
-        chat_list = page.locator("div.chat-content-list")
-        if chat_list.count() > 0:
-            asst_items = chat_list.locator(
-                "div.chat-content-item.chat-content-item-assistant"
+        asst_items = cached_locator(page, ASSISTANT_ITEM_SELECTOR)
+        if asst_items.count() > 0:
+            last_asst = asst_items.last
+            markdown_with_citations, inline_citation_hrefs = (
+                hover_all_citations_and_extract_markdown(page, last_asst)
+            )
+            print(
+                f"[DEBUG] Extracted markdown with {len(inline_citation_hrefs)} inline citations"
             )
-            if asst_items.count() > 0:
-                last_asst = asst_items.last
-                markdown_with_citations, inline_citation_hrefs = (
-                    hover_all_citations_and_extract_markdown(page, last_asst)
-                )
-                print(
-                    f"[DEBUG] Extracted markdown with {len(inline_citation_hrefs)} inline citations"
-                )
     except Exception as e:
         print(f"[WARN] Failed to extract markdown with citations: {e}")
 
     # If web search was used, open the side panel and collect sources
     search_results = extract_web_search_results_if_any(page, assistant_before)
 
-    # Extract URLs from search results and inline citations
-    search_urls = (
-        [r["href"] for r in search_results if r.get("href")] if search_results else []
-    )
-
     # Try to infer model name and online mode from visible toggles
+    # (a toggle this page did not show once is not probed again)
     model_name = ""
     mode_online = ""
-    try:
-        model_toggle = page.locator(
-            '[aria-label*="模型"], [aria-label*="Model"], [data-testid*="model"]'
-        ).first
-        if model_toggle and model_toggle.is_visible():
-            model_name = model_toggle.inner_text().strip()
-    except Exception:
-        pass
-    try:
-        online_toggle = page.locator(
-            ':is([aria-label*="联网"], [aria-label*="Search"], [aria-pressed])'
-        ).first
-        if online_toggle and online_toggle.is_visible():
-            pressed = online_toggle.get_attribute("aria-pressed")
-            mode_online = "true" if pressed == "true" else "false"
-    except Exception:
-        pass
+    absent = _TOGGLE_ABSENT.get(page)
+    if absent is None:
+        absent = _TOGGLE_ABSENT[page] = set()
+    if "model" not in absent:
+        try:
+            model_toggle = cached_locator(page, MODEL_TOGGLE_SELECTOR).first
+            if model_toggle.is_visible():
+                model_name = model_toggle.inner_text().strip()
+            else:
+                absent.add("model")
+        except Exception:
+            pass
+    if "online" not in absent:
+        try:
+            online_toggle = cached_locator(page, ONLINE_TOGGLE_SELECTOR).first
+            if online_toggle.is_visible():
+                pressed = online_toggle.get_attribute("aria-pressed")
+                mode_online = "true" if pressed == "true" else "false"
+            else:
+                absent.add("online")
+        except Exception:
+            pass
 
     item: Dict[str, Optional[str]] = {
         "website_name": website_name,
@@ -893,59 +1544,102 @@ def send_prompt_and_collect(
     return item
 
 
+# Header + prompt + response of a markdown section, filled by format_map()
+MD_TEMPLATE = (
+    "# Conversation {conversation_id}\n\n"
+    "- **Website**: {website_name}\n"
+    "- **URL**: {item_url}\n"
+    "- **Model**: {model_name}\n"
+    "- **Online Mode**: {mode_online}\n"
+    "- **Language**: {response_language}\n"
+    "- **Latency**: {latency_ms} ms\n"
+    "## Prompt\n\n"
+    "{prompt_text}\n\n"
+    "## Response\n\n"
+    "{response_text}\n\n"
+)
+
+
+class _MarkdownFields(dict):
+    """Missing fields render like it.get() did: as None."""
+
+    def __missing__(self, key):
+        return None
+
+
+class OutputWriter:
+    """Append-only output file kept open for a whole task.
+
+    Writes go through a 1 MiB buffer; flush() once per saved prompt so an
+    interrupted run still keeps everything that was reported as saved.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.f = open(path, "ab", buffering=1 << 20)
+
+    def write(self, text: str) -> None:
+        self.f.write(text.encode("utf-8"))
+
+    def write_bytes(self, data: bytes) -> None:
+        self.f.write(data)
+
+    def flush(self) -> None:
+        self.f.flush()
+
+    def close(self) -> None:
+        if not self.f.closed:
+            self.f.close()
+
+
 def write_outputs(
-    ndjson_path: str, md_path: str, items: List[Dict[str, Optional[str]]]
+    ndjson_out: OutputWriter,
+    md_out: OutputWriter,
+    items: List[Dict[str, Optional[str]]],
 ) -> None:
     if not items:
         return
 
-    # Determine write mode: append if files exist, otherwise create new
-    ndjson_mode = "a" if os.path.exists(ndjson_path) else "w"
-    md_mode = "a" if os.path.exists(md_path) else "w"
-
-    # Write NDJSON (append or create)
-    with open(ndjson_path, ndjson_mode, encoding="utf-8") as f:
-        for it in items:
-            f.write(json.dumps(it, ensure_ascii=False) + "\n")
-
-    # Write markdown with full conversation content (append or create)
-    with open(md_path, md_mode, encoding="utf-8") as f:
-        for it in items:
-            conv_id = it.get("conversation_id") or "unknown"
-            f.write(f"# Conversation {conv_id}\n\n")
-            f.write(f"- **Website**: {it.get('website_name')}\n")
-            f.write(f"- **URL**: {it.get('item_url')}\n")
-            f.write(f"- **Model**: {it.get('model_name')}\n")
-            f.write(f"- **Online Mode**: {it.get('mode_online')}\n")
-            f.write(f"- **Language**: {it.get('response_language')}\n")
-            f.write(f"- **Latency**: {it.get('latency_ms')} ms\n")
-
-            f.write("## Prompt\n\n")
-            f.write((it.get("prompt_text") or "").strip() + "\n\n")
-
-            f.write("## Response\n\n")
-            f.write((it.get("response_text") or "").strip() + "\n\n")
-
-            # Write web search results if available
-            web_search_results = it.get("web_search_results", [])
-            if web_search_results:
-                f.write("## Web Search Results\n\n")
-                for idx, result in enumerate(web_search_results, 1):
-                    title = result.get("title") or result.get("name") or "Search Result"
-                    href = result.get("href", "")
-                    snippet = result.get("snippet", "")
-                    site_name = result.get("name", "")
-
-                    f.write(f"### {idx}. {title}\n\n")
-                    if href:
-                        f.write(f"- **URL**: {href}\n")
-                    if site_name:
-                        f.write(f"- **Site**: {site_name}\n")
-                    # if snippet:
-                    #     f.write(f"- **Snippet**: {snippet}\n")
-                    f.write("\n")
-
-            f.write("---\n\n")
+    # Write NDJSON: one write() per batch
+    ndjson_out.write_bytes(b"".join(_ndjson_line(it) for it in items))
+    if NEAR_DUP_THRESHOLD > 0:
+        append_prompt_signatures(ndjson_out.path, items)
+
+    # Write markdown with full conversation content (append or create);
+    # sections are collected first and written with a single write()
+    parts: List[str] = []
+    write = parts.append
+    for it in items:
+        fields = _MarkdownFields(it)
+        fields["conversation_id"] = it.get("conversation_id") or "unknown"
+        fields["prompt_text"] = (it.get("prompt_text") or "").strip()
+        fields["response_text"] = (it.get("response_text") or "").strip()
+        write(MD_TEMPLATE.format_map(fields))
+
+        # Write web search results if available
+        web_search_results = it.get("web_search_results", [])
+        if web_search_results:
+            write("## Web Search Results\n\n")
+            for idx, result in enumerate(web_search_results, 1):
+                title = result.get("title") or result.get("name") or "Search Result"
+                href = result.get("href", "")
+                snippet = result.get("snippet", "")
+                site_name = result.get("name", "")
+
+                write(f"### {idx}. {title}\n\n")
+                if href:
+                    write(f"- **URL**: {href}\n")
+                if site_name:
+                    write(f"- **Site**: {site_name}\n")
+                # if snippet:
+                #     write(f"- **Snippet**: {snippet}\n")
+                write("\n")
+
+        write("---\n\n")
+
+    md_out.write("".join(parts))
+    ndjson_out.flush()
+    md_out.flush()
 
 
 def human_think_time(min_s: float = 0.8, max_s: float = 2.2) -> None:
@@ -960,25 +1654,19 @@ def click_new_conversation(page) -> bool:
     try:
         print("[INFO] Clicking 'New Conversation' button...")
 
-        # Multiple selectors to find the new conversation button
-        new_conv_selectors = [
-            'div.action-label:has(svg[name="AddConversation"])',
-            'svg[name="AddConversation"]',
-            'button:has-text("新建会话")',
-            'div:has-text("新建会话")',
-        ]
-
         clicked = False
-        for selector in new_conv_selectors:
-            try:
-                btn = page.locator(selector).first
-                if btn.is_visible(timeout=5000):
-                    btn.click(timeout=5000)
-                    clicked = True
-                    print("[INFO] New conversation button clicked")
-                    break
-            except Exception:
-                continue
+        btn = cached_locator(page, NEW_CONVERSATION_UNION).first
+        try:
+            btn.wait_for(state="visible", timeout=NEW_CONVERSATION_WAIT_MS)
+        except Exception:
+            btn = cached_locator(page, NEW_CONVERSATION_SELECTORS[-1]).first
+        try:
+            if btn.is_visible():
+                btn.click(timeout=5000)
+                clicked = True
+                print("[INFO] New conversation button clicked")
+        except Exception:
+            pass
 
         if not clicked:
             print("[WARN] Could not find new conversation button, continuing anyway...")
@@ -988,14 +1676,9 @@ def click_new_conversation(page) -> bool:
         time.sleep(1.0)
 
         # Wait for chat input to be ready
-        for selector in CHAT_INPUT_SELECTORS:
-            try:
-                elem = page.locator(selector).first
-                if elem.is_visible(timeout=5000):
-                    print("[INFO] New conversation ready")
-                    return True
-            except Exception:
-                continue
+        if wait_for_chat_input(page, 5):
+            print("[INFO] New conversation ready")
+            return True
 
         print("[WARN] New conversation may not be fully loaded")
         return True
@@ -1019,45 +1702,96 @@ def extract_task_name(input_file: str) -> str:
         return basename
 
 
+# load_processed_prompts only needs two top-level string fields per record, so
+# they are pulled out of the raw line instead of decoding response_text and
+# web_search_results. A '"' inside a JSON string is always escaped, so these
+# can only match real keys. Only complete-looking lines (ending in '}') take
+# this path; a record torn mid-write or anything else unusual falls back to a
+# full decode, which drops it.
+_RE_NDJSON_PROMPT = re.compile(rb'"prompt_text"\s*:\s*"((?:[^"\\]|\\.)*)"')
+_RE_NDJSON_STATUS = re.compile(rb'"status"\s*:\s*"([^"\\]*)"')
+
+
+def _scan_ndjson_record(line: bytes) -> Optional[Tuple[str, str]]:
+    """(stripped prompt_text, status) of one NDJSON line, None if unparsable."""
+    if line.rstrip().endswith(b"}"):
+        prompts = _RE_NDJSON_PROMPT.findall(line)
+        statuses = _RE_NDJSON_STATUS.findall(line)
+    else:
+        prompts = statuses = ()
+    if len(prompts) == 1 and len(statuses) == 1:
+        raw = prompts[0]
+        try:
+            status = statuses[0].decode("utf-8")
+            prompt = (
+                raw.decode("utf-8")
+                if b"\\" not in raw
+                else json.loads(b'"' + raw + b'"')
+            )
+        except ValueError:  # also UnicodeDecodeError
+            return None
+        return prompt.strip(), status
+    try:
+        item = _json_loads(line)
+    except ValueError:
+        return None
+    if not isinstance(item, dict):
+        return None
+    prompt = item.get("prompt_text") or ""
+    return (prompt.strip() if isinstance(prompt, str) else ""), item.get("status", "ok")
+
+
 def load_processed_prompts(ndjson_path: str) -> set:
     """Load already processed prompts from existing NDJSON file.
-    Returns a set of prompt_text that have been processed.
+    Returns the prompt_fingerprint() digests of the processed prompt_text values.
     """
     if not os.path.exists(ndjson_path):
         return set()
 
     processed = set()
-    ok_items: List[Dict[str, Optional[str]]] = []
+    ok_lines: List[bytes] = []
+    dropped = 0
     try:
-        with open(ndjson_path, "r", encoding="utf-8") as f:
+        with open(ndjson_path, "rb") as f:
             for line in f:
-                if line.strip():
+                if not line.strip():
+                    continue
+                record = _scan_ndjson_record(line)
+                if record is None:
+                    dropped += 1
+                    continue
+                prompt_text, status = record
+                if status != "ok":
+                    dropped += 1
+                    continue
+                ok_lines.append(line if line.endswith(b"\n") else line + b"\n")
+                if prompt_text:
                     try:
-                        item = json.loads(line)
-                        prompt_text = item.get("prompt_text", "").strip()
-                        status = item.get("status", "ok")
-                        if status == "ok":
-                            ok_items.append(item)
-                            if prompt_text:
-                                processed.add(prompt_text)
-                    except json.JSONDecodeError:
+                        processed.add(prompt_fingerprint(prompt_text))
+                    except UnicodeError:
+                        # e.g. a lone surrogate escape: no input line can equal it
                         continue
+    except OSError as e:
+        print(f"[WARN] Failed to load processed prompts: {e}")
+        return set()
 
-        # Rewrite NDJSON to keep only status == "ok" items
+    # Rewrite NDJSON to keep only status == "ok" items (lines kept verbatim);
+    # via a temp file + os.replace so a crash mid-write never truncates results
+    if dropped:
+        tmp_path = ndjson_path + ".tmp"
         try:
-            with open(ndjson_path, "w", encoding="utf-8") as wf:
-                for it in ok_items:
-                    wf.write(json.dumps(it, ensure_ascii=False) + "\n")
+            with open(tmp_path, "wb") as wf:
+                wf.write(b"".join(ok_lines))
+            os.replace(tmp_path, ndjson_path)
         except Exception as e:
             print(f"[WARN] Failed to rewrite Kimi NDJSON with ok items only: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
 
-        print(
-            f"[INFO] Found {len(processed)} already processed prompts (kept only status='ok')"
-        )
-        return processed
-    except Exception as e:
-        print(f"[WARN] Failed to load processed prompts: {e}")
-        return set()
+    print(
+        f"[INFO] Found {len(processed)} already processed prompts (kept only status='ok')"
+    )
+    return processed
 
 
 def main() -> None:
@@ -1082,7 +1816,17 @@ def main() -> None:
         f"[INFO] Found {len(input_files)} input file(s): {[os.path.basename(f) for f in input_files]}"
     )
 
-    # Process each input file as a separate task
+    # One set of browser windows (and one login) serves every task
+    pool = KimiWorkerPool(KIMI_CONCURRENCY)
+    try:
+        run_input_files(pool, input_files)
+    finally:
+        pool.close()
+
+
+def run_input_files(pool: "KimiWorkerPool", input_files: List[str]) -> None:
+    # Each input file is a separate task; all of them are queued up front
+    tasks: List[KimiTask] = []
     for input_file in input_files:
         task_name = extract_task_name(input_file)
         print(f"\n{'='*60}")
@@ -1104,154 +1848,325 @@ def main() -> None:
         # Load already processed prompts to avoid duplication
         processed_prompts = load_processed_prompts(output_ndjson)
 
-        # Filter out already processed prompts
-        new_prompts = [p for p in prompts if p.strip() not in processed_prompts]
+        # Filter out already processed prompts; read_prompts() already
+        # stripped every line, so each prompt is hashed once and never re-stripped
+        new_prompts = [p for p in prompts if prompt_fingerprint(p) not in processed_prompts]
+
+        if len(new_prompts) < len(prompts):
+            print(
+                f"[INFO] Skipping {len(prompts) - len(new_prompts)} already processed prompts"
+            )
+
+        if NEAR_DUP_THRESHOLD > 0 and new_prompts:
+            index = load_near_dup_index(output_ndjson, processed_prompts)
+            new_prompts, near_dups = filter_near_duplicates(new_prompts, index)
+            if near_dups:
+                print(
+                    f"[INFO] Skipping {near_dups} near-duplicate prompts (Jaccard >= {NEAR_DUP_THRESHOLD})"
+                )
 
         if not new_prompts:
             print(f"[INFO] All prompts in {task_name} have been processed. Skipping...")
             continue
 
         if len(new_prompts) < len(prompts):
-            print(
-                f"[INFO] Skipping {len(prompts) - len(new_prompts)} already processed prompts"
-            )
             print(f"[INFO] Processing {len(new_prompts)} new prompts")
 
-        process_task(task_name, new_prompts, output_ndjson, output_md)
+        tasks.append(KimiTask(task_name, new_prompts, output_ndjson, output_md))
 
+    process_tasks(pool, tasks)
 
-def process_task(
-    task_name: str, prompts: List[str], output_ndjson: str, output_md: str
-) -> None:
-    """Process a single task with its prompts."""
-
-    with Camoufox(
-        humanize=True,
-        geoip=False,
-        locale="zh-CN",
-    ) as browser:
-        page = browser.new_page(
-            locale="zh-CN",
-            extra_http_headers={
-                "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
-            },
-        )
 
-        # Load cookies before navigation (if any)
-        load_cookies_into_context(page, SESSION_COOKIES_FILE)
+def open_kimi_session(page, worker_id: int) -> bool:
+    """
+    Restore the saved session and open the chat page.
+    Worker 0 waits for the manual login and persists the session;
+    the other workers only wait for the chat input.
+    """
+    # Load cookies before navigation (if any)
+    load_cookies_into_context(page, SESSION_COOKIES_FILE)
+
+    page.goto(KIMI_HOME_URL)
+    page.wait_for_load_state()
+
+    # Restore storage after being on origin, then reload to apply
+    load_storage_from_file(page, SESSION_STORAGE_FILE)
+
+    # Force language preference to Chinese in localStorage
+    try:
+        page.evaluate(
+            """() => {
+            localStorage.setItem('locale', 'zh-CN');
+            localStorage.setItem('language', 'zh');
+            localStorage.setItem('kimi-language', 'zh-CN');
+        }"""
+        )
+    except Exception:
+        pass
 
+    try:
         page.goto(KIMI_HOME_URL)
         page.wait_for_load_state()
+    except Exception:
+        pass
+
+    if worker_id > 0:
+        # Session was just saved by worker 0; only wait for the chat UI
+        if wait_for_chat_input(page, 60):
+            return True
+        print(f"[ERROR] Kimi worker {worker_id} could not reuse the saved session.")
+        return False
+
+    print(
+        "[INFO] Waiting for manual login (up to 5 minutes). Once you see the chat input, you're good."
+    )
+    if not wait_for_login(page, timeout_seconds=300):
+        print("[ERROR] Login not detected within timeout. Please login and rerun.")
+        return False
 
-        # Restore storage after being on origin, then reload to apply
-        load_storage_from_file(page, SESSION_STORAGE_FILE)
+    # Persist session after successful login
+    save_cookies_from_context(page, SESSION_COOKIES_FILE)
+    save_storage_to_file(page, SESSION_STORAGE_FILE)
+    return True
 
-        # Force language preference to Chinese in localStorage
+
+def collect_with_retries(page, prompt: str, max_retries: int = 3) -> Dict:
+    """send_prompt_and_collect with up to max_retries attempts for non-ok results."""
+    item: Dict[str, Optional[str]] = {}
+    for attempt in range(1, max_retries + 1):
         try:
-            page.evaluate(
-                """() => {
-                localStorage.setItem('locale', 'zh-CN');
-                localStorage.setItem('language', 'zh');
-                localStorage.setItem('kimi-language', 'zh-CN');
-            }"""
+            item = send_prompt_and_collect(page, prompt_text=prompt, website_name="KIMI")
+        except Exception as e:
+            url = page.url
+            print(
+                f"[ERROR] Failed to process prompt (attempt {attempt}/{max_retries}): {e}"
             )
-        except Exception:
-            pass
+            item = {
+                "website_name": "KIMI",
+                "conversation_id": get_conversation_id_from_url(url),
+                "item_url": url,
+                "session_user": "",
+                "model_name": "",
+                "mode_online": "True",
+                "prompt_text": prompt,
+                "response_text": "",
+                "response_citations": [],
+                "response_language": "",
+                "latency_ms": 0,
+                "status": "error",
+                "error_message": str(e),
+                "message_id": "",
+                "parent_message_id": "",
+                "tokens_prompt": "",
+                "tokens_completion": "",
+                "tokens_total": "",
+            }
+
+        status = item.get("status", "ok")
+        if status == "ok":
+            break
+
+        if attempt < max_retries:
+            print(
+                f"[WARN] Prompt failed with status '{status}', retrying after short delay..."
+            )
+            human_think_time(1.0, 2.5)
+    return item
+
+
+class KimiWorkerPool:
+    """
+    Kimi browser windows that live for the whole run: each worker thread
+    opens its own Camoufox (Playwright's sync API is bound to its thread)
+    and logs in once, then serves the prompts of every task, so input files
+    after the first pay no browser start-up or login. Worker 0 logs in; the
+    others wait and reuse the saved session.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = max(1, size)
+        self.jobs: "queue.Queue" = queue.Queue()
+        self.results: "queue.Queue" = queue.Queue()
+        self.session_ready = threading.Event()
+        self.session_ok = False
+        self.threads: List[threading.Thread] = []
+
+    def start(self, prompt_count: int) -> None:
+        """Start the workers (once); the first task's size caps their number."""
+        if self.threads:
+            return
+        count = max(1, min(self.size, prompt_count))
+        if count > 1:
+            print(f"[INFO] Running {count} Kimi browser windows in parallel")
+        for i in range(count):
+            t = threading.Thread(
+                target=self._worker, args=(i,), name=f"kimi-worker-{i}", daemon=True
+            )
+            t.start()
+            self.threads.append(t)
 
+    def alive(self) -> bool:
+        return any(t.is_alive() for t in self.threads)
+
+    def close(self) -> None:
+        """Stop the workers; worker 0 saves the session, each closes its browser."""
+        # Drop prompts nobody is waiting for any more (e.g. after Ctrl+C)
         try:
-            page.goto(KIMI_HOME_URL)
-            page.wait_for_load_state()
-        except Exception:
+            while True:
+                self.jobs.get_nowait()
+        except queue.Empty:
             pass
-
-        print(
-            "[INFO] Waiting for manual login (up to 5 minutes). Once you see the chat input, you're good."
-        )
-        if not wait_for_login(page, timeout_seconds=300):
-            print("[ERROR] Login not detected within timeout. Please login and rerun.")
+        for _ in self.threads:
+            self.jobs.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
+
+    def _worker(self, worker_id: int) -> None:
+        if worker_id > 0:
+            self.session_ready.wait()
+            if not self.session_ok:
+                return
+        try:
+            with Camoufox(
+                humanize=True,
+                geoip=False,
+                locale="zh-CN",
+            ) as browser:
+                page = browser.new_page(
+                    locale="zh-CN",
+                    extra_http_headers={
+                        "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
+                    },
+                )
+                self._serve(worker_id, page)
+        finally:
+            # Never leave the other workers waiting, e.g. if the browser failed to launch
+            if worker_id == 0:
+                self.session_ready.set()
+
+    def _serve(self, worker_id: int, page) -> None:
+        logged_in = False
+        try:
+            logged_in = open_kimi_session(page, worker_id)
+        finally:
+            if worker_id == 0:
+                self.session_ok = logged_in
+                self.session_ready.set()
+        if not logged_in:
             return
 
-        # Persist session after successful login
-        save_cookies_from_context(page, SESSION_COOKIES_FILE)
-        save_storage_to_file(page, SESSION_STORAGE_FILE)
+        first = True
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            task, idx, prompt = job
 
-        total_processed = 0
-        for idx, prompt in enumerate(prompts):
-            print(f"\n[INFO] Processing prompt {idx + 1}/{len(prompts)}")
+            # Start a new conversation for every prompt after this window's first one
+            if not first:
+                human_think_time(0.7, 1.0)
+                click_new_conversation(page)
+                human_think_time(0.5, 1.0)
+            first = False
 
-            # Retry up to 3 times if status is not "ok"
-            max_retries = 3
+            print(f"\n[INFO] Processing prompt {idx + 1}/{task.total} of '{task.name}'")
             item: Dict[str, Optional[str]] = {}
-            for attempt in range(1, max_retries + 1):
-                try:
-                    item = send_prompt_and_collect(
-                        page, prompt_text=prompt, website_name="KIMI"
-                    )
-                except Exception as e:
-                    url = page.url
-                    print(
-                        f"[ERROR] Failed to process prompt (attempt {attempt}/{max_retries}): {e}"
-                    )
-                    item = {
-                        "website_name": "KIMI",
-                        "conversation_id": get_conversation_id_from_url(url),
-                        "item_url": url,
-                        "session_user": "",
-                        "model_name": "",
-                        "mode_online": "True",
-                        "prompt_text": prompt,
-                        "response_text": "",
-                        "response_citations": [],
-                        "response_language": "",
-                        "latency_ms": 0,
-                        "status": "error",
-                        "error_message": str(e),
-                        "message_id": "",
-                        "parent_message_id": "",
-                        "tokens_prompt": "",
-                        "tokens_completion": "",
-                        "tokens_total": "",
-                    }
-
-                status = item.get("status", "ok")
-                if status == "ok":
-                    break
+            try:
+                item = collect_with_retries(page, prompt)
+            finally:
+                # Always report back so the writer knows this prompt is finished
+                self.results.put((task, idx, item))
+
+        # Save session state at the end
+        if worker_id == 0:
+            save_cookies_from_context(page, SESSION_COOKIES_FILE)
+            save_storage_to_file(page, SESSION_STORAGE_FILE)
+
+
+class KimiTask:
+    """One input file: its pending prompts and output files."""
+
+    def __init__(
+        self, name: str, prompts: List[str], output_ndjson: str, output_md: str
+    ) -> None:
+        self.name = name
+        self.prompts = prompts
+        self.total = len(prompts)
+        self.pending = self.total
+        self.processed = 0
+        self.output_ndjson = output_ndjson
+        self.output_md = output_md
+        self.ndjson_out: Optional[OutputWriter] = None
+        self.md_out: Optional[OutputWriter] = None
+
+    def save(self, item: Dict) -> None:
+        """Append one result; the output files are opened on the first one."""
+        if self.ndjson_out is None:
+            self.ndjson_out = OutputWriter(self.output_ndjson)
+            self.md_out = OutputWriter(self.output_md)
+        write_outputs(self.ndjson_out, self.md_out, [item])
+        self.processed += 1
+
+    def close(self) -> None:
+        for out in (self.ndjson_out, self.md_out):
+            if out is not None:
+                out.close()
+
+
+def process_tasks(pool: KimiWorkerPool, tasks: List[KimiTask]) -> None:
+    """
+    Run the prompts of all tasks on the shared Kimi windows. Everything is
+    queued at once, so windows that finish the tail of one task go straight
+    on to the next one instead of idling until its last prompt is done. The
+    calling thread is the only writer of the output files.
+    """
+    total = sum(t.total for t in tasks)
+    if not total:
+        return
+    pool.start(total)
+    for task in tasks:
+        for idx, prompt in enumerate(task.prompts):
+            pool.jobs.put((task, idx, prompt))
 
-                if attempt < max_retries:
-                    print(
-                        f"[WARN] Prompt failed with status '{status}', retrying after short delay..."
-                    )
-                    human_think_time(1.0, 2.5)
+    pending = total
+    try:
+        while pending > 0:
+            try:
+                task, idx, item = pool.results.get(timeout=1.0)
+            except queue.Empty:
+                if not pool.alive():
+                    break
+                continue
+            pending -= 1
+            task.pending -= 1
 
             # Save only successful prompts (status == "ok")
             if item.get("status") != "ok":
                 print(
-                    f"[ERROR] Prompt failed after {max_retries} attempts, skipping save for this prompt."
+                    f"[ERROR] Prompt {idx + 1} of '{task.name}' failed after 3 attempts, skipping save for this prompt."
                 )
             else:
-                # Save immediately after each prompt (防止崩溃丢失数据)
-                print(f"[INFO] Saving result {idx + 1}/{len(prompts)}...")
-                write_outputs(output_ndjson, output_md, [item])
-                total_processed += 1
-                print(f"[INFO] ✓ Saved to {os.path.basename(output_ndjson)}")
-
-            # Start a new conversation for the next prompt (except after the last one)
-            if idx < len(prompts) - 1:
-                human_think_time(0.7, 1.0)
-                click_new_conversation(page)
-                human_think_time(0.5, 1.0)
-
-        # Save session state at the end
-        save_cookies_from_context(page, SESSION_COOKIES_FILE)
-        save_storage_to_file(page, SESSION_STORAGE_FILE)
-
-        print(f"\n{'='*60}")
-        print(f"[INFO] ✓ Task '{task_name}' completed!")
-        print(f"[INFO] Processed {total_processed} prompts")
-        print(f"[INFO] Results saved to:")
-        print(f"  - {output_ndjson}")
-        print(f"  - {output_md}")
-        print(f"{'='*60}\n")
+                # Save (and flush) immediately after each prompt (防止崩溃丢失数据)
+                print(f"[INFO] Saving result {idx + 1}/{task.total} of '{task.name}'...")
+                task.save(item)
+                print(f"[INFO] ✓ Saved to {os.path.basename(task.output_ndjson)}")
+
+            if task.pending == 0:
+                task.close()
+                print(f"\n{'='*60}")
+                print(f"[INFO] ✓ Task '{task.name}' completed!")
+                print(f"[INFO] Processed {task.processed} prompts")
+                print(f"[INFO] Results saved to:")
+                print(f"  - {task.output_ndjson}")
+                print(f"  - {task.output_md}")
+                print(f"{'='*60}\n")
+    finally:
+        for task in tasks:
+            task.close()
+
+    if pending > 0:
+        print("[ERROR] All Kimi browser windows have stopped, aborting")
 
 
 if __name__ == "__main__":
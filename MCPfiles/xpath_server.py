@@ -4,6 +4,7 @@ from camoufox.async_api import AsyncCamoufox
 import time
 import os
 import json
+import mmap
 import re
 
 mcp = FastMCP("Scrapy XPath Generator")
@@ -74,24 +75,37 @@ def write_camoufox_scraper(template: str, url: str, html_file_path: str) -> dict
     }
 
 
-@mcp.tool()
-def strip_css(html_input_file: str, html_output_file: str):
-    # Read the HTML file
-    with open(html_input_file, "r", encoding="utf-8") as file:
-        html_content = file.read()
-
-    # Remove style tags and their content
-    html_content = re.sub(r"<style[^>]*>.*?</style>", "", html_content, flags=re.DOTALL)
-
-    # Remove CSS emotion attributes
-    html_content = re.sub(r'data-emotion="css[^"]*"', "", html_content)
+# <style> blocks, emotion attributes and css-* class attributes, removed in one pass
+_CSS_STRIP_RE = re.compile(
+    rb'<style[^>]*>.*?</style>|data-emotion="css[^"]*"|class="css-[^"]*"', re.DOTALL
+)
 
-    # Remove class attributes with CSS references
-    html_content = re.sub(r'class="css-[^"]*"', "", html_content)
 
-    # Write the cleaned HTML to a new file
-    with open(html_output_file, "w", encoding="utf-8") as file:
-        file.write(html_content)
+@mcp.tool()
+def strip_css(html_input_file: str, html_output_file: str):
+    # Map the HTML file instead of reading it, and copy only the text between
+    # matches to the output, so large dumps are never held in memory (twice).
+    # The output goes to a temp file that replaces html_output_file at the
+    # end, so stripping a file in place never truncates the mapped input.
+    tmp_output_file = html_output_file + ".tmp"
+    try:
+        with open(html_input_file, "rb") as src, open(
+            tmp_output_file, "wb", buffering=1 << 20
+        ) as dst:
+            # mmap cannot map an empty file; there is nothing to copy then
+            if os.fstat(src.fileno()).st_size:
+                with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as html_content:
+                    # Remove style tags, CSS emotion attributes and css-* class attributes
+                    pos = 0
+                    for m in _CSS_STRIP_RE.finditer(html_content):
+                        dst.write(html_content[pos : m.start()])
+                        pos = m.end()
+                    dst.write(html_content[pos:])
+        os.replace(tmp_output_file, html_output_file)
+    except BaseException:
+        if os.path.exists(tmp_output_file):
+            os.remove(tmp_output_file)
+        raise
 
     return {f"CSS stripped successfully. New file created: {html_output_file}"}
 
@@ -1,8 +1,14 @@
 import json
 from pathlib import Path
 
+try:
+    import orjson  # optional: faster JSONL parsing
+except ImportError:
+    orjson = None
+
 
 ROOT = Path(__file__).resolve().parent
+_loads = orjson.loads if orjson is not None else json.loads
 
 
 def extract_sentences(src_name: str, dest_name: str) -> None:
@@ -10,15 +16,17 @@ def extract_sentences(src_name: str, dest_name: str) -> None:
     dest_path = ROOT / dest_name
 
     sentences = []
-    with src_path.open("r", encoding="utf-8") as f:
+    append = sentences.append
+    # Binary lines go straight to the parser (both accept UTF-8 bytes)
+    with src_path.open("rb") as f:
         for line in f:
             line = line.strip()
             if not line:
                 continue
-            obj = json.loads(line)
-            sentences.append(obj.get("sentence", ""))
+            append(_loads(line).get("sentence", ""))
 
-    dest_path.write_text("\n".join(sentences), encoding="utf-8")
+    # One encode + one write for the whole file
+    dest_path.write_bytes("\n".join(sentences).encode("utf-8"))
 
 
 def main() -> None:
@@ -0,0 +1,38 @@
+import importlib.util
+import os
+
+import pytest
+
+# The scraper imports the browser stack at module level
+for _dep in ("camoufox", "playwright"):
+    pytest.importorskip(_dep)
+
+_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "MCPfiles", "deepseek_chat_scraper.py"
+)
+_spec = importlib.util.spec_from_file_location("deepseek_chat_scraper", _PATH)
+deepseek = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(deepseek)
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_malformed_lines_do_not_abort_loading(tmp_path, monkeypatch, use_orjson):
+    if not use_orjson:
+        # orjson is optional; the stdlib decoder accepts lone surrogate escapes
+        monkeypatch.setattr(deepseek, "orjson", None)
+    ndjson = tmp_path / "deepseek_conversations_test.ndjson"
+    ndjson.write_bytes(
+        b'{"prompt_text": "ok prompt", "status": "ok"}\n'
+        # lone surrogate escape: cannot be fingerprinted
+        b'{"prompt_text": "a\\ud800", "status": "ok"}\n'
+        # non-str prompt_text
+        b'{"prompt_text": 42, "status": "ok"}\n'
+        b'{"prompt_text": "failed", "status": "error"}\n'
+        b"{not json\n"
+    )
+
+    processed = deepseek.load_processed_prompts(str(ndjson))
+
+    assert processed == {deepseek.prompt_fingerprint("ok prompt")}
+    assert b'"status": "error"' not in ndjson.read_bytes()
+    assert b"{not json" not in ndjson.read_bytes()
@@ -0,0 +1,40 @@
+import importlib.util
+import os
+
+import pytest
+
+# The scraper imports the browser stack at module level
+for _dep in ("camoufox", "playwright", "scrapy", "screeninfo"):
+    pytest.importorskip(_dep)
+
+_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "MCPfiles", "kimi_moonshot_chat_scraper.py"
+)
+_spec = importlib.util.spec_from_file_location("kimi_moonshot_chat_scraper", _PATH)
+kimi = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(kimi)
+
+
+def test_malformed_lines_do_not_abort_loading(tmp_path):
+    ndjson = tmp_path / "kimi_conversations_test.ndjson"
+    ndjson.write_bytes(
+        b'{"prompt_text": "ok prompt", "status": "ok"}\n'
+        # lone surrogate escape: decodes, but cannot be fingerprinted
+        b'{"prompt_text": "a\\ud800", "status": "ok"}\n'
+        # invalid UTF-8 in the status / prompt fields
+        b'{"prompt_text": "b", "status": "\xff"}\n'
+        b'{"prompt_text": "\xfe", "status": "ok"}\n'
+        b'{"prompt_text": "failed", "status": "error"}\n'
+        b"{not json\n"
+        # last record torn by a crash mid-write, right after its status field
+        b'{"prompt_text": "torn", "status": "ok"'
+    )
+
+    processed = kimi.load_processed_prompts(str(ndjson))
+
+    assert processed == {kimi.prompt_fingerprint("ok prompt")}
+    # Only the status == "ok" records survive the rewrite, verbatim
+    assert ndjson.read_bytes() == (
+        b'{"prompt_text": "ok prompt", "status": "ok"}\n'
+        b'{"prompt_text": "a\\ud800", "status": "ok"}\n'
+    )